@@ -0,0 +1,3 @@
+from Photometer.cli import main
+
+main()
@@ -0,0 +1,361 @@
+""" Benchmark of the host analysis pipeline on synthetic runs, results written as JSON.
+
+Every case (channels x intensities x repeats x days) gets a synthetic result file, then each stage is timed
+over several rounds with its peak Python heap allocation (tracemalloc, includes numpy/pandas buffers).
+Start up of the command line (see Photometer.cli) is timed in fresh interpreters, so import cost is included.
+The redraw stage appends one cycle of rows per call to a copy of the run and brings the plotted levels up to date,
+as the figure command does while watching a file; its duration should not grow with the length of the run.
+Results of different commits can be compared to track regressions and gains of the processing path.
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from importlib import metadata
+
+from Photometer.constants import (
+    PWM_DUTY_CYCLES,
+    MEASUREMENT_REPEATS,
+)
+from Photometer.files import atomic_write
+from Photometer.synthetic import (
+    write_synthetic_run,
+    synthetic_duty_cycles,
+)
+
+# 2: start up of the command line, 3: redraw of a growing run
+BENCHMARK_VERSION = 3
+ROUNDS = 3
+STAGES = ['parse', 'process', 'render', 'redraw']
+# Command line invocations timed from start to exit, {csv} is replaced by a small synthetic run
+STARTUP_COMMANDS = {
+    'help': ['--help'],
+    'status': ['status', '-i', '{csv}'],
+    'figure_help': ['figure', '--help'],
+}
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(
+        function,
+        rounds: int = ROUNDS,
+) -> dict:
+    """ Time a function over several rounds, then track its peak memory allocation in one more call
+
+    :param function: callable without arguments
+    :param rounds: number of timed calls
+    :return: dictionary with all durations, their minimum and median in seconds and the peak allocation in bytes
+    """
+
+    durations = []
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    # Separate traced call, tracing slows down allocation heavy code considerably
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'seconds': durations,
+        'min_seconds': min(durations),
+        'median_seconds': statistics.median(durations),
+        'peak_bytes': peak,
+    }
+
+
+def growing_run(
+        csv_file_path: str,
+        growing_file_path: str,
+        cycle_rows: int,
+        cycles: int,
+):
+    """ Redraw of a run still being written, one cycle of rows appended per call
+
+    :param csv_file_path: path of the complete .csv result file
+    :param growing_file_path: path to write the growing copy to, holding all but the last cycles at first
+    :param cycle_rows: number of rows per measurement cycle
+    :param cycles: number of calls the returned function supports
+    :return: callable without arguments appending the next cycle, then updating and selecting the plotted levels
+    """
+
+    from Photometer.chunked import LiveProcessor
+    from Photometer.processing import MEDIAN
+    from Photometer.pyramid import SeriesPyramid
+
+    with open(csv_file_path) as f:
+        lines = f.readlines()
+    first_row = next(index for index, line in enumerate(lines) if not line.startswith('#'))
+    held_back = min(cycles * cycle_rows, len(lines) - first_row - 1)
+    with open(growing_file_path, 'w') as f:
+        f.writelines(lines[:len(lines) - held_back])
+    appended = iter(range(len(lines) - held_back, len(lines), cycle_rows))
+    live = LiveProcessor(growing_file_path)
+    pyramid = SeriesPyramid()
+
+    def redraw() -> None:
+        start = next(appended, None)
+        if start is not None:
+            with open(growing_file_path, 'a') as f:
+                f.writelines(lines[start:start + cycle_rows])
+        df_final, df_tail, restarted = live.update()
+        if restarted:
+            pyramid.reset()
+        pyramid.extend(df_final, column=MEDIAN, tail=df_tail)
+        pyramid.select()
+
+    # Everything but the appended cycles is read once up front, as the first draw of a watched file
+    redraw()
+    return redraw
+
+
+def benchmark_case(
+        directory: str,
+        channels: int,
+        intensities: int,
+        measurement_repeats: int,
+        days: float,
+        stages: list[str],
+        rounds: int = ROUNDS,
+) -> dict:
+    """ Generate one synthetic run and time the selected stages on it
+
+    :param directory: directory for the synthetic file and rendered image
+    :param channels: number of LED / photoresistor pairs
+    :param intensities: number of LED duty powers including the dark measurement
+    :param measurement_repeats: number of repeat readings per row
+    :param days: length of the run in days
+    :param stages: stages to time, see STAGES
+    :param rounds: number of timed calls per stage
+    :return: dictionary describing the case and its stage results
+    """
+
+    # Imported here so generating data does not count towards the import time of the stages
+    from Photometer.processing import read_measurements, process_measurements
+
+    pwm_duty_cycles = synthetic_duty_cycles(intensities)
+    csv_file_path = os.path.join(directory, f"{channels}ch_{intensities}int_{measurement_repeats}rep_{days}d.csv")
+    rows = write_synthetic_run(
+        csv_file_path,
+        channels=channels,
+        pwm_duty_cycles=pwm_duty_cycles,
+        measurement_repeats=measurement_repeats,
+        days=days,
+    )
+    df = read_measurements(csv_file_path)
+
+    functions = {
+        'parse': lambda: read_measurements(csv_file_path),
+        'process': lambda: process_measurements(df),
+    }
+    if 'render' in stages:
+        # make_figure lives in the top level script; it parses and processes as well, so render includes both
+        from create_figure import make_figure
+        image_file_path = os.path.join(directory, 'img.png')
+        functions['render'] = lambda: make_figure(csv_file_path, image_file_path=image_file_path)
+    if 'redraw' in stages:
+        # One call per round plus the traced one, each with a new cycle
+        functions['redraw'] = growing_run(
+            csv_file_path,
+            os.path.join(directory, 'growing.csv'),
+            cycle_rows=channels * intensities,
+            cycles=rounds + 2,
+        )
+
+    results = {}
+    for stage in stages:
+        results[stage] = measure(functions[stage], rounds=rounds)
+        print(f"{os.path.basename(csv_file_path)} {stage}: {results[stage]['min_seconds']:.3f} s, "
+              f"{results[stage]['peak_bytes'] / 2 ** 20:.1f} MiB")
+    return {
+        'channels': channels,
+        'intensities': intensities,
+        'repeats': measurement_repeats,
+        'days': days,
+        'rows': rows,
+        'file_bytes': os.path.getsize(csv_file_path),
+        'stages': results,
+    }
+
+
+def benchmark_startup(
+        directory: str,
+        rounds: int = ROUNDS,
+) -> dict:
+    """ Time command line invocations in fresh interpreters, from start to exit
+
+    :param directory: directory for the synthetic file the commands run on
+    :param rounds: number of timed invocations per command
+    :return: dictionary of command name to durations, their minimum and median in seconds
+    """
+
+    csv_file_path = os.path.join(directory, 'startup.csv')
+    write_synthetic_run(csv_file_path, days=1)
+    results = {}
+    for name, arguments in STARTUP_COMMANDS.items():
+        command = [sys.executable, '-m', 'Photometer'] + [a.format(csv=csv_file_path) for a in arguments]
+        durations = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=REPOSITORY_DIRECTORY, stdout=subprocess.DEVNULL, check=True)
+            durations.append(time.perf_counter() - start)
+        results[name] = {
+            'seconds': durations,
+            'min_seconds': min(durations),
+            'median_seconds': statistics.median(durations),
+        }
+        print(f"startup {name}: {results[name]['min_seconds']:.3f} s")
+    return results
+
+
+def environment() -> dict:
+    """ Describe the machine and package versions the benchmark ran with
+
+    :return: dictionary
+    """
+
+    packages = {}
+    for package in ['numpy', 'pandas', 'scipy', 'matplotlib']:
+        try:
+            packages[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            packages[package] = None
+    return {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'packages': packages,
+    }
+
+
+def run_benchmarks(
+        channels: list[int],
+        intensities: list[int],
+        repeats: list[int],
+        days: list[float],
+        stages: list[str] | None = None,
+        rounds: int = ROUNDS,
+        startup: bool = True,
+) -> dict:
+    """ Benchmark every combination of the given case parameters
+
+    # Example usage:
+    results = run_benchmarks(channels=[8], intensities=[5], repeats=[11], days=[1, 7, 30])
+
+    :param channels: numbers of LED / photoresistor pairs
+    :param intensities: numbers of LED duty powers including the dark measurement
+    :param repeats: numbers of repeat readings per row
+    :param days: run lengths in days
+    :param stages: stages to time, defaults to STAGES
+    :param rounds: number of timed calls per stage
+    :param startup: also time the start up of the command line
+    :return: dictionary ready to be written as JSON
+    """
+
+    stages = STAGES if stages is None else stages
+    with tempfile.TemporaryDirectory() as directory:
+        startup_results = benchmark_startup(directory, rounds=rounds) if startup else None
+        cases = [
+            benchmark_case(directory, *case, stages=stages, rounds=rounds)
+            for case in itertools.product(channels, intensities, repeats, days)
+        ]
+    return {
+        'version': BENCHMARK_VERSION,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'rounds': rounds,
+        'startup': startup_results,
+        # Maximum resident set size of the whole benchmark process (kB on Linux)
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'cases': cases,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic runs")
+    parser.add_argument(
+        "--channels", "-c",
+        type=int,
+        nargs='+',
+        help="Numbers of LED / photoresistor pairs, defaults to 8",
+        default=[8],
+    )
+    parser.add_argument(
+        "--intensities", "-n",
+        type=int,
+        nargs='+',
+        help=f"Numbers of LED duty powers including the dark measurement, defaults to {len(PWM_DUTY_CYCLES)}",
+        default=[len(PWM_DUTY_CYCLES)],
+    )
+    parser.add_argument(
+        "--repeats", "-r",
+        type=int,
+        nargs='+',
+        help=f"Numbers of repeat readings per row, defaults to {MEASUREMENT_REPEATS}",
+        default=[MEASUREMENT_REPEATS],
+    )
+    parser.add_argument(
+        "--days", "-d",
+        type=float,
+        nargs='+',
+        help="Run lengths in days, defaults to 1 7 30",
+        default=[1, 7, 30],
+    )
+    parser.add_argument(
+        "--stages", "-s",
+        nargs='+',
+        choices=STAGES,
+        help="Stages to time, defaults to all",
+        default=STAGES,
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        help=f"Number of timed calls per stage, defaults to {ROUNDS}",
+        default=ROUNDS,
+    )
+    parser.add_argument(
+        "--skip_startup",
+        action='store_true',
+        help="Don't time the start up of the command line",
+    )
+    parser.add_argument(
+        "--output", "-o",
+        help="Output .json file path, printed only if not given",
+        default=None,
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        channels=args.channels,
+        intensities=args.intensities,
+        repeats=args.repeats,
+        days=args.days,
+        stages=args.stages,
+        rounds=args.rounds,
+        startup=not args.skip_startup,
+    )
+    if args.output is not None:
+        with atomic_write(args.output) as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+""" Calibration of photometer readings against reference OD measurements (e.g. OD600 from a plate reader).
+
+Each channel and LED intensity gets its own linear model in the absorbance domain:
+    OD = intercept + slope * -log10(transmitted light)
+Transmitted light is the filtered, flipped repeat median relative to the dark measurement of the same cycle.
+Offsets such as the early low value or a blank are part of the intercept, so no baseline has to be subtracted.
+"""
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    SEPERATOR,
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.files import atomic_write
+from Photometer.processing import (
+    run_duty_cycles,
+    read_measurements,
+    add_repeat_median,
+    add_dark_reference,
+    add_cycle,
+    epoch_seconds,
+    smooth_series,
+    convert_to_hours,
+    MEDIAN,
+    FULLY_DARK,
+    CYCLE,
+    MEDIAN_WINDOW,
+)
+
+# Column names added during calibration
+SIGNAL = 'signal'
+REFERENCE_OD = 'reference_od'
+CALIBRATED_OD = 'od'
+OD_WEIGHT = 'od_weight'
+OD_STD = 'od_std'
+
+# Model parameters
+INTERCEPT = 'intercept'
+SLOPE = 'slope'
+RESIDUAL_STD = 'residual_std'
+SIGNAL_MIN = 'signal_min'
+SIGNAL_MAX = 'signal_max'
+POINTS = 'points'
+MODEL_COLUMNS = [INTERCEPT, SLOPE, RESIDUAL_STD, SIGNAL_MIN, SIGNAL_MAX, POINTS]
+
+CALIBRATION_VERSION = 1
+# Fewer paired points than this do not give a usable model, two points fit exactly and leave no residual
+MIN_POINTS = 3
+# Transmitted light is clipped to this to keep the logarithm finite
+MIN_TRANSMISSION = 1e-4
+# Fraction of the calibrated signal range a model may be extrapolated by
+EXTRAPOLATION = .1
+# Lower bound for the residual standard deviation, keeps single near perfect fits from taking all weight
+MIN_RESIDUAL_STD = .005
+
+
+def read_reference(
+        file_path: str,
+) -> pd.DataFrame:
+    """ Read tab separated reference OD values
+
+    The first column holds the date in the form YYYYMMDD HH:MM, the header of each other column is the
+    channel number (GPIO number of the LED anode) the values belong to.
+
+    # Example file:
+    DATE	1	2	3
+    20241030 16:18	0.01	0.01	0.02
+    20241031 10:03	0.02	0.005	0.03
+
+    :param file_path: path of the reference file
+    :return: Pandas data frame with DATE and one column per channel
+    """
+
+    df = pd.read_csv(
+        file_path,
+        sep=SEPERATOR,
+        header=0,
+        date_format='%Y%m%d %H:%M',
+        parse_dates=[0],
+    )
+    df.columns = [DATE] + [int(c) for c in df.columns[1:]]
+    return df
+
+
+def add_signal(
+        df: pd.DataFrame,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+) -> pd.DataFrame:
+    """ Add the absorbance signal -log10(transmitted light) for every non dark row, in place
+
+    :param df: Pandas data frame as returned by read_measurements
+    :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+        defaults to those of the run profile
+    :param median_window: size of the median filter
+    :return: the same data frame
+    """
+
+    pwm_duty_cycles = run_duty_cycles(df, pwm_duty_cycles)
+    add_repeat_median(df)
+    add_dark_reference(df, dark_intensity=pwm_duty_cycles[0])
+    smooth_series(df, intensities=pwm_duty_cycles[1:], median_window=median_window)
+    # Flipped values grow towards the dark value as less light reaches the photoresistor
+    transmission = ((df[FULLY_DARK] - df[MEDIAN]) / df[FULLY_DARK]).clip(lower=MIN_TRANSMISSION)
+    df[SIGNAL] = (-np.log10(transmission)).where(df[INTENSITY].isin(pwm_duty_cycles[1:]))
+    return df
+
+
+def pair_reference(
+        df: pd.DataFrame,
+        df_reference: pd.DataFrame,
+) -> pd.DataFrame:
+    """ Interpolate the signal of each channel / intensity series at the reference time points
+
+    Reference points outside of the measured time span of a series are dropped.
+
+    :param df: Pandas data frame with absolute dates and SIGNAL
+    :param df_reference: Pandas data frame as returned by read_reference
+    :return: Pandas data frame with CHANNEL, INTENSITY, SIGNAL and REFERENCE_OD, one row per pair
+    """
+
+    reference = df_reference.melt(id_vars=[DATE], var_name=CHANNEL, value_name=REFERENCE_OD).dropna()
+    reference_seconds = epoch_seconds(reference[DATE])
+    pairs = []
+    for (ch, intensity), series in df.loc[df[SIGNAL].notna()].groupby([CHANNEL, INTENSITY]):
+        selected = (reference[CHANNEL] == ch).to_numpy()
+        if not selected.any():
+            continue
+        seconds = epoch_seconds(series[DATE])
+        at = reference_seconds[selected]
+        inside = (at >= seconds.min()) & (at <= seconds.max())
+        pairs.append(pd.DataFrame({
+            CHANNEL: ch,
+            INTENSITY: intensity,
+            SIGNAL: np.interp(at[inside], seconds, series[SIGNAL].to_numpy()),
+            REFERENCE_OD: reference.loc[selected, REFERENCE_OD].to_numpy()[inside],
+        }))
+    if not pairs:
+        return pd.DataFrame(columns=[CHANNEL, INTENSITY, SIGNAL, REFERENCE_OD])
+    return pd.concat(pairs, ignore_index=True)
+
+
+def fit_calibration(
+        pairs: pd.DataFrame,
+        min_points: int = MIN_POINTS,
+) -> pd.DataFrame:
+    """ Least squares fit of REFERENCE_OD against SIGNAL for every channel / intensity at once
+
+    :param pairs: Pandas data frame as returned by pair_reference
+    :param min_points: channel / intensity combinations with fewer pairs get no model, at least MIN_POINTS
+    :return: Pandas data frame of model parameters indexed by (channel, intensity)
+    """
+
+    if min_points < MIN_POINTS:
+        raise ValueError(f"At least {MIN_POINTS} points per model are needed to estimate its residual: {min_points}")
+    keys = [CHANNEL, INTENSITY]
+    x = pairs[SIGNAL]
+    y = pairs[REFERENCE_OD]
+    sums = pd.DataFrame({
+        'n': 1, 'x': x, 'y': y, 'xx': x * x, 'xy': x * y, **{k: pairs[k] for k in keys},
+    }).groupby(keys).sum()
+    n = sums['n']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sums['xy'] - sums['x'] * sums['y']) / (n * sums['xx'] - sums['x'] ** 2)
+    intercept = (sums['y'] - slope * sums['x']) / n
+
+    residuals = y - (intercept.reindex(pd.MultiIndex.from_frame(pairs[keys])).to_numpy() +
+                     slope.reindex(pd.MultiIndex.from_frame(pairs[keys])).to_numpy() * x)
+    squared = (residuals ** 2).groupby([pairs[k] for k in keys]).sum()
+    grouped_signal = x.groupby([pairs[k] for k in keys])
+
+    models = pd.DataFrame({
+        INTERCEPT: intercept,
+        SLOPE: slope,
+        RESIDUAL_STD: np.sqrt(squared / (n - 2)).clip(lower=MIN_RESIDUAL_STD),
+        SIGNAL_MIN: grouped_signal.min(),
+        SIGNAL_MAX: grouped_signal.max(),
+        POINTS: n,
+    })
+    return models.loc[(models[POINTS] >= min_points) & np.isfinite(models[SLOPE]), MODEL_COLUMNS]
+
+
+def save_calibration(
+        models: pd.DataFrame,
+        file_path: str,
+) -> None:
+    """ Store fitted models as JSON
+
+    :param models: Pandas data frame as returned by fit_calibration
+    :param file_path: path of the .json file
+    :return: None
+    """
+
+    content = {
+        'version': CALIBRATION_VERSION,
+        'model': 'OD = intercept + slope * -log10(transmission)',
+        'models': [
+            {
+                CHANNEL: int(ch),
+                INTENSITY: int(intensity),
+                **{k: float(v) for k, v in row.items()},
+                POINTS: int(row[POINTS]),
+            }
+            for (ch, intensity), row in models.iterrows()
+        ],
+    }
+    with atomic_write(file_path) as f:
+        json.dump(content, f, indent=2)
+
+
+def load_calibration(
+        file_path: str,
+) -> pd.DataFrame:
+    """ Load models stored by save_calibration
+
+    :param file_path: path of the .json file
+    :return: Pandas data frame of model parameters indexed by (channel, intensity)
+    """
+
+    with open(file_path) as f:
+        content = json.load(f)
+    assert content.get('version') == CALIBRATION_VERSION, \
+        f"Unsupported calibration version: {content.get('version')}"
+    return pd.DataFrame(content['models']).set_index([CHANNEL, INTENSITY])[MODEL_COLUMNS]
+
+
+def apply_calibration(
+        df: pd.DataFrame,
+        models: pd.DataFrame,
+        extrapolation: float = EXTRAPOLATION,
+) -> pd.DataFrame:
+    """ Add calibrated OD and its inverse variance weight to every row with a model, in place
+
+    Rows whose signal lies further than extrapolation * calibrated range outside of the calibrated range
+    get no OD, the model is not trusted there.
+
+    :param df: Pandas data frame with SIGNAL
+    :param models: Pandas data frame as returned by fit_calibration or load_calibration
+    :param extrapolation: fraction of the calibrated signal range a model may be extrapolated by
+    :return: the same data frame
+    """
+
+    row_models = models.reindex(pd.MultiIndex.from_frame(df[[CHANNEL, INTENSITY]]))
+    signal = df[SIGNAL].to_numpy()
+    margin = (row_models[SIGNAL_MAX] - row_models[SIGNAL_MIN]).to_numpy() * extrapolation
+    inside = (signal >= row_models[SIGNAL_MIN].to_numpy() - margin) & \
+             (signal <= row_models[SIGNAL_MAX].to_numpy() + margin)
+    od = row_models[INTERCEPT].to_numpy() + row_models[SLOPE].to_numpy() * signal
+    df[CALIBRATED_OD] = np.where(inside, od, np.nan)
+    df[OD_WEIGHT] = np.where(inside, 1 / row_models[RESIDUAL_STD].to_numpy() ** 2, 0)
+    return df
+
+
+def calibrate_measurements(
+        df: pd.DataFrame,
+        models: pd.DataFrame,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+) -> pd.DataFrame:
+    """ Calibrated OD for every row of a run
+
+    # Example usage:
+    models = load_calibration('calibration.json')
+    df = calibrate_measurements(read_measurements('20241030-161800_output.csv'), models)
+    combine_intensities(df)
+
+    :param df: Pandas data frame as returned by read_measurements, left unchanged
+    :param models: Pandas data frame as returned by fit_calibration or load_calibration
+    :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+        defaults to those of the run profile
+    :param median_window: size of the median filter
+    :return: new Pandas data frame with date in hours, cycle numbers, SIGNAL, CALIBRATED_OD and OD_WEIGHT
+    """
+
+    df = df.copy()
+    add_signal(df, pwm_duty_cycles=pwm_duty_cycles, median_window=median_window)
+    add_cycle(df)
+    apply_calibration(df, models)
+    return convert_to_hours(df)
+
+
+def combine_intensities(
+        df: pd.DataFrame,
+        column: str = CALIBRATED_OD,
+        weight_column: str = OD_WEIGHT,
+        std_column: str = OD_STD,
+) -> pd.DataFrame:
+    """ Inverse variance weighted mean of the OD of all intensities, per channel and cycle
+
+    Also used by fusion.fuse_intensities, with the OD estimates and fusion weights of uncalibrated runs.
+
+    :param df: Pandas data frame as returned by calibrate_measurements
+    :param column: column holding the OD values
+    :param weight_column: column holding the inverse variance weights
+    :param std_column: name of the standard deviation column of the result
+    :return: Pandas data frame with CHANNEL, CYCLE, DATE (first row of the cycle), column and std_column
+    """
+
+    usable = df[column].notna() & (df[weight_column] > 0)
+    weight = df[weight_column].where(usable, 0)
+    sums = pd.DataFrame({
+        CHANNEL: df[CHANNEL],
+        CYCLE: df[CYCLE],
+        'weighted': (df[column] * weight).where(usable, 0),
+        'weight': weight,
+    }).groupby([CHANNEL, CYCLE], sort=False).sum()
+    weighted = sums['weight'] > 0
+    combined = pd.DataFrame({
+        DATE: df.groupby([CHANNEL, CYCLE], sort=False)[DATE].first(),
+        column: (sums['weighted'] / sums['weight']).where(weighted),
+        std_column: (1 / np.sqrt(sums['weight'])).where(weighted),
+    })
+    return combined.reset_index()
+
+
+def fit_from_files(
+        csv_file_paths: list[str],
+        reference_file_path: str,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+        min_points: int = MIN_POINTS,
+) -> pd.DataFrame:
+    """ Fit models from one or more runs measured alongside the same reference sheet
+
+    :param csv_file_paths: paths of .csv result files
+    :param reference_file_path: path of the reference file, see read_reference
+    :param pwm_duty_cycles: LED duty powers of the runs, first one is the dark measurement,
+        defaults to those of each run profile
+    :param median_window: size of the median filter
+    :param min_points: channel / intensity combinations with fewer pairs get no model
+    :return: Pandas data frame of model parameters indexed by (channel, intensity)
+    """
+
+    df_reference = read_reference(reference_file_path)
+    pairs = []
+    for csv_file_path in csv_file_paths:
+        df = read_measurements(csv_file_path)
+        if df is None:
+            print(f"Couldn't read {csv_file_path}, skipping")
+            continue
+        add_signal(df, pwm_duty_cycles=pwm_duty_cycles, median_window=median_window)
+        pairs.append(pair_reference(df, df_reference))
+    assert pairs, "No readable result files given"
+    return fit_calibration(pd.concat(pairs, ignore_index=True), min_points=min_points)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Fit per channel and intensity OD calibration models")
+    parser.add_argument(
+        "--input", "-i",
+        nargs='+',
+        help="input filename(s), measured alongside the reference values",
+        required=True,
+    )
+    parser.add_argument(
+        "--odreader", "-od",
+        help="file path for tab seperated sheet of true values",
+        required=True,
+    )
+    parser.add_argument(
+        "--output", "-o",
+        help="Output .json file path for the fitted models",
+        required=True,
+    )
+    parser.add_argument(
+        "--min_points", "-m",
+        type=int,
+        help=f"Minimum number of reference points per model, defaults to {MIN_POINTS}",
+        default=MIN_POINTS,
+    )
+    args = parser.parse_args(argv)
+
+    models = fit_from_files(args.input, args.odreader, min_points=args.min_points)
+    print(models.to_string())
+    save_calibration(models, args.output)
+
+
+if __name__ == '__main__':
+    main()
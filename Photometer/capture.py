@@ -0,0 +1,296 @@
+""" Sample burst capture backends: the RP2040 ADC FIFO drained by DMA into a preallocated buffer, and a simulated
+equivalent so the same path runs off-device. Runs on the Pico (MicroPython) and on the host.
+
+While a capture runs the interpreter is free, samples are taken at a fixed rate set by the ADC clock divider
+instead of as fast as a Python loop goes.
+
+# Example usage:
+capture = make_capture(CAPTURE_DMA, adc_pin=26)
+samples = capture.fit_window(50000)
+capture.start(samples)
+...  # Python does other work
+mean = capture.mean_u16()
+"""
+
+import time
+from array import array
+
+from Photometer.constants import PIN_ADC0
+from Photometer.timing import (
+    ticks_us,
+    ticks_diff,
+)
+
+# Backends, see make_capture
+CAPTURE_READ = 'read'
+CAPTURE_DMA = 'dma'
+CAPTURE_SIMULATED = 'simulated'
+
+# Samples per second of a capture, the ADC converts at most 500 k per second
+CAPTURE_RATE = 100000
+# Size of the preallocated buffer, longest capture; 81.92 ms at CAPTURE_RATE, longer windows are sampled slower
+CAPTURE_MAX_SAMPLES = 8192
+# Seconds between checks whether a capture is done
+CAPTURE_POLL_SECONDS = .001
+
+# RP2040 registers, see the RP2040 datasheet chapters 4.9 (ADC) and 2.5 (DMA)
+ADC_BASE = 0x4004C000
+ADC_CS = ADC_BASE + 0x00
+ADC_FCS = ADC_BASE + 0x08
+ADC_FIFO = ADC_BASE + 0x0C
+ADC_DIV = ADC_BASE + 0x10
+ADC_CS_EN = 1 << 0
+ADC_CS_START_MANY = 1 << 3
+ADC_CS_AINSEL_SHIFT = 12
+ADC_FCS_EN = 1 << 0
+ADC_FCS_DREQ_EN = 1 << 3
+ADC_FCS_EMPTY = 1 << 8
+ADC_FCS_UNDER = 1 << 10
+ADC_FCS_OVER = 1 << 11
+ADC_FCS_THRESH_SHIFT = 24
+ADC_CLOCK = 48000000
+# DMA transfer request of the ADC FIFO
+DREQ_ADC = 36
+
+
+def capture_plan(
+        window_us: int,
+        rate: int = CAPTURE_RATE,
+        max_samples: int = CAPTURE_MAX_SAMPLES,
+) -> (int, int):
+    """ Sample rate and number of samples spanning an integration window
+
+    Windows that don't fit max_samples at rate are sampled at the lower rate that fills the buffer, so the capture
+    still spans the whole window instead of being cut short. Rates are whole ADC clock divisions.
+
+    :param window_us: integration window in microseconds
+    :param rate: highest samples per second
+    :param max_samples: size of the buffer
+    :return: samples per second, number of samples
+    """
+
+    # ADC clock cycles per sample, rounded up so the window fits
+    cycles = max(ADC_CLOCK // rate, -(-ADC_CLOCK * window_us // (1000000 * max_samples)))
+    return ADC_CLOCK // cycles, max(ADC_CLOCK * window_us // (1000000 * cycles), 1)
+
+
+def _check_samples(samples: int, buffer) -> None:
+    if samples > len(buffer):
+        raise ValueError(f"Capture of {samples} samples doesn't fit the buffer of {len(buffer)}, see fit_window")
+
+
+def mean_u16(samples) -> int:
+    """ Mean of 12 bit ADC samples, scaled the way ADC.read_u16 scales a single sample
+
+    :param samples: buffer of 12 bit samples
+    :return: 16 bit mean
+    """
+
+    total = sum(samples)
+    # read_u16 returns (raw << 4) | (raw >> 8), the same as raw * 16 + raw // 256 for 12 bit values
+    return (total * 16 + total // 256) // max(len(samples), 1)
+
+
+class DMACapture:
+    """ Capture bursts of ADC samples through the ADC FIFO and a DMA channel into a preallocated buffer
+
+    Needs the rp2 module of MicroPython on an RP2040.
+    """
+
+    def __init__(
+            self,
+            adc_pin: int = PIN_ADC0,
+            rate: int = CAPTURE_RATE,
+            max_samples: int = CAPTURE_MAX_SAMPLES,
+    ):
+        """ Initialize DMACapture.
+
+        :param adc_pin: GPIO number of the ADC input, 26 to 29
+        :param rate: samples per second
+        :param max_samples: size of the preallocated buffer
+        """
+
+        # Only available on the Pico
+        import rp2
+        from machine import mem32
+
+        self.mem32 = mem32
+        self.max_rate = rate
+        self.rate = rate
+        self.buffer = array('H', bytes(2 * max_samples))
+        self.samples = 0
+        self.dma = rp2.DMA()
+        # 16 bit transfers from the fixed FIFO address into consecutive buffer entries, paced by the ADC
+        self.ctrl = self.dma.pack_ctrl(size=1, inc_read=False, inc_write=True, treq_sel=DREQ_ADC)
+        self.ainsel = adc_pin - PIN_ADC0
+
+    def fit_window(self, window_us: int) -> int:
+        """ Set the sample rate for captures spanning an integration window, see capture_plan
+
+        :param window_us: integration window in microseconds
+        :return: number of samples to capture
+        """
+
+        self.rate, samples = capture_plan(window_us, rate=self.max_rate, max_samples=len(self.buffer))
+        return samples
+
+    def start(self, samples: int) -> None:
+        """ Start capturing, returns right away
+
+        :param samples: number of samples, at most the buffer size
+        :return: None
+        """
+
+        _check_samples(samples, self.buffer)
+        mem32 = self.mem32
+        self.samples = samples
+        mem32[ADC_CS] = ADC_CS_EN | (self.ainsel << ADC_CS_AINSEL_SHIFT)
+        # FIFO raises a DMA request for every sample, clear over / underflow flags and leftover samples
+        mem32[ADC_FCS] = ADC_FCS_EN | ADC_FCS_DREQ_EN | (1 << ADC_FCS_THRESH_SHIFT) | ADC_FCS_OVER | ADC_FCS_UNDER
+        while not mem32[ADC_FCS] & ADC_FCS_EMPTY:
+            mem32[ADC_FIFO]
+        # One conversion every DIV + 1 ADC clock cycles
+        mem32[ADC_DIV] = (max(ADC_CLOCK // self.rate - 1, 96) & 0xFFFF) << 8
+        self.dma.config(read=ADC_FIFO, write=self.buffer, count=self.samples, ctrl=self.ctrl, trigger=True)
+        mem32[ADC_CS] |= ADC_CS_START_MANY
+
+    def done(self) -> bool:
+        """ Whether the capture is complete
+
+        :return: True once all samples are in the buffer
+        """
+
+        return not self.dma.active()
+
+    def wait(self) -> memoryview:
+        """ Wait for the capture to complete, then stop the ADC free running
+
+        :return: view of the captured 12 bit samples
+        """
+
+        while not self.done():
+            time.sleep(CAPTURE_POLL_SECONDS)
+        mem32 = self.mem32
+        mem32[ADC_CS] &= ~ADC_CS_START_MANY
+        # Back to single conversions for ADC.read_u16
+        mem32[ADC_FCS] = 0
+        mem32[ADC_DIV] = 0
+        return memoryview(self.buffer)[:self.samples]
+
+    def mean_u16(self) -> int:
+        """ Wait for the capture and average it
+
+        :return: 16 bit mean of the samples
+        """
+
+        return mean_u16(self.wait())
+
+
+class SimulatedCapture:
+    """ Capture with the interface and timing of DMACapture, samples taken from a read_u16 function
+
+    # Example usage:
+    capture = SimulatedCapture(ADC(Pin(26)).read_u16)
+    """
+
+    def __init__(
+            self,
+            read_u16,
+            rate: int = CAPTURE_RATE,
+            max_samples: int = CAPTURE_MAX_SAMPLES,
+    ):
+        """ Initialize SimulatedCapture.
+
+        :param read_u16: function returning a 16 bit reading, e.g. ADC.read_u16 of a simulated machine module
+        :param rate: samples per second
+        :param max_samples: size of the preallocated buffer
+        """
+
+        self.read_u16 = read_u16
+        self.max_rate = rate
+        self.rate = rate
+        self.buffer = array('H', bytes(2 * max_samples))
+        self.samples = 0
+        self.start_ticks = ticks_us()
+
+    def fit_window(self, window_us: int) -> int:
+        """ Set the sample rate for captures spanning an integration window, see capture_plan
+
+        :param window_us: integration window in microseconds
+        :return: number of samples to capture
+        """
+
+        self.rate, samples = capture_plan(window_us, rate=self.max_rate, max_samples=len(self.buffer))
+        return samples
+
+    def start(self, samples: int) -> None:
+        """ Start capturing, returns right away
+
+        :param samples: number of samples, at most the buffer size
+        :return: None
+        """
+
+        _check_samples(samples, self.buffer)
+        self.samples = samples
+        self.start_ticks = ticks_us()
+
+    def done(self) -> bool:
+        """ Whether the capture is complete
+
+        :return: True once the capture would be complete at the capture rate
+        """
+
+        return ticks_diff(ticks_us(), self.start_ticks) >= self.samples * 1000000 // self.rate
+
+    def wait(self) -> memoryview:
+        """ Take the samples at the times they are due at the capture rate
+
+        Samples due while a reading is taken hold its value, as fast as read_u16 allows.
+
+        :return: view of the captured 12 bit samples
+        """
+
+        filled = 0
+        while filled < self.samples:
+            due = min(ticks_diff(ticks_us(), self.start_ticks) * self.rate // 1000000 + 1, self.samples)
+            if due <= filled:
+                continue
+            value = self.read_u16() >> 4
+            for i in range(filled, due):
+                self.buffer[i] = value
+            filled = due
+        return memoryview(self.buffer)[:self.samples]
+
+    def mean_u16(self) -> int:
+        """ Wait for the capture and average it
+
+        :return: 16 bit mean of the samples
+        """
+
+        return mean_u16(self.wait())
+
+
+def make_capture(
+        backend: str,
+        adc_pin: int = PIN_ADC0,
+        read_u16=None,
+        rate: int = CAPTURE_RATE,
+        max_samples: int = CAPTURE_MAX_SAMPLES,
+):
+    """ Capture backend by name
+
+    :param backend: CAPTURE_READ, CAPTURE_DMA or CAPTURE_SIMULATED
+    :param adc_pin: GPIO number of the ADC input
+    :param read_u16: reading function of the simulated backend
+    :param rate: samples per second
+    :param max_samples: size of the preallocated buffer
+    :return: DMACapture, SimulatedCapture or None for plain ADC.read_u16 calls
+    """
+
+    if backend == CAPTURE_READ:
+        return None
+    if backend == CAPTURE_DMA:
+        return DMACapture(adc_pin=adc_pin, rate=rate, max_samples=max_samples)
+    if backend == CAPTURE_SIMULATED:
+        return SimulatedCapture(read_u16, rate=rate, max_samples=max_samples)
+    raise ValueError(f"Unknown capture backend: {backend}")
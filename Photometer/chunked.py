@@ -0,0 +1,432 @@
+""" Memory bounded processing of result files: the steps of process_measurements applied to chunks of rows,
+with the state needed across chunk boundaries carried over, so results are identical.
+
+Carried state:
+- time of the first row, hours are counted from it (rows are in time order, as written by the firmware)
+- last dark median per channel, the dark reference of rows before the first dark row of their channel in a chunk
+- the last values of each series as context of the median filter; rows whose filtered value needs values of
+  the next chunk are held back
+- rows up to the end of the baseline window, until the early low value of each series is known;
+  runs with a blank have their baseline from the start (see Photometer.processing.blank_values)
+Peak memory depends on chunk_rows, median window and baseline window, not on the length of the run.
+The same state lets LiveProcessor follow a file that is still being written, processing only the appended rows.
+
+# Example usage:
+for df_chunk in process_chunks('20241030-161800_output.csv'):
+    pyramid_rows.append(df_chunk[[DATE, CHANNEL, INTENSITY, MEDIAN]])
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.profile import PROFILE_PWM_DUTY_CYCLES
+from Photometer.processing import (
+    iter_medians,
+    run_duty_cycles,
+    MedianTail,
+    blank_values,
+    epoch_seconds,
+    early_low_values,
+    subtract_baseline,
+    scale_to_od,
+    MEDIAN,
+    FULLY_DARK,
+    MEDIAN_WINDOW,
+    BASELINE_WINDOW_HOURS,
+    BASELINE_QUANTILE,
+    OD_SCALE,
+    CHUNK_ROWS,
+)
+
+# Entry of df.attrs of processed chunks: epoch seconds of the first row, hours are counted from it
+START_SECONDS = 'start_seconds'
+
+class SeriesFilter:
+    """ Median filter of one channel / intensity series fed in pieces
+
+    Same result as scipy.ndimage.median_filter with mode='nearest' over the whole series, which is only
+    filtered if it ends up longer than the window (see Photometer.processing.smooth_series).
+
+    # Example usage:
+    series_filter = SeriesFilter(median_window=5)
+    filtered = [series_filter.add(values) for values in pieces] + [series_filter.flush()]
+    """
+
+    def __init__(
+            self,
+            median_window: int = MEDIAN_WINDOW,
+    ):
+        """ Initialize SeriesFilter.
+
+        :param median_window: size of the median filter
+        """
+
+        self.median_window = median_window
+        # Window of position p covers p - before to p + after
+        self.before = median_window // 2
+        self.after = median_window - 1 - self.before
+        # Raw values from position offset on, kept as context of the next values
+        self.values = np.empty(0)
+        self.offset = 0
+        self.length = 0
+        # Positions with a final value
+        self.done = 0
+
+    def add(self, values: np.ndarray) -> np.ndarray:
+        """ Append raw values
+
+        :param values: next raw values of the series
+        :return: filtered values of the positions that became final, following those returned before
+        """
+
+        self.values = np.concatenate([self.values, values])
+        self.length += len(values)
+        if self.length <= self.median_window:
+            # Might stay too short to be filtered at all
+            return np.empty(0)
+        return self._filter(self.length - self.after)
+
+    def flush(self) -> np.ndarray:
+        """ End of the series
+
+        :return: filtered values of all positions not returned yet
+        """
+
+        if self.length <= self.median_window:
+            result = self.values[self.done - self.offset:]
+            self.done = self.length
+            return result
+        return self._filter(self.length)
+
+    def _filter(self, end: int) -> np.ndarray:
+        """ Filter the kept values, return positions done to end and drop values no longer needed as context """
+
+        # Imported here, scipy.ndimage is slow to load and only needed for filtering
+        from scipy.ndimage import median_filter
+
+        if end <= self.done:
+            return np.empty(0)
+        # Positions taken have their whole window inside the kept values, or at the real start / end of the series
+        filtered = median_filter(self.values, size=self.median_window, mode='nearest')
+        result = filtered[self.done - self.offset:end - self.offset]
+        self.done = end
+        keep_from = max(self.done - self.before, 0)
+        self.values = self.values[keep_from - self.offset:]
+        self.offset = keep_from
+        return result
+
+
+class ChunkProcessor:
+    """ Processing state carried from one chunk of rows to the next, see the module description
+
+    Concatenated, the results of add for every chunk of a file followed by flush are the same as
+    process_measurements(read_measurements(csv_file_path)) with the same parameters, without the repeat columns.
+
+    # Example usage:
+    processor = ChunkProcessor()
+    for df in iter_medians('20241030-161800_output.csv'):
+        processed = list(processor.add(df))
+    processed += list(processor.flush())
+    """
+
+    def __init__(
+            self,
+            pwm_duty_cycles: list[int] | None = None,
+            median_window: int = MEDIAN_WINDOW,
+            baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+            baseline_quantile: float = BASELINE_QUANTILE,
+            od_scale: float = OD_SCALE,
+    ):
+        """ Initialize ChunkProcessor.
+
+        :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+            defaults to those of the run profile
+        :param median_window: size of the median filter
+        :param baseline_window_hours: (start, end) hours to take the low value from
+        :param baseline_quantile: quantile of the early values used as low value
+        :param od_scale: OD assigned to the dark value
+        """
+
+        self.pwm_duty_cycles = pwm_duty_cycles
+        self.median_window = median_window
+        self.baseline_window_hours = baseline_window_hours
+        self.baseline_quantile = baseline_quantile
+        self.od_scale = od_scale
+        self.intensities = None
+        self.start_seconds = None
+        self.last_dark = {}
+        self.filters = {}
+        # Rows waiting for filtered values with their medians, numbered from first_row on;
+        # per series the numbers of its rows without filtered value yet, in series order
+        self.pending = None
+        self.pending_medians = np.empty(0)
+        self.first_row = 0
+        self.waiting = {}
+        # Filtered rows waiting for the early low values
+        self.held = []
+        self.baseline = None
+
+    def add(self, df: pd.DataFrame):
+        """ Process the next chunk of rows
+
+        :param df: Pandas data frame of rows following the previous chunk, as returned by iter_medians
+        :return: generator of processed Pandas data frames of the rows that became final, in file order
+        """
+
+        self.pwm_duty_cycles = run_duty_cycles(df, self.pwm_duty_cycles)
+        self.intensities = self.pwm_duty_cycles[1:]
+        if self.baseline is None and not self.held:
+            self.baseline = blank_values(df, intensities=self.intensities)
+        if df.empty:
+            return
+
+        # Hours since the first row
+        seconds = epoch_seconds(df[DATE])
+        self.start_seconds = seconds.min() if self.start_seconds is None else self.start_seconds
+        df[DATE] = (seconds - self.start_seconds) / 3600
+        df.attrs[START_SECONDS] = int(self.start_seconds)
+
+        # Dark reference per channel, carried over from the previous chunk until the first dark row of the channel
+        dark = df[MEDIAN].where(df[INTENSITY] == self.pwm_duty_cycles[0]).groupby(df[CHANNEL])
+        df[FULLY_DARK] = dark.ffill().fillna(df[CHANNEL].map(self.last_dark))
+        self.last_dark.update(dark.last().dropna().to_dict())
+
+        rows = self.first_row + len(self.pending_medians) + np.arange(len(df))
+        medians = df[MEDIAN].to_numpy(dtype=float)
+        self.pending = df if self.pending is None else pd.concat([self.pending, df])
+        self.pending_medians = np.concatenate([self.pending_medians, medians])
+        selected = np.flatnonzero(df[INTENSITY].isin(self.intensities).to_numpy())
+        for key, series_rows in df.iloc[selected].groupby([CHANNEL, INTENSITY], sort=False).indices.items():
+            series_rows = selected[series_rows]
+            self.waiting[key] = np.concatenate([
+                self.waiting.get(key, np.empty(0, dtype=np.int64)), rows[series_rows],
+            ])
+            self._store(key, self.filters.setdefault(key, SeriesFilter(self.median_window)).add(medians[series_rows]))
+
+        # Pass on all rows up to the first one still waiting for its filtered value
+        first_waiting = min((series[0] for series in self.waiting.values() if series.size),
+                            default=self.first_row + len(self.pending_medians))
+        if first_waiting > self.first_row:
+            yield from self._release(first_waiting - self.first_row)
+
+    def flush(self):
+        """ End of the rows, processes the rows held back; copy the processor first to continue afterwards
+
+        :return: generator of processed Pandas data frames of the remaining rows, in file order
+        """
+
+        for key, series_filter in self.filters.items():
+            self._store(key, series_filter.flush())
+        if len(self.pending_medians):
+            yield from self._release(len(self.pending_medians))
+        if self.held:
+            # Run not longer than the baseline window, nothing is subtracted
+            held, self.held = self.held, []
+            yield scale_to_od(pd.concat(held), od_scale=self.od_scale)
+
+    def _subtract(self, df: pd.DataFrame):
+        """ Pass filtered rows on once the early low values are known """
+
+        if self.baseline is not None:
+            yield scale_to_od(
+                subtract_baseline(df, intensities=self.intensities, baseline=self.baseline),
+                od_scale=self.od_scale,
+            )
+            return
+        self.held.append(df)
+        if (df[DATE] > self.baseline_window_hours[1]).any():
+            # Rows are in time order, every row of the window has been seen
+            df = pd.concat(self.held)
+            self.held = []
+            self.baseline = early_low_values(
+                df,
+                intensities=self.intensities,
+                baseline_window_hours=self.baseline_window_hours,
+                baseline_quantile=self.baseline_quantile,
+            )
+            yield scale_to_od(
+                subtract_baseline(df, intensities=self.intensities, baseline=self.baseline),
+                od_scale=self.od_scale,
+            )
+
+    def _store(self, key: tuple, values: np.ndarray) -> None:
+        """ Store the next filtered values of a series """
+
+        rows = self.waiting[key][:values.size]
+        self.pending_medians[rows - self.first_row] = values
+        self.waiting[key] = self.waiting[key][values.size:]
+
+    def _release(self, rows: int):
+        """ Pass the first rows of pending on """
+
+        df = self.pending.iloc[:rows].copy()
+        df[MEDIAN] = self.pending_medians[:rows]
+        self.pending = self.pending.iloc[rows:]
+        self.pending_medians = self.pending_medians[rows:]
+        self.first_row += rows
+        yield from self._subtract(df)
+
+
+def process_chunks(
+        csv_file_path: str,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        od_scale: float = OD_SCALE,
+        chunk_rows: int = CHUNK_ROWS,
+):
+    """ Read and process a result file chunk by chunk
+
+    Concatenated, the chunks are the same as process_measurements(read_measurements(csv_file_path)) with the
+    same parameters, without the repeat columns.
+
+    :param csv_file_path: path of .csv result file
+    :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+        defaults to those of the run profile
+    :param median_window: size of the median filter
+    :param baseline_window_hours: (start, end) hours to take the low value from
+    :param baseline_quantile: quantile of the early values used as low value
+    :param od_scale: OD assigned to the dark value
+    :param chunk_rows: number of rows read at once
+    :return: generator of processed Pandas data frames in file order, date in hours and column MEDIAN holding
+        the OD estimate, header entries and START_SECONDS in df.attrs;
+        raises pd.errors.ParserError if the file could not be parsed
+    """
+
+    processor = ChunkProcessor(
+        pwm_duty_cycles=pwm_duty_cycles,
+        median_window=median_window,
+        baseline_window_hours=baseline_window_hours,
+        baseline_quantile=baseline_quantile,
+        od_scale=od_scale,
+    )
+    for df in iter_medians(csv_file_path, chunk_rows=chunk_rows):
+        yield from processor.add(df)
+    yield from processor.flush()
+
+
+class LiveProcessor:
+    """ Processed rows of a result file still being written, each update reads and processes only appended rows
+
+    Rows whose filtered value or baseline still depends on rows to come are returned as a provisional tail,
+    from a copy of the processing state, so final and provisional rows together are the same as
+    process_measurements(read_measurements(csv_file_path)).
+
+    # Example usage:
+    live = LiveProcessor('20241030-161800_output.csv')
+    for _ in watch_file('20241030-161800_output.csv'):
+        df_final, df_tail, restarted = live.update()
+    """
+
+    def __init__(
+            self,
+            csv_file_path: str,
+            **kwargs,
+    ):
+        """ Initialize LiveProcessor.
+
+        :param csv_file_path: path of .csv result file
+        :param kwargs: passed on to ChunkProcessor
+        """
+
+        self.csv_file_path = csv_file_path
+        self.kwargs = kwargs
+        self.tail = None
+        self.processor = None
+
+    @property
+    def start_seconds(self) -> int | None:
+        """ Epoch seconds of the first row, hours are counted from it """
+
+        return None if self.processor is None or self.processor.start_seconds is None \
+            else int(self.processor.start_seconds)
+
+    @property
+    def pwm_duty_cycles(self) -> list[int]:
+        """ LED duty powers of the run after the first update, first one is the dark measurement """
+
+        pwm_duty_cycles = self.kwargs.get('pwm_duty_cycles')
+        return self.tail.profile[PROFILE_PWM_DUTY_CYCLES] if pwm_duty_cycles is None else pwm_duty_cycles
+
+    def update(self) -> (pd.DataFrame | None, pd.DataFrame | None, bool):
+        """ Read and process the rows appended since the last update
+
+        :return: processed rows that became final since the last update (date in hours, MEDIAN holding the
+            OD estimate), the provisional rows after all final ones, None instead of empty data frames;
+            True if the file was processed anew from its start, after a replaced file or a changed profile or blank,
+            the final rows start from the first row of the run then
+        """
+
+        restarted = self.tail is None or self.tail.restarted
+        if restarted:
+            self._restart()
+        final = list(self._process())
+        if self.tail.restarted:
+            restarted = True
+            self._restart()
+            final = list(self._process())
+        provisional = list(copy.deepcopy(self.processor).flush())
+        return (
+            pd.concat(final) if final else None,
+            pd.concat(provisional) if provisional else None,
+            restarted,
+        )
+
+    def _restart(self) -> None:
+        """ Read the file from its start with its current layout """
+
+        if self.tail is not None:
+            self.tail.close()
+        self.tail = MedianTail(self.csv_file_path)
+        self.processor = ChunkProcessor(**self.kwargs)
+
+    def _process(self):
+        """ Process the rows the tail reader passes on """
+
+        for df in self.tail.read():
+            yield from self.processor.add(df)
+
+    def close(self) -> None:
+        if self.tail is not None:
+            self.tail.close()
+
+
+def read_processed(
+        csv_file_path: str,
+        columns: list[str] | None = None,
+        chunk_rows: int = CHUNK_ROWS,
+        **kwargs,
+) -> pd.DataFrame | None:
+    """ Process a result file chunk by chunk and keep only some columns of the result
+
+    # Example usage:
+    df = read_processed('20241030-161800_output.csv', columns=[DATE, CHANNEL, INTENSITY, MEDIAN])
+
+    :param csv_file_path: path of .csv result file
+    :param columns: columns to keep, defaults to all
+    :param chunk_rows: number of rows read at once
+    :param kwargs: passed on to process_chunks
+    :return: processed Pandas data frame, header entries and START_SECONDS in df.attrs,
+        None if the file could not be parsed or holds no rows
+    """
+
+    try:
+        chunks = [
+            chunk if columns is None else chunk[columns]
+            for chunk in process_chunks(csv_file_path, chunk_rows=chunk_rows, **kwargs)
+        ]
+    except pd.errors.ParserError:
+        return None
+    if not chunks:
+        return None
+    df = pd.concat(chunks)
+    df.attrs.update(chunks[0].attrs)
+    return df
@@ -0,0 +1,57 @@
+""" Host command line: one entry point for all host tools, each subcommand imports its module only when run.
+
+Help and quick commands such as status never load pandas, scipy or matplotlib.
+
+# Example usage:
+python -m Photometer status -i 20241030-161800_output.csv
+python -m Photometer figure -i 20241030-161800_output.csv -od truth.tsv
+python -m Photometer growth --help
+"""
+
+import argparse
+import importlib
+import os
+import sys
+
+# Subcommand to (module with main(argv), description); modules are imported only when their subcommand runs
+COMMANDS = {
+    'status': ('Photometer.status', "Show header, progress, self-test and alerts of result files"),
+    'figure': ('create_figure', "Draw a figure of a result file and redraw it whenever rows are added"),
+    'growth': ('Photometer.growth', "Extract growth curve features from result files"),
+    'calibrate': ('Photometer.calibration', "Fit OD calibration models against reference values"),
+    'replay': ('Photometer.replay', "Replay archived result files through the processing stages"),
+    'sweep': ('Photometer.sweep', "Sweep processing parameters over a result file"),
+    'fleet': ('Photometer.fleet', "Run and supervise several photometers"),
+    'timing': ('Photometer.timing_report', "Report where the time of the measurement cycles goes"),
+    'synthetic': ('Photometer.synthetic', "Write a synthetic result file"),
+    'benchmark': ('Photometer.benchmark', "Benchmark the analysis pipeline and the command line start up"),
+    'decode': ('Photometer.decode', "Decode compact result streams into text result files"),
+    'store': ('Photometer.store', "Import result files into an indexed measurement store, list its runs"),
+    'command': ('Photometer.command', "Send a command to a running photometer"),
+}
+
+# Top level scripts such as create_figure live next to the package
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m Photometer',
+        description="Host tools of the pico photometer, see '<command> --help' for the options of each command",
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for command, (_, description) in COMMANDS.items():
+        # Options, including --help, are left to the module of the command
+        subparsers.add_parser(command, help=description, add_help=False)
+    args, arguments = parser.parse_known_args(argv)
+
+    module_name, _ = COMMANDS[args.command]
+    if REPOSITORY_DIRECTORY not in sys.path:
+        sys.path.append(REPOSITORY_DIRECTORY)
+    # Shown as program name in the usage line of the command
+    sys.argv[0] = f"{parser.prog} {args.command}"
+    importlib.import_module(module_name).main(arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+""" Command channel of a running photometer: the host appends JSON lines to a file on the mounted folder,
+the firmware picks up new lines while it waits between measurement cycles.
+Runs on the Pico (MicroPython) and on the host.
+
+Lines already in the file when the firmware starts are skipped, so a restart doesn't repeat old commands.
+Every executed command is written to the output file as HEADER_COMMAND line, with its result.
+Commands changing settings are followed by a HEADER_PROFILE line with the new settings, so readers process
+the rows measured before and after the change (see Photometer.profile.merge_profiles).
+
+# Commands:
+{"command": "measure"}                                  extra cycle now, the regular cycle times stay the same
+{"command": "interval", "seconds": 300}                 seconds between measurement cycles
+{"command": "duty_cycles", "values": [0, 16383, 65535]} LED duty powers, the first one is the dark measurement
+                                                        and has to stay the one the run started with
+{"command": "blank"}                                    extra cycle now, e.g. of sterile medium before inoculation;
+                                                        its readings become the baseline of processing
+{"command": "stats"}                                    print counters and settings of the run
+
+# Example usage:
+python -m Photometer.command -f /home/user/photometer/commands.jsonl interval 300
+"""
+
+import json
+
+from Photometer.constants import MAX_U16
+
+# Command file the firmware looks for in the folder mounted by mpremote
+COMMAND_FILE_PATH = '/remote/commands.jsonl'
+# Seconds between looks at the command file while waiting for the next cycle
+COMMAND_POLL_SECONDS = 5
+
+# Keys of a command
+COMMAND = 'command'
+COMMAND_SECONDS = 'seconds'
+COMMAND_VALUES = 'values'
+# Keys added to the record of an executed command
+COMMAND_TIME = 'time'
+COMMAND_OK = 'ok'
+COMMAND_ERROR = 'error'
+
+# Commands
+COMMAND_MEASURE = 'measure'
+COMMAND_INTERVAL = 'interval'
+COMMAND_DUTY_CYCLES = 'duty_cycles'
+COMMAND_BLANK = 'blank'
+COMMAND_STATS = 'stats'
+COMMANDS = (COMMAND_MEASURE, COMMAND_INTERVAL, COMMAND_DUTY_CYCLES, COMMAND_BLANK, COMMAND_STATS)
+
+
+def check_command(command) -> str | None:
+    """ Check name and arguments of a command
+
+    :param command: parsed command line
+    :return: error message, None if the command is valid
+    """
+
+    if not isinstance(command, dict) or command.get(COMMAND) not in COMMANDS:
+        return f"Unknown command, choose from {', '.join(COMMANDS)}"
+    name = command[COMMAND]
+    if name == COMMAND_INTERVAL:
+        seconds = command.get(COMMAND_SECONDS)
+        if not isinstance(seconds, (int, float)) or isinstance(seconds, bool) or seconds <= 0:
+            return f"{name} needs {COMMAND_SECONDS} > 0"
+    if name == COMMAND_DUTY_CYCLES:
+        values = command.get(COMMAND_VALUES)
+        if (not isinstance(values, list) or len(values) < 2
+                or not all(isinstance(i, int) and not isinstance(i, bool) and 0 <= i <= MAX_U16 for i in values)):
+            return f"{name} needs {COMMAND_VALUES}: dark and at least one more duty power within [0, {MAX_U16}]"
+    return None
+
+
+class CommandReader:
+    """ Read the commands appended to the command file since the last poll
+
+    # Example usage:
+    reader = CommandReader()
+    for command, error in reader.poll():
+        ...
+    """
+
+    def __init__(
+            self,
+            file_path: str = COMMAND_FILE_PATH,
+    ):
+        """ Initialize CommandReader, skipping the commands already in the file.
+
+        :param file_path: path of the command file
+        """
+
+        self.file_path = file_path
+        self.offset = self._size()
+
+    def _size(self) -> int:
+        try:
+            with open(self.file_path, 'rb') as f:
+                return f.seek(0, 2)
+        except OSError:
+            return 0
+
+    def poll(self) -> list:
+        """ New complete command lines
+
+        :return: list of (command, error message or None)
+        """
+
+        size = self._size()
+        if size < self.offset:
+            # Replaced by a new file, read it from the start
+            self.offset = 0
+        if size == self.offset:
+            return []
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        # A line still being written is left for the next poll
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        commands = []
+        for line in data[:end].decode().split('\n'):
+            if not line.strip():
+                continue
+            try:
+                command = json.loads(line)
+            except ValueError:
+                commands.append(({COMMAND: line}, "Not a JSON line"))
+                continue
+            commands.append((command, check_command(command)))
+        return commands
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Send a command to a running photometer")
+    parser.add_argument(
+        "--file", "-f",
+        help="command file in the folder mounted on the photometer",
+        required=True,
+    )
+    parser.add_argument(
+        "command",
+        choices=COMMANDS,
+    )
+    parser.add_argument(
+        "arguments",
+        nargs='*',
+        type=int,
+        help=f"seconds for {COMMAND_INTERVAL}, duty powers for {COMMAND_DUTY_CYCLES}",
+    )
+    args = parser.parse_args(argv)
+
+    command = {COMMAND: args.command}
+    if args.command == COMMAND_INTERVAL:
+        command[COMMAND_SECONDS] = args.arguments[0] if args.arguments else 0
+    elif args.command == COMMAND_DUTY_CYCLES:
+        command[COMMAND_VALUES] = args.arguments
+    error = check_command(command)
+    if error is not None:
+        parser.error(error)
+    # One write per line, the firmware never sees half a command as complete
+    with open(args.file, 'a') as f:
+        f.write(json.dumps(command) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,9 @@ try:
 except ModuleNotFoundError:
     from collections import namedtuple
 
+# Version of the firmware, written to the header of every result file
+FIRMWARE_VERSION = '0.4.0'
+
 # unsigned 16 bit integer maximum
 MAX_U16 = const(65535)
 
@@ -48,10 +51,48 @@ MEASUREMENT_REPEATS = const(11)
 MEASUREMENT_REPEAT_INTERVAL_SECONDS = const(.2)
 # How many seconds between each measurement cycle (300 = 5 minutes):
 MEASUREMENT_FREQUENCY_SECONDS = const(900)
+# Seconds of back to back ADC reads averaged into each repeat, rounded to whole PWM periods, 0 for single reads
+# (see Photometer.oversample); e.g. .05 with 0 repeat interval: 11 repeats in .55 s instead of 2.2 s
+MEASUREMENT_OVERSAMPLE_WINDOW_SECONDS = 0
 # How long to wait before a measurement for the first time (so LED is at right setting):
 # @todo: 3
 MEASUREMENT_LED_WARMUP_SECONDS = const(2)
 
+# Time stamp result rows with integer seconds since the epoch (fast to write and parse) instead of YYYYMMDD-HHMMSS
+EPOCH_TIMESTAMPS = True
+
+# Write results as compact delta encoded stream (<start>_output.pms) instead of text rows, decoded on the host
+# (see Photometer.stream); rows are printed as compact frame lines too, which Photometer.fleet decodes
+STREAM_RESULTS = False
+
+# Leave channels that are stuck or lost their dark / bright contrast out of future cycles (see Photometer.health)
+EXCLUDE_FAILING_CHANNELS = False
+
+# Don't start measuring if the start up self-test fails (see Photometer.self_test)
+SELF_TEST_REQUIRED = False
+
+# Light channels that don't see each other's LED together and measure the dark values of all channels at once,
+# following the crosstalk matrix measured at calibration or the channel positions (see Photometer.schedule)
+SCHEDULE_MEASUREMENTS = False
+# Positions of the channels as {LED anode GPIO: (x, y)}, used to tell interfering channels apart without crosstalk
+# matrix, e.g. {0: (0, 0), 1: (1, 0), ...} for channels in a row; None: only the matrix is used
+CHANNEL_POSITIONS = None
+
+# How oversampled repeats are captured (see Photometer.capture): 'read' for ADC.read_u16 calls in a loop,
+# 'dma' for the RP2040 ADC FIFO drained by DMA at a fixed rate, 'simulated' for the off-device equivalent of 'dma'
+ADC_CAPTURE = 'read'
+
+# Start reading as soon as the photoresistor has settled after an LED change instead of always waiting the full
+# warmup, which becomes the timeout (see Photometer.settle)
+ADAPTIVE_SETTLE = False
+
+# Pick up commands (extra cycle, interval, duty powers, blank, stats) the host appends to commands.jsonl in the
+# mounted folder while waiting between cycles (see Photometer.command)
+COMMAND_CHANNEL = False
+
+# Record per phase / per channel timing of each measurement cycle next to the results (see Photometer.timing)
+PROFILE_TIMING = False
+
 # Total length of measurement for default values:
 # 8 measurements * (2 warmup seconds + (5 repeats * .2 interval seconds)) equals roughly 24 seconds
 # 8 measurements * (3 warmup seconds + (11 repeats * .2 interval seconds)) equals roughly 41.6 seconds
@@ -0,0 +1,298 @@
+""" Streaming decoder of the compact result streams written by the firmware (see Photometer.stream), host only.
+Decoded lines are the same as the text rows Photometer would have written.
+
+# Example usage:
+python -m Photometer.decode -i 20241030-161800_output.pms -o 20241030-161800_output.csv
+"""
+
+import binascii
+
+from Photometer.constants import SEPERATOR
+from Photometer.stream import (
+    fletcher16,
+    STREAM_SUFFIX,
+    SYNC,
+    SYNC_BYTE,
+    FRAME_TEXT,
+    FRAME_KEY,
+    FRAME_TYPES,
+    MAX_PAYLOAD,
+    MAX_LENGTH_BYTES,
+    ROW_COUNT_MODULO,
+    FRAME_LINE_PREFIX,
+)
+
+# Bytes of the decoded text handed out at once by StreamReader
+READ_BYTES = 2 ** 16
+
+
+def _length(buffer: bytearray, position: int) -> (int, int | None):
+    """ Payload length varint at position: length and position after it, None if incomplete, -1 if invalid """
+
+    length = 0
+    for i in range(MAX_LENGTH_BYTES):
+        if position + i >= len(buffer):
+            return 0, None
+        byte = buffer[position + i]
+        length |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return length, position + i + 1 if length <= MAX_PAYLOAD else -1
+    return 0, -1
+
+
+def _unzigzag(value: int) -> int:
+    """ Inverse of Photometer.stream._zigzag """
+
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+class StreamDecoder:
+    """ Decode frames fed in arbitrary pieces back into text lines
+
+    # Example usage:
+    decoder = StreamDecoder()
+    for data in chunks:
+        lines.extend(decoder.feed(data))
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # Series id to [channel, detector, duty power, repeats, first reading, time, row count]
+        self.series = {}
+        # Damaged frames and stretches of bytes between frames, delta frames skipped while waiting for a key frame
+        self.damaged = 0
+        self.skipped = 0
+
+    def feed(self, data: bytes) -> list[str]:
+        """ Decode all complete frames, keep an incomplete last frame for the next call
+
+        :param data: next bytes of the stream
+        :return: decoded lines without line break
+        """
+
+        self.buffer.extend(data)
+        buffer = self.buffer
+        lines = []
+        position = 0
+        while True:
+            start = buffer.find(SYNC_BYTE, position)
+            if start < 0:
+                if position < len(buffer):
+                    self.damaged += 1
+                position = len(buffer)
+                break
+            if start > position:
+                # Bytes that are no frame, e.g. the SYNC of a frame got damaged
+                self.damaged += 1
+                position = start
+            if start + 1 >= len(buffer):
+                position = start
+                break
+            length, end = _length(buffer, start + 2)
+            if end is None:
+                # Length not complete yet
+                position = start
+                break
+            if buffer[start + 1] not in FRAME_TYPES or end < 0:
+                self.damaged += 1
+                position = buffer.find(SYNC_BYTE, start + 1)
+                position = len(buffer) if position < 0 else position
+                continue
+            if end + length + 2 > len(buffer):
+                position = start
+                break
+            checksum = fletcher16(buffer[start + 1:end + length])
+            if checksum != (buffer[end + length] << 8) | buffer[end + length + 1]:
+                self.damaged += 1
+                position = buffer.find(SYNC_BYTE, start + 1)
+                position = len(buffer) if position < 0 else position
+                continue
+            line = self._decode(buffer[start + 1], buffer[end:end + length])
+            if line is not None:
+                lines.append(line)
+            position = end + length + 2
+        del buffer[:position]
+        return lines
+
+    def feed_line(self, line: str) -> list[str]:
+        """ Decode a frame line as printed by the firmware over the serial link (see Photometer.stream.frame_line)
+
+        :param line: line starting with FRAME_LINE_PREFIX, without line break
+        :return: decoded lines without line break, none if the line is damaged
+        """
+
+        try:
+            data = binascii.a2b_base64(line[len(FRAME_LINE_PREFIX):])
+        except (binascii.Error, ValueError):
+            self.damaged += 1
+            return []
+        return self.feed(data)
+
+    def _decode(self, frame_type: int, payload) -> str | None:
+        """ Text line of a checked frame, None for delta frames without key frame """
+
+        if frame_type == FRAME_TEXT:
+            return bytes(payload).decode()
+        values = []
+        value = 0
+        shift = 0
+        for byte in payload:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                values.append(value)
+                value = 0
+                shift = 0
+        if frame_type == FRAME_KEY:
+            series_id, row_count, time_stamp, channel, detector, led_duty_power, repeats = values[:7]
+            readings = values[7:7 + repeats]
+            self.series[series_id] = [channel, detector, led_duty_power, repeats, readings[0], time_stamp, row_count]
+        else:
+            series = self.series.get(values[0])
+            if series is None or values[1] != (series[6] + 1) % ROW_COUNT_MODULO:
+                # A row of the series got lost, the deltas are relative to it
+                self.series.pop(values[0], None)
+                self.skipped += 1
+                return None
+            channel, detector, led_duty_power, repeats, first, time_stamp, _ = series
+            time_stamp += values[2]
+            readings = [first + _unzigzag(values[3])]
+            for delta in values[4:4 + repeats - 1]:
+                readings.append(readings[-1] + _unzigzag(delta))
+            series[4:] = [readings[0], time_stamp, values[1]]
+        return SEPERATOR.join(str(i) for i in [time_stamp, channel, detector, led_duty_power] + readings)
+
+
+def is_stream(file_path: str) -> bool:
+    """ Whether a result file is a stream instead of text
+
+    :param file_path: path of the result file
+    :return: True if the file starts with a frame
+    """
+
+    with open(file_path, 'rb') as f:
+        start = f.read(2)
+    return len(start) == 2 and start[0] == SYNC and start[1] in FRAME_TYPES
+
+
+class StreamReader:
+    """ Read-only text file object of a stream, decoded piece by piece; takes the place of open() for readers
+
+    # Example usage:
+    with open_result('20241030-161800_output.pms') as f:
+        for line in f:
+            ...
+    """
+
+    def __init__(self, file_path: str):
+        self.file = open(file_path, 'rb')
+        self.decoder = StreamDecoder()
+        self.pending = ''
+
+    def _fill(self, size: int) -> None:
+        """ Decode until at least size characters are pending or the stream ends """
+
+        while len(self.pending) < size:
+            data = self.file.read(READ_BYTES)
+            if not data:
+                break
+            lines = self.decoder.feed(data)
+            if lines:
+                self.pending += '\n'.join(lines) + '\n'
+
+    def read(self, size: int = -1) -> str:
+        if size is None or size < 0:
+            self._fill(float('inf'))
+            size = len(self.pending)
+        else:
+            self._fill(size)
+        text, self.pending = self.pending[:size], self.pending[size:]
+        return text
+
+    def readline(self) -> str:
+        while '\n' not in self.pending:
+            size = len(self.pending)
+            self._fill(size + 1)
+            if len(self.pending) == size:
+                break
+        end = self.pending.find('\n') + 1 or len(self.pending)
+        line, self.pending = self.pending[:end], self.pending[end:]
+        return line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def open_result(file_path: str):
+    """ Open a result file for reading as text, whether it is a text file or a stream
+
+    :param file_path: path of the result file
+    :return: text file object
+    """
+
+    if is_stream(file_path):
+        return StreamReader(file_path)
+    return open(file_path)
+
+
+def decode_file(
+        stream_file_path: str,
+        csv_file_path: str,
+) -> StreamDecoder:
+    """ Decode a stream into a text result file
+
+    :param stream_file_path: path of the stream
+    :param csv_file_path: path of the .csv output
+    :return: decoder, with counts of damaged and skipped frames
+    """
+
+    reader = StreamReader(stream_file_path)
+    with reader, open(csv_file_path, 'w') as f:
+        for line in reader:
+            f.write(line)
+    return reader.decoder
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decode compact result streams into text result files")
+    parser.add_argument(
+        "--input", "-i",
+        help="stream written by the firmware",
+        required=True,
+    )
+    parser.add_argument(
+        "--output", "-o",
+        help="text result file to write, defaults to the input with .csv ending",
+        default=None,
+    )
+    args = parser.parse_args(argv)
+
+    output = args.output if args.output is not None else \
+        f"{args.input[:-len(STREAM_SUFFIX)] if args.input.endswith(STREAM_SUFFIX) else args.input}.csv"
+    decoder = decode_file(args.input, output)
+    print(f"{args.input} -> {output}, {decoder.damaged} damaged frames, "
+          f"{decoder.skipped} rows skipped waiting for a key frame")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+""" Host side file helpers: atomic output writes and change triggered file watching. """
+
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import tempfile
+import time
+
+from Photometer.profile import (
+    default_profile,
+    read_profile,
+    PROFILE_REPEATS,
+    PROFILE_REPEAT_INTERVAL,
+    PROFILE_WARMUP,
+    PROFILE_OVERSAMPLE_WINDOW,
+)
+
+
+def cycle_settle_seconds(profile: dict) -> float:
+    """ Quiet time after which the rows of a measurement cycle recorded with profile are complete
+
+    Rows of one cycle arrive roughly every warmup + repeats * (interval + oversample window) seconds,
+    a burst is considered done after twice that long without a change.
+
+    :param profile: run profile, see Photometer.profile
+    :return: seconds
+    """
+
+    return 2 * (profile[PROFILE_WARMUP] +
+                profile[PROFILE_REPEATS] * (profile[PROFILE_REPEAT_INTERVAL] + profile[PROFILE_OVERSAMPLE_WINDOW]))
+
+
+# Quiet time of runs with the settings of Photometer.constants
+SETTLE_SECONDS = cycle_settle_seconds(default_profile())
+# Fallback polling interval where inotify is not available
+POLL_SECONDS = 1
+
+# See: man 7 inotify
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """ Yield a temporary path next to path, move it onto path once the block finishes without error.
+
+    Readers of path (file syncing tools, image viewers) only ever see the old or the complete new file.
+    The temporary file keeps the extension of path so tools inferring the format from it keep working.
+
+    # Example usage:
+    with atomic_path('img.png') as tmp_path:
+        plt.savefig(tmp_path)
+
+    :param path: final file path
+    :return: temporary file path
+    """
+
+    directory, name = os.path.split(os.path.abspath(path))
+    stem, ext = os.path.splitext(name)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{stem}.", suffix=ext, dir=directory)
+    os.close(fd)
+    # mkstemp creates files readable by the owner only, use the permissions a plain open() would give instead
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_path, 0o666 & ~umask)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w', **kwargs):
+    """ Open a file for writing that replaces path atomically once the block finishes without error.
+
+    :param path: final file path
+    :param mode: file mode, has to be a writing mode
+    :param kwargs: passed on to open()
+    :return: open file object
+    """
+
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class _InotifySource:
+    """ Wait for changes of a single file via Linux inotify on its directory.
+
+    The directory is watched instead of the file itself, so files replaced by renaming are still picked up.
+    """
+
+    def __init__(self, path: str):
+        directory, name = os.path.split(os.path.abspath(path))
+        self.name = os.fsencode(name)
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        # Raises AttributeError on systems without inotify
+        self.fd = libc.inotify_init1(_IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(
+                self.fd,
+                os.fsencode(directory),
+                _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE,
+        ) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), directory)
+
+    def wait(self, timeout: float | None) -> bool:
+        """ Wait for a change of the watched file
+
+        :param timeout: seconds to wait at most, None waits indefinitely
+        :return: True if the file changed, False on timeout
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            buffer = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, length = _INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += _INOTIFY_EVENT.size
+                name = buffer[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self.name:
+                    return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _PollingSource:
+    """ Wait for changes of a single file by polling modification time and size. """
+
+    def __init__(self, path: str, poll_seconds: float = POLL_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.last_stat = self._stat()
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def wait(self, timeout: float | None) -> bool:
+        """ Wait for a change of the watched file
+
+        :param timeout: seconds to wait at most, None waits indefinitely
+        :return: True if the file changed, False on timeout
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current_stat = self._stat()
+            if current_stat != self.last_stat:
+                self.last_stat = current_stat
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_seconds if deadline is None else
+                       min(self.poll_seconds, max(deadline - time.monotonic(), 0)))
+
+    def close(self) -> None:
+        pass
+
+
+def file_settle_seconds(file_path: str) -> float:
+    """ Quiet time after which the rows of a measurement cycle of a result file are complete
+
+    :param file_path: path of .csv result file
+    :return: seconds, from the profile in the file header; SETTLE_SECONDS if the header can't be read yet
+    """
+
+    try:
+        return cycle_settle_seconds(read_profile(file_path))
+    except (OSError, ValueError, KeyError, TypeError):
+        return SETTLE_SECONDS
+
+
+def watch_source(
+        source,
+        settle_seconds,
+):
+    """ Yield once per burst of changes reported by source, after it has been quiet for settle_seconds.
+
+    :param source: object with wait(timeout) returning whether a change happened, and close()
+    :param settle_seconds: quiet time after the last change, or a callable returning it; called once per burst
+        so it follows a header written after watching started
+    :return: generator yielding None after each finished burst
+    """
+
+    try:
+        while True:
+            source.wait(None)
+            settle = settle_seconds() if callable(settle_seconds) else settle_seconds
+            # Debounce: keep waiting as long as changes keep coming in
+            while source.wait(settle):
+                pass
+            yield
+    finally:
+        source.close()
+
+
+def watch_file(
+        path: str,
+        settle_seconds: float | None = None,
+        poll_seconds: float = POLL_SECONDS,
+):
+    """ Yield once per burst of changes to path, after the file has been quiet for settle_seconds.
+
+    Uses inotify where available, polls modification time and size otherwise.
+    A whole measurement cycle appends its rows within a short burst, so each cycle triggers one yield.
+
+    # Example usage:
+    for _ in watch_file('output.csv'):
+        make_figure('output.csv')
+
+    :param path: file to watch
+    :param settle_seconds: quiet time after the last change before a burst is considered finished,
+        None derives it from the profile in the header of path (see file_settle_seconds)
+    :param poll_seconds: polling interval if inotify is not available
+    :return: generator yielding None after each finished burst
+    """
+
+    try:
+        source = _InotifySource(path)
+    except (OSError, AttributeError):
+        source = _PollingSource(path, poll_seconds=poll_seconds)
+    yield from watch_source(source, (lambda: file_settle_seconds(path)) if settle_seconds is None else settle_seconds)
@@ -0,0 +1,445 @@
+""" Run several photometers from one host: discover Picos by serial number, start and supervise one mpremote
+session per device and feed all of their output into one ingestion pipeline running in a single event loop.
+
+# Example config file (JSON), devices not listed get a directory named after their serial number.
+# A profile is copied to the device folder as profile.json and picked up by the firmware (see Photometer.profile):
+{
+    "directory": "/home/user/photometer",
+    "devices": {
+        "e66038b713456789": {"name": "incubator_left", "directory": "/home/user/photometer/left"},
+        "e66038b713987654": {"name": "incubator_right", "profile": "profiles/burst.json"}
+    }
+}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from Photometer.constants import SEPERATOR
+from Photometer.decode import StreamDecoder
+from Photometer.files import (
+    cycle_settle_seconds,
+    SETTLE_SECONDS,
+)
+from Photometer.header import (
+    parse_header_line,
+    HEADER_PREFIX,
+    HEADER_PROFILE,
+)
+from Photometer.profile import (
+    load_profile,
+    default_profile,
+    PROFILE_FILE_PATH,
+)
+from Photometer.self_test import (
+    parse_self_test_line,
+    REPORT_PASSED,
+    REPORT_CHANNELS,
+)
+from Photometer.stream import FRAME_LINE_PREFIX
+
+# USB vendor ID of Raspberry Pi boards as listed by mpremote
+RASPBERRY_PI_VENDOR_ID = '2e8a'
+# Seconds between scans for newly attached devices
+SCAN_SECONDS = 30
+# Restart back off after a session ended, doubled per failed start up to the maximum
+RESTART_SECONDS = 5
+MAX_RESTART_SECONDS = 300
+# A session running this long counts as successful, the back off is reset afterwards
+STABLE_SECONDS = 600
+
+FIRMWARE_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pico_photometer.py')
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Result rows as printed by Photometer.save_result, time stamped with a time string or epoch seconds
+RESULT_ROW = re.compile(r'^(\d{8}-\d{6}|\d+)' + f'({SEPERATOR}' + r'\d+){4,}$')
+# Output file announced by Photometer.__init__ on the mounted folder
+OUTPUT_FILE = re.compile(r'^/remote/(\S+\.(csv|pms))$')
+
+
+def timestamp() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def list_devices(
+        mpremote: str = 'mpremote',
+) -> dict[str, str]:
+    """ Find attached Raspberry Pi boards
+
+    :param mpremote: mpremote executable
+    :return: dictionary of serial number to port
+    """
+
+    process = await asyncio.create_subprocess_exec(
+        mpremote, 'connect', 'list',
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await process.communicate()
+    devices = {}
+    for line in stdout.decode(errors='replace').splitlines():
+        # port serial vid:pid manufacturer product
+        fields = line.split()
+        if len(fields) >= 3 and fields[2].lower().startswith(RASPBERRY_PI_VENDOR_ID):
+            devices[fields[1]] = fields[0]
+    return devices
+
+
+def prepare_directory(
+        directory: str,
+        profile: str | None = None,
+) -> None:
+    """ Create a device folder that can be mounted on the Pico, with the Photometer package linked into it
+
+    :param directory: folder the device writes its results to
+    :param profile: path of the run profile for the device, None keeps a profile already in the folder
+    :return: None
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    link = os.path.join(directory, 'Photometer')
+    if not os.path.exists(link):
+        os.symlink(PACKAGE_DIRECTORY, link)
+    if profile is not None:
+        # Fail here rather than on the device
+        load_profile(profile)
+        shutil.copyfile(profile, os.path.join(directory, os.path.basename(PROFILE_FILE_PATH)))
+
+
+def render_figure(
+        csv_file_path: str,
+) -> None:
+    """ Render the figure of one run, executed in a worker process
+
+    :param csv_file_path: path of .csv result file
+    :return: None
+    """
+
+    # make_figure lives in the top level script
+    sys.path.insert(0, os.path.dirname(PACKAGE_DIRECTORY))
+    from create_figure import make_figure
+    make_figure(csv_file_path)
+
+
+class Ingestor:
+    """ Single ingestion pipeline for the output of all devices
+
+    Parses header lines and result rows, hands them to the registered consumers, and once the measurement cycle
+    of a device has settled flushes the consumers and renders its figure. Rendering runs in worker processes so the event loop stays responsive.
+    """
+
+    def __init__(
+            self,
+            settle_seconds: float | None = None,
+            render: bool = True,
+            processes: int | None = None,
+    ):
+        """ Initialize Ingestor.
+
+        :param settle_seconds: quiet time after the last row of a device before its figure is rendered,
+            None derives it per device from the profile header of its run (see Photometer.files)
+        :param render: whether to render figures
+        :param processes: number of worker processes for rendering, defaults to the number of CPUs
+        """
+
+        self.settle_seconds = settle_seconds
+        self.executor = ProcessPoolExecutor(max_workers=processes) if render else None
+        # Callables taking (device name, list of row fields), (device name, header key, header value)
+        # and (device name) once the rows of a cycle have settled
+        self.consumers = []
+        self.header_consumers = []
+        self.flushers = []
+        self.output_files = {}
+        self.pending = {}
+        # Device name to quiet time of its current run, with settle_seconds None
+        self.device_settle_seconds = {}
+        # Device name to decoder of the frame lines it prints
+        self.decoders = {}
+
+    def add_consumer(self, consumer, header_consumer=None, flusher=None) -> None:
+        self.consumers.append(consumer)
+        if header_consumer is not None:
+            self.header_consumers.append(header_consumer)
+        if flusher is not None:
+            self.flushers.append(flusher)
+
+    def ingest(
+            self,
+            name: str,
+            directory: str,
+            line: str,
+    ) -> None:
+        """ Handle one line of device output
+
+        :param name: device name
+        :param directory: device folder mounted as /remote
+        :param line: output line without line break
+        :return: None
+        """
+
+        if line.startswith(FRAME_LINE_PREFIX):
+            # Rows of a device writing a stream, printed as compact frames (see Photometer.stream.frame_line)
+            for decoded in self.decoders.setdefault(name, StreamDecoder()).feed_line(line):
+                self.ingest(name, directory, decoded)
+            return
+        output_file = OUTPUT_FILE.match(line)
+        if output_file:
+            self.output_files[name] = os.path.join(directory, output_file.group(1))
+            return
+        if line.startswith(HEADER_PREFIX):
+            try:
+                key, value = parse_header_line(line)
+            except ValueError:
+                return
+            if key == HEADER_PROFILE and isinstance(value, dict):
+                profile = default_profile()
+                profile.update(value)
+                self.device_settle_seconds[name] = cycle_settle_seconds(profile)
+            for header_consumer in self.header_consumers:
+                header_consumer(name, key, value)
+            return
+        if not RESULT_ROW.match(line):
+            return
+        fields = line.split(SEPERATOR)
+        for consumer in self.consumers:
+            consumer(name, fields)
+        if self.flushers or (self.executor is not None and name in self.output_files):
+            # Debounce: restart the settle timer with every row
+            if name in self.pending:
+                self.pending[name].cancel()
+            settle_seconds = self.settle_seconds if self.settle_seconds is not None else \
+                self.device_settle_seconds.get(name, SETTLE_SECONDS)
+            self.pending[name] = asyncio.get_running_loop().call_later(
+                settle_seconds, self._settled, name,
+            )
+
+    def _settled(self, name: str) -> None:
+        self.pending.pop(name, None)
+        for flusher in self.flushers:
+            flusher(name)
+        if self.executor is None or name not in self.output_files:
+            return
+        future = asyncio.get_running_loop().run_in_executor(self.executor, render_figure, self.output_files[name])
+
+        def report(done):
+            if not done.cancelled() and done.exception() is not None:
+                print(f"{timestamp()} [{name}] Rendering failed: {done.exception()}")
+        future.add_done_callback(report)
+
+    def close(self) -> None:
+        for handle in self.pending.values():
+            handle.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DeviceSupervisor:
+    """ Keep one mpremote session per device running, restart it with back off once it ends. """
+
+    def __init__(
+            self,
+            serial: str,
+            name: str,
+            directory: str,
+            ingestor: Ingestor,
+            mpremote: str = 'mpremote',
+            script: str = FIRMWARE_SCRIPT,
+            profile: str | None = None,
+    ):
+        """ Initialize DeviceSupervisor.
+
+        :param serial: serial number of the device
+        :param name: name used in log output
+        :param directory: folder mounted as /remote on the device
+        :param ingestor: pipeline that receives the output
+        :param mpremote: mpremote executable
+        :param script: firmware script run on the device
+        :param profile: path of the run profile for the device, optional
+        """
+
+        self.serial = serial
+        self.name = name
+        self.directory = directory
+        self.ingestor = ingestor
+        self.mpremote = mpremote
+        self.script = script
+        self.profile = profile
+        self.process = None
+        self.running = True
+        # Last self-test report of the current session, see Photometer.self_test
+        self.self_test = None
+
+    def command(self) -> list[str]:
+        return [
+            self.mpremote,
+            'connect', f'id:{self.serial}',
+            'setrtc',
+            'mount', self.directory,
+            'run', self.script,
+        ]
+
+    async def run(self) -> None:
+        """ Start the session, pass its output on, restart it until stop() is called
+
+        :return: None
+        """
+
+        prepare_directory(self.directory, profile=self.profile)
+        restart_seconds = RESTART_SECONDS
+        while self.running:
+            print(f"{timestamp()} [{self.name}] Starting session on {self.serial}, output in {self.directory}")
+            started = asyncio.get_running_loop().time()
+            self.self_test = None
+            measured = False
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command(),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            async for raw_line in self.process.stdout:
+                line = raw_line.decode(errors='replace').rstrip('\r\n')
+                print(f"{timestamp()} [{self.name}] {line}")
+                self.ingestor.ingest(self.name, self.directory, line)
+                measured = measured or bool(RESULT_ROW.match(line)) or line.startswith(FRAME_LINE_PREFIX)
+                report = parse_self_test_line(line)
+                if report is not None:
+                    self.self_test = report
+                    if not report[REPORT_PASSED]:
+                        failed = [ch for ch, values in report[REPORT_CHANNELS].items() if not values[REPORT_PASSED]]
+                        print(f"{timestamp()} [{self.name}] Self-test failed for channels {failed}")
+            return_code = await self.process.wait()
+            if not self.running:
+                break
+            if self.self_test is not None and not self.self_test[REPORT_PASSED] and not measured:
+                # Firmware refused to start measuring, restarting won't fix the hardware
+                print(f"{timestamp()} [{self.name}] Session ended ({return_code}) after a failed self-test, "
+                      f"not restarting, check the device")
+                break
+            if asyncio.get_running_loop().time() - started > STABLE_SECONDS:
+                restart_seconds = RESTART_SECONDS
+            print(f"{timestamp()} [{self.name}] Session ended ({return_code}), restarting in {restart_seconds} s")
+            await asyncio.sleep(restart_seconds)
+            restart_seconds = min(restart_seconds * 2, MAX_RESTART_SECONDS)
+
+    def stop(self) -> None:
+        self.running = False
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+def read_config(
+        file_path: str | None,
+) -> dict:
+    """ Read the fleet config file, see module docstring
+
+    :param file_path: path of the .json file, None for defaults
+    :return: config dictionary
+    """
+
+    if file_path is None:
+        return {'directory': os.getcwd(), 'devices': {}}
+    with open(file_path) as f:
+        config = json.load(f)
+    config.setdefault('directory', os.path.dirname(os.path.abspath(file_path)))
+    config.setdefault('devices', {})
+    return config
+
+
+async def run_fleet(
+        config: dict,
+        ingestor: Ingestor,
+        mpremote: str = 'mpremote',
+        scan_seconds: float = SCAN_SECONDS,
+) -> None:
+    """ Supervise every attached device, pick up devices attached later
+
+    :param config: config dictionary as returned by read_config
+    :param ingestor: pipeline that receives the output of all devices
+    :param mpremote: mpremote executable
+    :param scan_seconds: seconds between scans for new devices
+    :return: None
+    """
+
+    supervisors = {}
+    tasks = set()
+    try:
+        while True:
+            for serial in await list_devices(mpremote):
+                if serial in supervisors:
+                    continue
+                device_config = config['devices'].get(serial, {})
+                supervisors[serial] = DeviceSupervisor(
+                    serial=serial,
+                    name=device_config.get('name', serial),
+                    directory=device_config.get('directory', os.path.join(config['directory'], serial)),
+                    ingestor=ingestor,
+                    mpremote=mpremote,
+                    profile=device_config.get('profile'),
+                )
+                task = asyncio.create_task(supervisors[serial].run())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.sleep(scan_seconds)
+    finally:
+        for supervisor in supervisors.values():
+            supervisor.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Run and supervise all attached photometers")
+    parser.add_argument(
+        "--config", "-c",
+        help="JSON config file with per device names and output folders, optional",
+        default=None,
+    )
+    parser.add_argument(
+        "--mpremote",
+        help="mpremote executable, defaults to mpremote",
+        default='mpremote',
+    )
+    parser.add_argument(
+        "--no_render",
+        action='store_true',
+        help="Don't render figures after each measurement cycle",
+    )
+    parser.add_argument(
+        "--store",
+        help="SQLite measurement store to add all rows to, optional, see Photometer.store",
+        default=None,
+    )
+    parser.add_argument(
+        "--settle", "-s",
+        type=float,
+        help="Seconds without new rows of a device before its figure is redrawn, defaults to twice the time "
+             "between rows of a cycle with the profile of the run",
+        default=None,
+    )
+    args = parser.parse_args(argv)
+
+    ingestor = Ingestor(settle_seconds=args.settle, render=not args.no_render)
+    store = None
+    if args.store is not None:
+        # Imported here, only needed with a store
+        from Photometer.store import MeasurementStore
+        store = MeasurementStore(args.store)
+        ingestor.add_consumer(store.row, header_consumer=store.header, flusher=lambda name: store.flush())
+    try:
+        asyncio.run(run_fleet(read_config(args.config), ingestor, mpremote=args.mpremote))
+    except KeyboardInterrupt:
+        print('Stopping')
+    finally:
+        ingestor.close()
+        if store is not None:
+            store.close()
+
+
+if __name__ == '__main__':
+    main()
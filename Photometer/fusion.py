@@ -0,0 +1,149 @@
+""" Fusion of all LED intensities of a channel into one OD trace covering the full dynamic range.
+
+Every intensity gives an OD estimate per cycle. Its variance is derived from the local signal-to-noise ratio of
+the light reaching the photoresistor (Var(-log10 T) ~ 1 / (ln(10) * SNR)^2), so dim, noise bound intensities get
+little weight. Readings approaching ADC saturation (MAX_U16) are faded out over a margin below full scale.
+The fused OD is the inverse variance weighted mean of all intensities.
+"""
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    MAX_U16,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.processing import (
+    run_duty_cycles,
+    add_cycle,
+    convert_to_hours,
+    repeat_columns,
+    subtract_baseline,
+    MEDIAN,
+    FULLY_DARK,
+    MEDIAN_WINDOW,
+    BASELINE_WINDOW_HOURS,
+    BASELINE_QUANTILE,
+)
+from Photometer.calibration import (
+    add_signal,
+    apply_calibration,
+    combine_intensities,
+    SIGNAL,
+    CALIBRATED_OD,
+    SLOPE,
+)
+
+# Column names added during fusion
+SNR = 'snr'
+OD_ESTIMATE = 'od_estimate'
+FUSION_WEIGHT = 'fusion_weight'
+FUSED_OD = 'fused_od'
+FUSED_OD_STD = 'fused_od_std'
+
+# Number of consecutive cycles the SNR is smoothed over
+SNR_WINDOW = MEDIAN_WINDOW
+# Fraction of full scale below MAX_U16 over which readings are faded out
+SATURATION_MARGIN = .05
+# Repeat spread below one ADC count is quantisation, not a better measurement
+MIN_NOISE = 1
+
+
+def add_fusion_weight(
+        df: pd.DataFrame,
+        slope: np.ndarray | float = 1,
+        snr_window: int = SNR_WINDOW,
+        saturation_margin: float = SATURATION_MARGIN,
+) -> pd.DataFrame:
+    """ Add local SNR and inverse variance weight of every row with a signal, in place
+
+    :param df: Pandas data frame with SIGNAL, see calibration.add_signal
+    :param slope: OD per absorbance unit of each row (calibration slope), 1 for uncalibrated absorbance
+    :param snr_window: number of consecutive cycles the SNR of a series is smoothed over (rolling median)
+    :param saturation_margin: fraction of full scale below MAX_U16 over which readings are faded out
+    :return: the same data frame
+    """
+
+    values = df[repeat_columns(df)].to_numpy(dtype=float)
+    # Standard error of the repeat median, approximated by that of the mean
+    noise = np.maximum(values.std(axis=1, ddof=1), MIN_NOISE) / np.sqrt(values.shape[1])
+    light = (df[FULLY_DARK] - df[MEDIAN]).clip(lower=0)
+    snr = (light / noise).where(df[SIGNAL].notna())
+    df[SNR] = snr.groupby([df[CHANNEL], df[INTENSITY]], sort=False).transform(
+        lambda s: s.rolling(snr_window, center=True, min_periods=1).median()
+    )
+
+    headroom = (MAX_U16 - values.max(axis=1)) / MAX_U16
+    saturation = np.clip(headroom / saturation_margin, 0, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = (np.log(10) * df[SNR].to_numpy() / slope) ** 2 * saturation
+    df[FUSION_WEIGHT] = np.where(np.isfinite(weight), weight, 0)
+    return df
+
+
+def fuse_measurements(
+        df: pd.DataFrame,
+        models: pd.DataFrame | None = None,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        snr_window: int = SNR_WINDOW,
+        saturation_margin: float = SATURATION_MARGIN,
+) -> pd.DataFrame:
+    """ Per row OD estimates and fusion weights of a run
+
+    Without calibration models, the OD estimate of an intensity is its absorbance relative to its early low value,
+    which is independent of LED intensity and therefore comparable across intensities.
+
+    :param df: Pandas data frame as returned by read_measurements, left unchanged
+    :param models: Optional calibration models as returned by calibration.load_calibration
+    :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+        defaults to those of the run profile
+    :param median_window: size of the median filter
+    :param baseline_window_hours: (start, end) hours to take the low value from, uncalibrated only
+    :param baseline_quantile: quantile of the early values used as low value, uncalibrated only
+    :param snr_window: number of consecutive cycles the SNR of a series is smoothed over
+    :param saturation_margin: fraction of full scale below MAX_U16 over which readings are faded out
+    :return: new Pandas data frame with date in hours, cycle numbers, SNR, OD_ESTIMATE and FUSION_WEIGHT
+    """
+
+    pwm_duty_cycles = run_duty_cycles(df, pwm_duty_cycles)
+    df = df.copy()
+    add_signal(df, pwm_duty_cycles=pwm_duty_cycles, median_window=median_window)
+    add_cycle(df)
+    convert_to_hours(df)
+    if models is not None:
+        apply_calibration(df, models)
+        df[OD_ESTIMATE] = df[CALIBRATED_OD]
+        slope = np.abs(models[SLOPE].reindex(pd.MultiIndex.from_frame(df[[CHANNEL, INTENSITY]])).to_numpy())
+    else:
+        df[OD_ESTIMATE] = df[SIGNAL]
+        subtract_baseline(
+            df,
+            intensities=pwm_duty_cycles[1:],
+            baseline_window_hours=baseline_window_hours,
+            baseline_quantile=baseline_quantile,
+            column=OD_ESTIMATE,
+        )
+        slope = 1
+    add_fusion_weight(df, slope=slope, snr_window=snr_window, saturation_margin=saturation_margin)
+    df[FUSION_WEIGHT] = df[FUSION_WEIGHT].where(df[OD_ESTIMATE].notna(), 0)
+    return df
+
+
+def fuse_intensities(
+        df: pd.DataFrame,
+) -> pd.DataFrame:
+    """ Inverse variance weighted OD of all intensities, per channel and cycle
+
+    # Example usage:
+    df_fused = fuse_intensities(fuse_measurements(read_measurements('20241030-161800_output.csv')))
+
+    :param df: Pandas data frame as returned by fuse_measurements
+    :return: Pandas data frame with CHANNEL, CYCLE, DATE (first row of the cycle), FUSED_OD and FUSED_OD_STD
+    """
+
+    fused = combine_intensities(df, column=OD_ESTIMATE, weight_column=FUSION_WEIGHT, std_column=FUSED_OD_STD)
+    return fused.rename(columns={OD_ESTIMATE: FUSED_OD})
@@ -0,0 +1,377 @@
+""" Growth curve features (lag time, maximum growth rate, doubling time, plateau OD) from result files.
+
+Rates come from ln(OD), so they are only meaningful for values proportional to OD: the calibrated OD if
+calibration models are given, else the absorbance relative to the early low value (see Photometer.fusion)
+with the inoculum OD the baseline correction removed added back. The inoculum OD of uncalibrated runs is
+estimated from the growth itself, see estimate_inoculum.
+"""
+
+import argparse
+import functools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.files import atomic_write
+from Photometer.processing import (
+    run_duty_cycles,
+    read_measurements,
+    CYCLE,
+)
+from Photometer.calibration import load_calibration
+from Photometer.fusion import (
+    fuse_measurements,
+    OD_ESTIMATE,
+)
+
+# Result columns
+RUN = 'Run'
+MU_MAX = 'mu_max'
+DOUBLING_TIME = 'doubling_time'
+LAG_TIME = 'lag_time'
+PLATEAU_OD = 'plateau_od'
+TIME_MU_MAX = 'time_mu_max'
+
+# Number of consecutive measurements in each log-linear fit (5 * 15 min = 1.25 h)
+FIT_WINDOW = 5
+# ODs at or below this are treated as noise, log of them is meaningless
+MIN_OD = 1e-3
+# Quantile of all ODs of a series reported as plateau
+PLATEAU_QUANTILE = .95
+# Fits less linear than this are noise, not exponential growth
+MIN_R_SQUARED = .95
+# Series whose plateau isn't at least this many times their initial OD didn't grow, their fits are noise
+MIN_FOLD_CHANGE = 2
+# Fractions of the plateau between which the growth rate is fitted against the absorbance to estimate the inoculum
+# OD of uncalibrated runs; subtracting the early low value removes the inoculum, without adding it back
+# ln(OD - inoculum) overestimates the rate many times early in growth
+INOCULUM_FIT_RANGE = (.05, .5)
+
+
+def _pivot_series(
+        df: pd.DataFrame,
+        intensities: list[int],
+        column: str = OD_ESTIMATE,
+) -> (np.ndarray, np.ndarray, pd.MultiIndex):
+    """ Arrange each channel / intensity series as one column, aligned by measurement cycle
+
+    :param df: Pandas data frame with date in hours and cycle numbers, as returned by fuse_measurements
+    :param intensities: LED duty powers to include
+    :param column: column holding the OD values
+    :return: times (cycles x series), ODs (cycles x series), (channel, intensity) of each column
+    """
+
+    df = df.loc[df[INTENSITY].isin(intensities), [CHANNEL, INTENSITY, CYCLE, DATE, column]]
+    wide = df.pivot(index=CYCLE, columns=[CHANNEL, INTENSITY], values=[DATE, column])
+    return wide[DATE].to_numpy(dtype=float), wide[column].to_numpy(dtype=float), wide[DATE].columns
+
+
+def _window_sums(
+        values: np.ndarray,
+        window: int,
+) -> np.ndarray:
+    """ Sum over a sliding window along the first axis, for all columns at once
+
+    :param values: 2D array, NaN free
+    :param window: window length
+    :return: 2D array with len(values) - window + 1 rows
+    """
+
+    cumulative = np.zeros((values.shape[0] + 1, values.shape[1]))
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    return cumulative[window:] - cumulative[:-window]
+
+
+def estimate_inoculum(
+        times: np.ndarray,
+        ods: np.ndarray,
+        window: int = FIT_WINDOW,
+        fit_range: tuple[float, float] = INOCULUM_FIT_RANGE,
+        plateau_quantile: float = PLATEAU_QUANTILE,
+) -> np.ndarray:
+    """ Inoculum OD of every column from its growth, for ODs offset by it
+
+    With logistic growth the growth rate is quadratic in the OD, zero at no cells and at the plateau:
+    dOD/dt = mu * OD * (1 - OD / K). The offset absorbance A = OD - inoculum shifts both roots, so the lower root
+    of a quadratic fit of dA/dt against A is minus the inoculum. Rates are secants over window measurements,
+    against the mean absorbance of the window, from the windows between the fit_range fractions of the plateau.
+
+    :param times: measurement times in hours, one column per series
+    :param ods: baseline corrected absorbances, same shape as times
+    :param window: number of consecutive measurements per secant
+    :param fit_range: (low, high) fractions of the plateau to fit between
+    :param plateau_quantile: quantile of the absorbances taken as plateau
+    :return: 1D array with the inoculum OD of every column, NaN where it can't be estimated (no growth)
+    """
+
+    n_columns = ods.shape[1]
+    inoculum = np.full(n_columns, np.nan)
+    if ods.shape[0] <= window:
+        return inoculum
+    finite = np.isfinite(ods) & np.isfinite(times)
+    count = _window_sums(finite.astype(float), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = _window_sums(np.where(finite, ods, 0), window) / count
+        rate = (ods[window - 1:] - ods[:1 - window]) / (times[window - 1:] - times[:1 - window])
+    plateau = np.nanquantile(np.where(finite, ods, np.nan), plateau_quantile, axis=0)
+
+    for column in range(n_columns):
+        selected = ((count[:, column] == window) & np.isfinite(rate[:, column]) &
+                    (mean[:, column] > fit_range[0] * plateau[column]) &
+                    (mean[:, column] < fit_range[1] * plateau[column]))
+        if selected.sum() < 3 or not plateau[column] > 0:
+            continue
+        curvature, slope, intercept = np.polyfit(mean[selected, column], rate[selected, column], 2)
+        discriminant = slope ** 2 - 4 * curvature * intercept
+        if curvature >= 0 or discriminant <= 0:
+            # Not saturating growth
+            continue
+        lower_root = (-slope + np.sqrt(discriminant)) / (2 * curvature)
+        if lower_root < 0:
+            inoculum[column] = -lower_root
+    return inoculum
+
+
+def fit_growth(
+        times: np.ndarray,
+        ods: np.ndarray,
+        window: int = FIT_WINDOW,
+        min_od: float = MIN_OD,
+        plateau_quantile: float = PLATEAU_QUANTILE,
+        min_r_squared: float = MIN_R_SQUARED,
+        min_fold_change: float = MIN_FOLD_CHANGE,
+) -> dict[str, np.ndarray]:
+    """ Sliding window log-linear fit of every column at once
+
+    ln(OD) is fitted against time in each window of consecutive measurements, the steepest slope is the
+    maximum growth rate. Lag time is where the tangent at that point crosses the initial OD.
+    Only windows in which every OD is above min_od and the fit reaches min_r_squared are considered.
+    ODs have to be proportional to cell density, offsets distort the rate.
+
+    :param times: measurement times in hours, one column per series
+    :param ods: OD values, same shape as times
+    :param window: number of consecutive measurements per fit
+    :param min_od: ODs at or below this are ignored
+    :param plateau_quantile: quantile of the ODs reported as plateau
+    :param min_r_squared: minimum coefficient of determination of a fit
+    :param min_fold_change: minimum ratio of plateau to initial OD of a growing series
+    :return: dictionary of feature name to 1D array with one entry per column
+    """
+
+    n_columns = ods.shape[1]
+    with warnings.catch_warnings():
+        # Columns without any OD, e.g. without an inoculum estimate, get NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        plateau_od = np.nanquantile(np.where(np.isfinite(ods), ods, np.nan), plateau_quantile, axis=0)
+    if ods.shape[0] < window:
+        # Run too short for a single fit
+        nan_result = np.full(n_columns, np.nan)
+        return {MU_MAX: nan_result, DOUBLING_TIME: nan_result, LAG_TIME: nan_result,
+                TIME_MU_MAX: nan_result, PLATEAU_OD: plateau_od}
+
+    usable = (ods > min_od) & np.isfinite(times)
+    log_ods = np.log(np.where(usable, ods, 1))
+    # Relative to the first measurement to keep the sums of squares small
+    times = times - np.nanmin(times, axis=0)
+    times_usable = np.where(usable, times, 0)
+
+    count = _window_sums(usable.astype(float), window)
+    sum_t = _window_sums(times_usable, window)
+    sum_y = _window_sums(np.where(usable, log_ods, 0), window)
+    sum_tt = _window_sums(times_usable ** 2, window)
+    sum_ty = _window_sums(np.where(usable, times_usable * log_ods, 0), window)
+    sum_yy = _window_sums(np.where(usable, log_ods ** 2, 0), window)
+
+    variance_t = count * sum_tt - sum_t ** 2
+    variance_y = count * sum_yy - sum_y ** 2
+    covariance = count * sum_ty - sum_t * sum_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = covariance ** 2 / (variance_t * variance_y)
+        valid = (count == window) & (variance_t > 0) & (r_squared >= min_r_squared)
+        slopes = np.where(valid, covariance / variance_t, -np.inf)
+
+    # Initial OD: median of the usable ODs of the first window, NaN if there are none
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        initial_od = np.nanmedian(np.where(usable[:window], ods[:window], np.nan), axis=0)
+
+    best = np.argmax(slopes, axis=0)
+    columns = np.arange(n_columns)
+    mu_max = slopes[best, columns]
+    with np.errstate(invalid='ignore'):
+        found = np.isfinite(mu_max) & (mu_max > 0) & (plateau_od >= min_fold_change * initial_od)
+    mu_max = np.where(found, mu_max, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Centre of the steepest window
+        time_centre = sum_t[best, columns] / count[best, columns]
+        log_centre = sum_y[best, columns] / count[best, columns]
+        lag_time = np.clip(time_centre - (log_centre - np.log(initial_od)) / mu_max, 0, None)
+        doubling_time = np.log(2) / mu_max
+
+    return {
+        MU_MAX: mu_max,
+        DOUBLING_TIME: doubling_time,
+        LAG_TIME: np.where(found, lag_time, np.nan),
+        TIME_MU_MAX: np.where(found, time_centre, np.nan),
+        PLATEAU_OD: plateau_od,
+    }
+
+
+def growth_features(
+        df: pd.DataFrame,
+        models: pd.DataFrame | None = None,
+        intensities: list[int] | None = None,
+        inoculum_od: float | None = None,
+        window: int = FIT_WINDOW,
+        min_od: float = MIN_OD,
+        plateau_quantile: float = PLATEAU_QUANTILE,
+        min_r_squared: float = MIN_R_SQUARED,
+        min_fold_change: float = MIN_FOLD_CHANGE,
+) -> pd.DataFrame:
+    """ Growth features for every channel and intensity of a run
+
+    # Example usage:
+    growth_features(read_measurements('20241030-161800_output.csv'))
+
+    :param df: Pandas data frame as returned by read_measurements, left unchanged
+    :param models: Optional calibration models as returned by calibration.load_calibration,
+        features are fitted to the calibrated OD then
+    :param intensities: LED duty powers to fit, defaults to all but the dark measurement
+    :param inoculum_od: OD during the baseline window, added to the baseline corrected absorbance of
+        uncalibrated runs; the baseline is only subtracted from runs longer than its window. Defaults to the
+        median of the estimates of all intensities of a channel (see estimate_inoculum), channels without
+        an estimate get no features
+    :param window: number of consecutive measurements per fit
+    :param min_od: ODs at or below this are ignored
+    :param plateau_quantile: quantile of the ODs reported as plateau
+    :param min_r_squared: minimum coefficient of determination of a fit
+    :param min_fold_change: minimum ratio of plateau to initial OD of a growing series
+    :return: Pandas data frame indexed by (channel, intensity), times in hours, rates per hour
+    """
+
+    intensities = run_duty_cycles(df)[1:] if intensities is None else intensities
+    df = fuse_measurements(df, models=models)
+    times, ods, columns = _pivot_series(df, intensities)
+    if models is None and inoculum_od is None:
+        inoculum = pd.Series(estimate_inoculum(times, ods, window=window, plateau_quantile=plateau_quantile),
+                             index=columns)
+        # Inoculum is a property of the culture, not of the LED intensity it is measured at
+        ods = ods + inoculum.groupby(level=CHANNEL).transform('median').to_numpy()
+    elif models is None:
+        ods = ods + inoculum_od
+    features = fit_growth(
+        times,
+        ods,
+        window=window,
+        min_od=min_od,
+        plateau_quantile=plateau_quantile,
+        min_r_squared=min_r_squared,
+        min_fold_change=min_fold_change,
+    )
+    return pd.DataFrame(features, index=columns)[[LAG_TIME, MU_MAX, DOUBLING_TIME, TIME_MU_MAX, PLATEAU_OD]]
+
+
+def _run_growth_features(
+        csv_file_path: str,
+        **kwargs,
+) -> pd.DataFrame | None:
+    """ Read and fit one result file, used by the worker processes
+
+    :param csv_file_path: path of .csv result file
+    :param kwargs: passed on to growth_features
+    :return: Pandas data frame as returned by growth_features, None if the file could not be parsed
+    """
+
+    df = read_measurements(csv_file_path)
+    if df is None:
+        return None
+    return growth_features(df, **kwargs)
+
+
+def growth_features_for_runs(
+        csv_file_paths: list[str],
+        processes: int | None = None,
+        **kwargs,
+) -> pd.DataFrame:
+    """ Growth features for many result files, one file per worker process at a time
+
+    :param csv_file_paths: paths of .csv result files
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :param kwargs: passed on to growth_features
+    :return: Pandas data frame indexed by (run, channel, intensity), unreadable files are skipped
+    """
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(functools.partial(_run_growth_features, **kwargs), csv_file_paths))
+    runs = {}
+    for csv_file_path, result in zip(csv_file_paths, results):
+        if result is None:
+            print(f"Couldn't read {csv_file_path}, skipping")
+        else:
+            runs[csv_file_path] = result
+    if not runs:
+        return pd.DataFrame()
+    return pd.concat(runs, names=[RUN])
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Extract growth curve features from result files")
+    parser.add_argument(
+        "--input", "-i",
+        nargs='+',
+        help="input filename(s)",
+        required=True,
+    )
+    parser.add_argument(
+        "--output", "-o",
+        help="Output .csv file path for the feature table, printed only if not given",
+        default=None,
+    )
+    parser.add_argument(
+        "--window", "-w",
+        type=int,
+        help=f"Number of consecutive measurements per log-linear fit, defaults to {FIT_WINDOW}",
+        default=FIT_WINDOW,
+    )
+    parser.add_argument(
+        "--calibration", "-c",
+        help="file path for calibration models as written by Photometer.calibration, optional",
+        default=None,
+    )
+    parser.add_argument(
+        "--inoculum_od",
+        type=float,
+        help="OD of the cultures during the first hours, for uncalibrated runs, estimated from the growth if not given",
+        default=None,
+    )
+    parser.add_argument(
+        "--processes", "-p",
+        type=int,
+        help="Number of worker processes, defaults to the number of CPUs",
+        default=None,
+    )
+    args = parser.parse_args(argv)
+
+    features = growth_features_for_runs(
+        args.input,
+        processes=args.processes,
+        models=load_calibration(args.calibration) if args.calibration is not None else None,
+        inoculum_od=args.inoculum_od,
+        window=args.window,
+    )
+    print(features.to_string())
+    if args.output is not None:
+        with atomic_write(args.output) as f:
+            features.to_csv(f, sep='\t')
+
+
+if __name__ == '__main__':
+    main()
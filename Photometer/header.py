@@ -0,0 +1,185 @@
+""" Self describing header of result files, written by the firmware and read by the host.
+Runs on the Pico (MicroPython) and on the host.
+
+Every header line is HEADER_PREFIX key SEPERATOR JSON value and precedes the result rows:
+#schema	{"version": 2, "columns": ["Date", "Channel", "Detector", "Intensity", "0", "1", "2"], "types": [...]}
+#firmware	"0.4.0"
+#start	"20241030-161800"
+#profile	{"name": "default", "pwm_duty_cycles": [...], "resistor_led_gpio_pairs": [...], ...}
+
+The profile line is written again between result rows whenever a command changes settings of the running
+photometer, rows after it are measured with the new settings (see read_entries and Photometer.command).
+"""
+
+import json
+
+from Photometer.constants import (
+    SEPERATOR,
+    DATE,
+    CHANNEL,
+    DETECTOR,
+    INTENSITY,
+)
+
+# Raised whenever the header layout changes in a way older readers can't handle
+# 2: TYPE_EPOCH time stamps
+HEADER_VERSION = 2
+
+HEADER_PREFIX = '#'
+HEADER_SCHEMA = 'schema'
+HEADER_FIRMWARE = 'firmware'
+HEADER_START = 'start'
+# Also written between result rows once settings change while running, see Photometer.command
+HEADER_PROFILE = 'profile'
+# Written between result rows, see Photometer.health
+HEADER_ALERT = 'alert'
+# Written after the header, see Photometer.self_test
+HEADER_SELF_TEST = 'self_test'
+# Written after the header if cycles are scheduled, see Photometer.schedule
+HEADER_SCHEDULE = 'schedule'
+# Written between result rows for every command received while running, see Photometer.command
+HEADER_COMMAND = 'command'
+# Written after the rows of a blank cycle, see Photometer.command and Photometer.processing.blank_values
+HEADER_BLANK = 'blank'
+
+# Keys of the blank entry: time stamp of the end of the blank cycle,
+# list of [LED anode, LED duty power, repeat median] per row of the cycle
+BLANK_TIME = 'time'
+BLANK_READINGS = 'readings'
+
+# Keys of the schema entry
+SCHEMA_VERSION = 'version'
+SCHEMA_COLUMNS = 'columns'
+SCHEMA_TYPES = 'types'
+
+# Column types: time string, integer seconds since the epoch, GPIO number / duty power, unsigned 16 bit ADC reading
+TYPE_TIME = 'time'
+TYPE_EPOCH = 'epoch'
+TYPE_INT = 'int'
+TYPE_U16 = 'u16'
+
+
+def result_schema(
+        measurement_repeats: int,
+        epoch_timestamps: bool = False,
+) -> dict:
+    """ Column schema of result rows as written by Photometer.format_result
+
+    :param measurement_repeats: number of repeat readings per row
+    :param epoch_timestamps: whether rows are time stamped in seconds since the epoch instead of time strings
+    :return: schema dictionary
+    """
+
+    return {
+        SCHEMA_VERSION: HEADER_VERSION,
+        SCHEMA_COLUMNS: [DATE, CHANNEL, DETECTOR, INTENSITY] + [str(i) for i in range(measurement_repeats)],
+        SCHEMA_TYPES: [TYPE_EPOCH if epoch_timestamps else TYPE_TIME, TYPE_INT, TYPE_INT, TYPE_INT] +
+                      [TYPE_U16] * measurement_repeats,
+    }
+
+
+def header_line(
+        key: str,
+        value,
+) -> str:
+    """ Format one header line of a result file
+
+    :param key: header entry name
+    :param value: JSON serialisable value
+    :return: header line without line break
+    """
+
+    return f"{HEADER_PREFIX}{key}{SEPERATOR}{json.dumps(value)}"
+
+
+def header_lines(
+        profile: dict,
+        firmware_version: str,
+        start_time: str,
+        measurement_repeats: int,
+        epoch_timestamps: bool = False,
+) -> list[str]:
+    """ All header lines of a new result file
+
+    :param profile: run profile, see Photometer.profile
+    :param firmware_version: version of the firmware writing the file
+    :param start_time: time string of the start of the run
+    :param measurement_repeats: number of repeat readings per row
+    :param epoch_timestamps: whether rows are time stamped in seconds since the epoch
+    :return: list of header lines without line breaks
+    """
+
+    return [
+        header_line(HEADER_SCHEMA, result_schema(measurement_repeats, epoch_timestamps=epoch_timestamps)),
+        header_line(HEADER_FIRMWARE, firmware_version),
+        header_line(HEADER_START, start_time),
+        header_line(HEADER_PROFILE, profile),
+    ]
+
+
+def parse_header_line(line: str) -> (str, object):
+    """ Parse one header line of a result file
+
+    :param line: header line, with or without line break
+    :return: header entry name and value, raises ValueError for incomplete lines
+    """
+
+    key, _, value = line[len(HEADER_PREFIX):].rstrip('\r\n').partition(SEPERATOR)
+    return key, json.loads(value)
+
+
+def read_header(file_path: str) -> dict:
+    """ Read the header lines at the start of a result file
+
+    :param file_path: path of .csv result file
+    :return: dictionary of header entries, empty for files written before headers were introduced
+    """
+
+    # Host only, imported here so the firmware doesn't carry the stream decoder
+    from Photometer.decode import open_result
+
+    header = {}
+    with open_result(file_path) as f:
+        for line in f:
+            if not line.startswith(HEADER_PREFIX):
+                break
+            try:
+                key, value = parse_header_line(line)
+            except ValueError:
+                # Incomplete line of a file still being written
+                break
+            header[key] = value
+    schema = header.get(HEADER_SCHEMA)
+    if schema is not None and schema[SCHEMA_VERSION] > HEADER_VERSION:
+        raise ValueError(f"Header version {schema[SCHEMA_VERSION]} of {file_path} is newer than the supported "
+                         f"version {HEADER_VERSION}, update the host scripts")
+    return header
+
+
+def read_entries(
+        file_path: str,
+        keys: tuple,
+) -> dict:
+    """ Entries of the given names anywhere in a result file, in the header and between the result rows
+
+    :param file_path: path of .csv result file
+    :param keys: names of the entries to collect
+    :return: dictionary of entry name to list of values in file order
+    """
+
+    # Host only, imported here so the firmware doesn't carry the stream decoder
+    from Photometer.decode import open_result
+
+    entries = {key: [] for key in keys}
+    with open_result(file_path) as f:
+        for line in f:
+            if not line.startswith(HEADER_PREFIX):
+                continue
+            try:
+                key, value = parse_header_line(line)
+            except ValueError:
+                # Incomplete line of a file still being written
+                continue
+            if key in entries:
+                entries[key].append(value)
+    return entries
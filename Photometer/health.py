@@ -0,0 +1,238 @@
+""" Streaming health checks of LED / photoresistor channels during a run, with constant work and state per row.
+Runs on the Pico (MicroPython) and on the host.
+
+Checks per channel:
+- stuck: all repeat readings of a row identical (or pinned at 0 / MAX_U16) for STUCK_ROWS rows in a row
+- contrast: brightest minus dark reading below MIN_CONTRAST and collapsed below CONTRAST_DROP of the last healthy
+  contrast of the channel, for CONTRAST_CYCLES cycles in a row. A growing culture lowers the contrast over many
+  cycles and moves the reference along, a failing LED or photoresistor loses it from one cycle to the next.
+- variance: spread of the repeat readings jumps above VARIANCE_JUMP times its running average
+Alerts are raised when a check starts failing and cleared once it passes again.
+Channels taken out of the cycles are still measured every few cycles, backing off while they keep failing,
+so a transient fault clears its alert and brings the channel back.
+"""
+
+import json
+
+from Photometer.constants import (
+    MAX_U16,
+    SEPERATOR,
+)
+from Photometer.header import (
+    HEADER_PREFIX,
+    HEADER_ALERT,
+)
+
+# Rows with identical repeat readings before a channel counts as stuck
+STUCK_ROWS = 3
+# Minimum raw difference between brightest and dark reading, and cycles below it before alerting
+MIN_CONTRAST = 100
+CONTRAST_CYCLES = 3
+# Fraction of the last healthy contrast below which a low contrast counts as lost rather than absorbed by a
+# dense culture, a culture doesn't grow that much denser within one cycle
+CONTRAST_DROP = .25
+# Spread of a row compared to the running average spread of its channel / intensity series
+VARIANCE_JUMP = 5
+# Spreads below this are treated as this, so noise free readings don't trigger on a single count
+MIN_SPREAD = 5
+# Weight of a new row in the running average spread, and rows needed before judging
+SPREAD_WEIGHT = .1
+SPREAD_ROWS = 5
+
+ALERT_STUCK = 'stuck'
+ALERT_CONTRAST = 'contrast'
+ALERT_VARIANCE = 'variance'
+# Checks that take a channel out of future cycles if exclusion is enabled
+EXCLUDING_ALERTS = (ALERT_STUCK, ALERT_CONTRAST)
+# Skipped cycles of an excluded channel before it is measured again to see whether it recovered,
+# doubled after every probe that still fails, up to the maximum
+PROBE_CYCLES = 4
+MAX_PROBE_CYCLES = 32
+
+# Keys of an alert record
+ALERT_TIME = 'time'
+ALERT_CHANNEL = 'channel'
+ALERT_INTENSITY = 'intensity'
+ALERT_KIND = 'kind'
+ALERT_VALUE = 'value'
+ALERT_ACTIVE = 'active'
+
+
+class HealthMonitor:
+    """ Track stuck readings, dark / bright contrast and spread jumps of every channel
+
+    # Example usage:
+    monitor = HealthMonitor(dark_intensity=0, bright_intensity=65535)
+    for alert in monitor.update(time_stamp, channel=0, intensity=65535, readings=[20070, 20034, 20003]):
+        print(alert)
+    if monitor.is_failing(0):
+        ...
+    """
+
+    def __init__(
+            self,
+            dark_intensity: int,
+            bright_intensity: int,
+    ):
+        """ Initialize HealthMonitor.
+
+        :param dark_intensity: LED duty power of the dark measurement
+        :param bright_intensity: LED duty power the contrast to the dark measurement is checked at
+        """
+
+        self.dark_intensity = dark_intensity
+        self.bright_intensity = bright_intensity
+        # Per channel: consecutive stuck rows, consecutive low contrast cycles, last dark median,
+        # contrast of the last cycle that passed the check
+        self.stuck_rows = {}
+        self.low_contrast_cycles = {}
+        self.dark = {}
+        self.contrast = {}
+        # Per (channel, intensity): running average spread and number of rows seen
+        self.spread = {}
+        self.spread_rows = {}
+        # Active alerts as (channel, intensity, kind)
+        self.active = set()
+        # Per excluded channel: cycles skipped since the last probe, cycles to skip before the next one
+        self.skipped_cycles = {}
+        self.probe_cycles = {}
+
+    def _set(
+            self,
+            alerts: list,
+            time_stamp,
+            channel: int,
+            intensity: int | None,
+            kind: str,
+            failing: bool,
+            value,
+    ) -> None:
+        """ Add an alert record if a check changed from passing to failing or back """
+
+        key = (channel, intensity, kind)
+        if failing == (key in self.active):
+            return
+        if failing:
+            self.active.add(key)
+        else:
+            self.active.discard(key)
+        alerts.append({
+            ALERT_TIME: time_stamp,
+            ALERT_CHANNEL: channel,
+            ALERT_INTENSITY: intensity,
+            ALERT_KIND: kind,
+            ALERT_VALUE: value,
+            ALERT_ACTIVE: failing,
+        })
+
+    def update(
+            self,
+            time_stamp,
+            channel: int,
+            intensity: int,
+            readings: list[int],
+    ) -> list[dict]:
+        """ Check one result row
+
+        :param time_stamp: time stamp of the row, copied to alerts
+        :param channel: channel (LED anode GPIO) of the row
+        :param intensity: LED duty power of the row
+        :param readings: repeat readings of the row
+        :return: list of alert records raised or cleared by this row, usually empty
+        """
+
+        alerts = []
+        low, high = min(readings), max(readings)
+        median = sorted(readings)[len(readings) // 2]
+
+        # Identical readings: a real ADC always shows some noise over several repeats
+        if len(readings) > 1:
+            stuck = low == high or high == 0 or low == MAX_U16
+            self.stuck_rows[channel] = self.stuck_rows.get(channel, 0) + 1 if stuck else 0
+            # Channel wide check, not tied to one intensity
+            self._set(alerts, time_stamp, channel, None, ALERT_STUCK,
+                      self.stuck_rows[channel] >= STUCK_ROWS, median)
+
+        # Raw readings rise with light, the bright reading has to stay clearly above the dark one
+        if intensity == self.dark_intensity:
+            self.dark[channel] = median
+        elif intensity == self.bright_intensity and channel in self.dark:
+            contrast = median - self.dark[channel]
+            reference = self.contrast.get(channel)
+            low = contrast < MIN_CONTRAST and (reference is None or contrast < CONTRAST_DROP * reference)
+            if not low:
+                # Lost contrast is not taken over, so a failing channel keeps failing
+                self.contrast[channel] = contrast
+            self.low_contrast_cycles[channel] = self.low_contrast_cycles.get(channel, 0) + 1 if low else 0
+            self._set(alerts, time_stamp, channel, intensity, ALERT_CONTRAST,
+                      self.low_contrast_cycles[channel] >= CONTRAST_CYCLES, contrast)
+
+        if self.stuck_rows.get(channel, 0):
+            # Stuck rows say nothing about the noise of a channel, a recovering channel would trip the check
+            return alerts
+        key = (channel, intensity)
+        spread = max(high - low, MIN_SPREAD)
+        rows = self.spread_rows.get(key, 0)
+        if rows >= SPREAD_ROWS:
+            self._set(alerts, time_stamp, channel, intensity, ALERT_VARIANCE,
+                      spread > VARIANCE_JUMP * self.spread[key], spread)
+        # Jumps are not averaged in, so a lasting jump keeps alerting instead of becoming the new normal
+        if rows < SPREAD_ROWS or spread <= VARIANCE_JUMP * self.spread[key]:
+            self.spread[key] = spread if rows == 0 else \
+                self.spread[key] + SPREAD_WEIGHT * (spread - self.spread[key])
+        self.spread_rows[key] = rows + 1
+        return alerts
+
+    def is_failing(self, channel: int) -> bool:
+        """ Whether a check that warrants excluding the channel is failing
+
+        :param channel: channel (LED anode GPIO)
+        :return: True if stuck or without contrast
+        """
+
+        return any(c == channel and kind in EXCLUDING_ALERTS for c, _, kind in self.active)
+
+    def skip_cycle(self, channel: int) -> bool:
+        """ Whether to leave a failing channel out of the next cycle, called once per cycle and channel
+
+        Failing channels are measured again after PROBE_CYCLES skipped cycles; the rows of that probe clear
+        the alerts if the fault is gone. The wait doubles with every failed probe up to MAX_PROBE_CYCLES.
+
+        :param channel: channel (LED anode GPIO)
+        :return: True to skip the channel, False to measure it
+        """
+
+        if not self.is_failing(channel):
+            self.skipped_cycles.pop(channel, None)
+            self.probe_cycles.pop(channel, None)
+            return False
+        skipped = self.skipped_cycles.get(channel, 0)
+        if skipped < self.probe_cycles.setdefault(channel, PROBE_CYCLES):
+            self.skipped_cycles[channel] = skipped + 1
+            return True
+        self.skipped_cycles[channel] = 0
+        self.probe_cycles[channel] = min(2 * self.probe_cycles[channel], MAX_PROBE_CYCLES)
+        return False
+
+
+def read_alerts(file_path: str) -> list[dict]:
+    """ Alert records written into a result file by Photometer, as HEADER_ALERT lines between the rows
+
+    :param file_path: path of .csv result file
+    :return: list of alert records in file order
+    """
+
+    # Host only, imported here so the firmware doesn't carry the stream decoder
+    from Photometer.decode import open_result
+
+    prefix = f"{HEADER_PREFIX}{HEADER_ALERT}{SEPERATOR}"
+    alerts = []
+    with open_result(file_path) as f:
+        for line in f:
+            if line.startswith(prefix):
+                try:
+                    alerts.append(json.loads(line[len(prefix):]))
+                except ValueError:
+                    # Incomplete line of a file still being written
+                    pass
+    return alerts
@@ -0,0 +1,38 @@
+""" Oversampled readings: every repeat is the mean of back to back ADC reads over an integration window
+of whole LED PWM periods, which also spans whole periods of mains light flicker.
+Runs on the Pico (MicroPython) and on the host.
+
+The mean over whole periods is the DC term of a lock-in demodulation: the PWM ripple and its harmonics, as well as
+100 / 120 Hz ambient flicker, average out instead of adding noise to single reads taken at arbitrary phases.
+Ambient light itself is still taken care of by the dark measurement of every cycle.
+"""
+
+# Integration window per repeat; 50 ms holds 5 periods of 100 Hz and 6 periods of 120 Hz flicker
+OVERSAMPLE_WINDOW_SECONDS = .05
+# Flicker frequencies of mains powered light, the window should span whole periods of these
+FLICKER_FREQUENCIES = (100, 120)
+
+
+def integration_window_us(
+        window_seconds: float,
+        pwm_frequency: int,
+) -> int:
+    """ Integration window rounded to whole PWM periods
+
+    :param window_seconds: requested window
+    :param pwm_frequency: LED PWM frequency in Hz
+    :return: window in microseconds, at least one PWM period
+    """
+
+    periods = max(round(window_seconds * pwm_frequency), 1)
+    return periods * 1000000 // pwm_frequency
+
+
+def flicker_residual(window_seconds: float) -> float:
+    """ Largest fraction of a flicker period the window is off from whole periods, 0 for an ideal window
+
+    :param window_seconds: integration window
+    :return: fraction of a period, within [0, .5]
+    """
+
+    return max(abs(window_seconds * f - round(window_seconds * f)) for f in FLICKER_FREQUENCIES)
@@ -0,0 +1,169 @@
+""" Plotting helpers shared by the figure scripts: style presets, series selection, axis layout and saving.
+
+Processing is left to Photometer.processing, so every figure goes through the same pipeline.
+matplotlib is only imported once a figure is drawn, pyplot alone takes about half a second to load.
+
+# Example usage:
+with style_context(STYLE_PAPER) as style:
+    fig, ax = plt.subplots()
+    for ch, intensity, df_series in iter_series(df, intensities=[32767]):
+        ax.plot(df_series[DATE], df_series[MEDIAN], c=style[STYLE_LINE_COLOR])
+    format_od_axis(ax)
+    save_figure(fig, 'fig.pdf', style)
+"""
+
+import contextlib
+
+from Photometer.constants import (
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.files import atomic_path
+
+# Style presets
+STYLE_SCREEN = 'screen'
+STYLE_PAPER = 'paper'
+STYLE_SEMINAR = 'seminar'
+
+# Keys of a style: matplotlib rc parameters, colour of single colour lines (None cycles colours),
+# whether images get a transparent background
+STYLE_RC = 'rc'
+STYLE_LINE_COLOR = 'line_color'
+STYLE_TRANSPARENT = 'transparent'
+
+# Default OD range of the y-axis
+YAXIS_MIN = .0004
+YAXIS_MAX = 2.5
+OD_LABEL = 'OD$_{600}$'
+DPI = 300
+# Points per series a plot should get at most, about the pixel width of an axis at screen resolution
+PLOT_POINTS = 1000
+
+# Helvetica set in LaTeX, fonts embedded as TrueType so they stay editable in PDF and PS output
+_LATEX_RC = {
+    'font.family': 'sans-serif',
+    'font.sans-serif': 'Helvetica',
+    'text.usetex': True,
+    'text.latex.preamble': r'\usepackage{cmbright}',
+    'mathtext.fontset': 'custom',
+    'mathtext.rm': 'Helvetica',
+    'pdf.fonttype': 42,
+    'ps.fonttype': 42,
+}
+
+
+def _text_color_rc(color: str) -> dict:
+    return {
+        'ytick.color': color,
+        'xtick.color': color,
+        'axes.labelcolor': color,
+        'axes.edgecolor': color,
+    }
+
+
+STYLES = {
+    # matplotlib defaults, for the live figures of create_figure
+    STYLE_SCREEN: {
+        STYLE_RC: {},
+        STYLE_LINE_COLOR: None,
+        STYLE_TRANSPARENT: False,
+    },
+    STYLE_PAPER: {
+        STYLE_RC: {**_LATEX_RC, **_text_color_rc('black')},
+        STYLE_LINE_COLOR: None,
+        STYLE_TRANSPARENT: False,
+    },
+    # White on transparent, for dark slides
+    STYLE_SEMINAR: {
+        STYLE_RC: {**_LATEX_RC, **_text_color_rc('white')},
+        STYLE_LINE_COLOR: 'white',
+        STYLE_TRANSPARENT: True,
+    },
+}
+
+
+@contextlib.contextmanager
+def style_context(style: str = STYLE_SCREEN):
+    """ Draw with a style preset, matplotlib settings are restored afterwards
+
+    :param style: name of the preset, see STYLES
+    :return: style dictionary
+    """
+
+    import matplotlib as mpl
+
+    if style not in STYLES:
+        raise ValueError(f"Unknown style {style}, choose from {', '.join(STYLES)}")
+    with mpl.rc_context(STYLES[style][STYLE_RC]):
+        yield STYLES[style]
+
+
+def iter_series(
+        df,
+        channels: list[int] | None = None,
+        intensities: list[int] | None = None,
+):
+    """ Channel / intensity series of a data frame, grouped once instead of masking the frame per series
+
+    :param df: Pandas data frame with CHANNEL and INTENSITY columns
+    :param channels: channels in the order to yield, defaults to all in order of appearance
+    :param intensities: intensities in the order to yield, defaults to all in order of appearance
+    :return: generator of (channel, intensity, data frame of the series); missing series are left out
+    """
+
+    groups = df.groupby([CHANNEL, INTENSITY], sort=False).indices
+    channels = df[CHANNEL].unique() if channels is None else channels
+    intensities = df[INTENSITY].unique() if intensities is None else intensities
+    for ch in channels:
+        for intensity in intensities:
+            positions = groups.get((ch, intensity))
+            if positions is not None:
+                yield ch, intensity, df.iloc[positions]
+
+
+def format_od_axis(
+        ax,
+        yaxis_min: float | None = YAXIS_MIN,
+        yaxis_max: float | None = YAXIS_MAX,
+        ylabel: str | None = OD_LABEL,
+) -> None:
+    """ Log scaled OD axis with grid
+
+    :param ax: matplotlib axis
+    :param yaxis_min: min value on the y-axis, None leaves it to matplotlib
+    :param yaxis_max: max value on the y-axis, None leaves it to matplotlib
+    :param ylabel: label of the y-axis, None leaves it unset
+    :return: None
+    """
+
+    if yaxis_min is not None or yaxis_max is not None:
+        ax.set_ylim(yaxis_min, yaxis_max)
+    ax.set_yscale('log')
+    ax.grid(visible='both', which='both', zorder=0)
+    if ylabel is not None:
+        ax.set_ylabel(ylabel)
+
+
+def save_figure(
+        fig,
+        image_file_path: str,
+        style: dict = STYLES[STYLE_SCREEN],
+) -> None:
+    """ Save and close a figure, written atomically so readers never pick up a half-written image
+
+    :param fig: matplotlib figure
+    :param image_file_path: path to save the image under, the format follows its extension
+    :param style: style dictionary as yielded by style_context
+    :return: None
+    """
+
+    from matplotlib import pyplot as plt
+
+    with atomic_path(image_file_path) as tmp_path:
+        fig.savefig(
+            tmp_path,
+            bbox_inches='tight',
+            dpi=DPI,
+            transparent=style[STYLE_TRANSPARENT],
+        )
+    plt.close(fig)
@@ -0,0 +1,630 @@
+""" Host side processing of photometer result files, shared by the figure scripts and the analysis tools. """
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    SEPERATOR,
+    MAX_U16,
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.header import (
+    read_header,
+    read_entries,
+    result_schema,
+    HEADER_PREFIX,
+    HEADER_SCHEMA,
+    HEADER_PROFILE,
+    HEADER_BLANK,
+    BLANK_READINGS,
+    SCHEMA_COLUMNS,
+    SCHEMA_TYPES,
+    TYPE_TIME,
+    TYPE_EPOCH,
+    TYPE_INT,
+    TYPE_U16,
+)
+from Photometer.profile import (
+    default_profile,
+    merge_profiles,
+    PROFILE_PWM_DUTY_CYCLES,
+    PROFILE_REPEATS,
+)
+from Photometer.decode import (
+    is_stream,
+    open_result,
+    StreamReader,
+)
+
+# Column names added during processing
+MEDIAN = 'med'
+FULLY_DARK = 'fully_dark'
+CYCLE = 'cycle'
+
+# Default processing parameters
+MEDIAN_WINDOW = 5
+# Hours used to find the low (~OD 0) measurement of each channel and intensity
+BASELINE_WINDOW_HOURS = (1, 10)
+BASELINE_QUANTILE = .01
+# OD the dark value is extrapolated to
+OD_SCALE = 2.5
+
+# Rows per chunk of read_medians, about 1 MiB of 11 repeat rows in memory at a time
+CHUNK_ROWS = 2 ** 14
+# Characters MedianTail reads at once, about as many rows as CHUNK_ROWS
+TAIL_READ_CHARS = 2 ** 20
+# Entries between the rows that change how earlier rows are processed
+LAYOUT_ENTRIES = (HEADER_PROFILE, HEADER_BLANK)
+
+# Header column types to fixed dtypes; keys stay int64 so they join with models and reference tables
+SCHEMA_DTYPES = {
+    TYPE_EPOCH: 'int64',
+    TYPE_INT: 'int64',
+    TYPE_U16: 'uint16',
+}
+
+
+def schema_parser(schema: dict) -> (list, dict):
+    """ Column names and fixed dtypes for pd.read_csv from a header schema
+
+    Repeat columns are named by their integer index, as expected by repeat_columns.
+    Time strings get no dtype, they are parsed as dates; epoch time stamps are read as int64.
+
+    :param schema: schema dictionary, see Photometer.header.result_schema
+    :return: list of column names, dictionary of column name to dtype
+    """
+
+    names = []
+    dtypes = {}
+    for column, column_type in zip(schema[SCHEMA_COLUMNS], schema[SCHEMA_TYPES]):
+        name = int(column) if column_type == TYPE_U16 else column
+        names.append(name)
+        if column_type != TYPE_TIME:
+            dtypes[name] = SCHEMA_DTYPES[column_type]
+    return names, dtypes
+
+
+def _read_layout(
+        csv_file_path: str,
+        measurement_repeats: int | None = None,
+        entries: dict | None = None,
+) -> (dict, dict, dict, dict):
+    """ Header, run profile and pd.read_csv options of a result file
+
+    :param csv_file_path: path of .csv result file
+    :param measurement_repeats: number of repeat columns per row, overrides the header of the file
+    :param entries: LAYOUT_ENTRIES of the file as returned by read_entries, read from the file if None
+    :return: header dictionary, run profile, keyword arguments for pd.read_csv without source and dtype
+    """
+
+    header = read_header(csv_file_path)
+    entries = read_entries(csv_file_path, LAYOUT_ENTRIES) if entries is None else entries
+    # Duty powers changed while running are added to those of the header
+    profile = merge_profiles(entries[HEADER_PROFILE])
+    if entries[HEADER_BLANK]:
+        # The latest blank of the run, see blank_values
+        header[HEADER_BLANK] = entries[HEADER_BLANK][-1]
+    if measurement_repeats is not None:
+        profile[PROFILE_REPEATS] = measurement_repeats
+        schema = result_schema(measurement_repeats)
+    else:
+        schema = header.get(HEADER_SCHEMA, result_schema(profile[PROFILE_REPEATS]))
+    names, dtypes = schema_parser(schema)
+    options = {
+        'sep': SEPERATOR,
+        'header': None,
+        'names': names,
+        'comment': HEADER_PREFIX,
+        'date_format': '%Y%m%d-%H%M%S',
+        # Epoch time stamps need no date parsing at all
+        'parse_dates': [] if DATE in dtypes else [DATE],
+    }
+    return header, profile, options, dtypes
+
+
+def _source(csv_file_path: str):
+    """ What pd.read_csv reads: the path of text result files, a decoding reader of streams (see Photometer.decode)
+
+    :param csv_file_path: path of .csv result file or stream
+    :return: path or text file object, a new one for every read
+    """
+
+    return StreamReader(csv_file_path) if is_stream(csv_file_path) else csv_file_path
+
+
+def read_measurements(
+        csv_file_path: str,
+        measurement_repeats: int | None = None,
+) -> pd.DataFrame | None:
+    """ Read a result file as written by Photometer.save_result
+
+    Columns and dtypes come from the schema in the file header (see Photometer.header), so no types are inferred.
+    Files without header are read with the layout of their run profile, or of Photometer.constants.
+    All header entries are kept in df.attrs, the run profile under HEADER_PROFILE for the processing steps;
+    its LED duty powers include those set while running (see Photometer.profile.merge_profiles).
+    The latest blank written between the rows is kept under HEADER_BLANK (see blank_values).
+
+    :param csv_file_path: path of .csv result file
+    :param measurement_repeats: number of repeat columns per row, overrides the header of the file
+    :return: Pandas data frame with one row per measurement, None if the file could not be parsed
+    """
+
+    header, profile, options, dtypes = _read_layout(csv_file_path, measurement_repeats)
+    try:
+        df = pd.read_csv(_source(csv_file_path), dtype=dtypes, **options)
+    except pd.errors.ParserError:
+        return None
+    except ValueError:
+        # Missing values, usually the incomplete last row of a file still being written
+        df = pd.read_csv(_source(csv_file_path), **options).dropna(subset=list(dtypes)).astype(dtypes)
+    df.attrs.update(header)
+    df.attrs[HEADER_PROFILE] = profile
+    return df
+
+
+def iter_medians(
+        csv_file_path: str,
+        measurement_repeats: int | None = None,
+        chunk_rows: int = CHUNK_ROWS,
+):
+    """ Read a result file chunk by chunk, keeping only the flipped repeat median of each row
+
+    Header entries and run profile are set in df.attrs of every chunk, as by read_measurements.
+
+    :param csv_file_path: path of .csv result file
+    :param measurement_repeats: number of repeat columns per row, overrides the header of the file
+    :param chunk_rows: number of rows read at once
+    :return: generator of Pandas data frames in file order with column MEDIAN instead of the repeat columns,
+        raises pd.errors.ParserError if the file could not be parsed
+    """
+
+    header, profile, options, dtypes = _read_layout(csv_file_path, measurement_repeats)
+
+    def compact(chunk: pd.DataFrame) -> pd.DataFrame:
+        return _compact_medians(chunk, header, profile)
+
+    rows_read = 0
+    try:
+        with pd.read_csv(_source(csv_file_path), dtype=dtypes, chunksize=chunk_rows, **options) as reader:
+            for chunk in reader:
+                rows_read += len(chunk)
+                yield compact(chunk)
+        return
+    except pd.errors.ParserError:
+        raise
+    except ValueError:
+        pass
+    # Missing values, usually the incomplete last row of a file still being written:
+    # continue untyped after the rows already passed on
+    with pd.read_csv(_source(csv_file_path), chunksize=chunk_rows, **options) as reader:
+        for chunk in reader:
+            chunk = chunk.loc[chunk.index >= rows_read]
+            yield compact(chunk.dropna(subset=list(dtypes)).astype(dtypes))
+
+
+def _compact_medians(
+        chunk: pd.DataFrame,
+        header: dict,
+        profile: dict,
+) -> pd.DataFrame:
+    """ Replace the repeat columns of read rows by their flipped median, set header and run profile in df.attrs """
+
+    chunk = add_repeat_median(chunk).drop(columns=repeat_columns(chunk))
+    chunk.attrs.update(header)
+    chunk.attrs[HEADER_PROFILE] = profile
+    return chunk
+
+
+class MedianTail:
+    """ Rows appended to a result file since the last read, with the flipped repeat median like iter_medians
+
+    Only the part of the file added since the last read is read, rows are passed on once their line is complete.
+    A HEADER_PROFILE or HEADER_BLANK line written after the layout was read changes how earlier rows are
+    processed, and a file that was replaced or shrank is another run; both set restarted, the reader has to
+    be replaced then.
+
+    # Example usage:
+    tail = MedianTail('20241030-161800_output.csv')
+    for _ in watch_file('20241030-161800_output.csv'):
+        df_new = pd.concat(tail.read())
+    """
+
+    def __init__(
+            self,
+            csv_file_path: str,
+            measurement_repeats: int | None = None,
+            read_chars: int = TAIL_READ_CHARS,
+    ):
+        """ Initialize MedianTail.
+
+        :param csv_file_path: path of .csv result file
+        :param measurement_repeats: number of repeat columns per row, overrides the header of the file
+        :param read_chars: characters read at once
+        """
+
+        self.csv_file_path = csv_file_path
+        self.read_chars = read_chars
+        entries = read_entries(csv_file_path, LAYOUT_ENTRIES)
+        self.header, self.profile, self.options, self.dtypes = _read_layout(
+            csv_file_path, measurement_repeats, entries=entries,
+        )
+        self.entry_prefixes = tuple(f"{HEADER_PREFIX}{key}{SEPERATOR}" for key in LAYOUT_ENTRIES)
+        # Layout entries the layout was read with, more of them in the file mean the layout changed
+        self.entries = sum(len(values) for values in entries.values())
+        self.file = open_result(csv_file_path)
+        self.size = 0
+        # Start of a line not completely written yet
+        self.partial = ''
+        self.restarted = False
+
+    def read(self):
+        """ Read the rows appended since the last read
+
+        :return: generator of Pandas data frames in file order with column MEDIAN instead of the repeat columns,
+            nothing once restarted is set; raises pd.errors.ParserError if the rows could not be parsed
+        """
+
+        try:
+            stat = os.stat(self.csv_file_path)
+        except OSError:
+            # Being replaced
+            return
+        opened = os.fstat(self.file.fileno())
+        if (stat.st_dev, stat.st_ino) != (opened.st_dev, opened.st_ino) or stat.st_size < self.size:
+            self.restarted = True
+        if self.restarted:
+            return
+        self.size = stat.st_size
+        while True:
+            text = self.file.read(self.read_chars)
+            if not text:
+                break
+            text = self.partial + text
+            end = text.rfind('\n') + 1
+            lines, self.partial = text[:end], text[end:]
+            self.entries -= sum(line.startswith(self.entry_prefixes) for line in lines.splitlines())
+            if self.entries < 0:
+                self.restarted = True
+                return
+            try:
+                chunk = pd.read_csv(io.StringIO(lines), dtype=self.dtypes, **self.options)
+            except pd.errors.EmptyDataError:
+                # Only header lines
+                continue
+            except pd.errors.ParserError:
+                raise
+            except ValueError:
+                # Missing values, usually a line cut short by a restart of the Pico
+                chunk = pd.read_csv(io.StringIO(lines), **self.options)
+                chunk = chunk.dropna(subset=list(self.dtypes)).astype(self.dtypes)
+            yield _compact_medians(chunk, self.header, self.profile)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_medians(
+        csv_file_path: str,
+        measurement_repeats: int | None = None,
+        chunk_rows: int = CHUNK_ROWS,
+) -> pd.DataFrame | None:
+    """ Read a result file chunk by chunk, keeping only the flipped repeat median of each row
+
+    Peak memory is one chunk of full rows plus the compact result, however many repeats the run has.
+    The result is the same as read_measurements followed by add_repeat_median, without the repeat columns.
+
+    :param csv_file_path: path of .csv result file
+    :param measurement_repeats: number of repeat columns per row, overrides the header of the file
+    :param chunk_rows: number of rows read at once
+    :return: Pandas data frame with one row per measurement and column MEDIAN,
+        None if the file could not be parsed
+    """
+
+    try:
+        chunks = list(iter_medians(csv_file_path, measurement_repeats=measurement_repeats, chunk_rows=chunk_rows))
+    except pd.errors.ParserError:
+        return None
+    if not chunks:
+        return None
+    df = pd.concat(chunks, ignore_index=True)
+    df.attrs.update(chunks[0].attrs)
+    return df
+
+
+def run_duty_cycles(
+        df: pd.DataFrame,
+        pwm_duty_cycles: list[int] | None = None,
+) -> list[int]:
+    """ LED duty powers of a run: given ones, else those of the run profile, else those of Photometer.constants
+
+    :param df: Pandas data frame as returned by read_measurements
+    :param pwm_duty_cycles: explicitly given LED duty powers or None
+    :return: list of LED duty powers, first one is the dark measurement
+    """
+
+    if pwm_duty_cycles is not None:
+        return pwm_duty_cycles
+    return df.attrs.get(HEADER_PROFILE, default_profile())[PROFILE_PWM_DUTY_CYCLES]
+
+
+def repeat_columns(df: pd.DataFrame) -> list[int]:
+    """ Return the repeat measurement columns of a result data frame
+
+    :param df: Pandas data frame as returned by read_measurements
+    :return: list of repeat column names
+    """
+
+    return [c for c in df.columns if isinstance(c, int)]
+
+
+def epoch_seconds(dates: pd.Series) -> np.ndarray:
+    """ Seconds since the epoch of a date column, whether read from epoch time stamps or time strings
+
+    :param dates: int64 epoch seconds or datetime column
+    :return: int64 array of seconds
+    """
+
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.to_numpy(dtype='datetime64[s]').astype(np.int64)
+    return dates.to_numpy(dtype=np.int64)
+
+
+def convert_to_hours(df: pd.DataFrame) -> pd.DataFrame:
+    """ Convert the date column to hours since the first measurement, in place
+
+    :param df: Pandas data frame as returned by read_measurements
+    :return: the same data frame
+    """
+
+    seconds = epoch_seconds(df[DATE])
+    df[DATE] = (seconds - seconds.min()) / 3600 if seconds.size else seconds.astype(float)
+    return df
+
+
+def add_repeat_median(df: pd.DataFrame) -> pd.DataFrame:
+    """ Add the flipped median of the repeat measurements, in place
+
+    Measurements are flipped so low values are low measurements.
+
+    :param df: Pandas data frame as returned by read_measurements
+    :return: the same data frame
+    """
+
+    df[MEDIAN] = MAX_U16 - df[repeat_columns(df)].median(axis=1)
+    return df
+
+
+def add_dark_reference(
+        df: pd.DataFrame,
+        dark_intensity: int | None = None,
+) -> pd.DataFrame:
+    """ Add the no light measurement of the current cycle to every row, in place
+
+    The dark measurement of a channel precedes its other rows of a cycle, whether the cycle is measured
+    channel by channel or scheduled (see Photometer.schedule), so forward filling per channel
+    assigns each row the dark value of its own channel and cycle.
+
+    :param df: Pandas data frame with repeat median
+    :param dark_intensity: LED duty power used for the dark measurement, defaults to the first of the run
+    :return: the same data frame
+    """
+
+    dark_intensity = run_duty_cycles(df)[0] if dark_intensity is None else dark_intensity
+    df[FULLY_DARK] = df[MEDIAN].where(df[INTENSITY] == dark_intensity).groupby(df[CHANNEL]).ffill()
+    return df
+
+
+def add_cycle(df: pd.DataFrame) -> pd.DataFrame:
+    """ Number the measurement cycles of each channel / intensity series, in place
+
+    :param df: Pandas data frame as returned by read_measurements
+    :return: the same data frame
+    """
+
+    df[CYCLE] = df.groupby([CHANNEL, INTENSITY], sort=False).cumcount()
+    return df
+
+
+def smooth_series(
+        df: pd.DataFrame,
+        intensities: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+) -> pd.DataFrame:
+    """ Median filter each channel / intensity series, in place
+
+    :param df: Pandas data frame with repeat median
+    :param intensities: LED duty powers to process, defaults to all but the dark measurement
+    :param median_window: size of the median filter, series not longer than this are left as is
+    :return: the same data frame
+    """
+
+    # Imported here, scipy.ndimage is slow to load and only needed for filtering
+    from scipy.ndimage import median_filter
+
+    intensities = run_duty_cycles(df)[1:] if intensities is None else intensities
+    selected = df[INTENSITY].isin(intensities)
+    df.loc[selected, MEDIAN] = df.loc[selected].groupby([CHANNEL, INTENSITY], sort=False)[MEDIAN].transform(
+        lambda s: median_filter(s.to_numpy(), size=median_window, mode='nearest') if s.size > median_window else s
+    )
+    return df
+
+
+def early_low_values(
+        df: pd.DataFrame,
+        intensities: list[int] | None = None,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        column: str = MEDIAN,
+) -> pd.Series:
+    """ Low value of each channel / intensity series within the baseline window
+
+    :param df: Pandas data frame with repeat median, date in hours
+    :param intensities: LED duty powers to process, defaults to all but the dark measurement
+    :param baseline_window_hours: (start, end) hours to take the low value from
+    :param baseline_quantile: quantile of the early values used as low value
+    :param column: column to take the low value of
+    :return: Pandas series of low values indexed by (channel, intensity)
+    """
+
+    intensities = run_duty_cycles(df)[1:] if intensities is None else intensities
+    start, end = baseline_window_hours
+    in_window = df[INTENSITY].isin(intensities) & (df[DATE] > start) & (df[DATE] < end)
+    return df.loc[in_window].groupby([CHANNEL, INTENSITY])[column].quantile(baseline_quantile)
+
+
+def blank_values(
+        df: pd.DataFrame,
+        intensities: list[int] | None = None,
+) -> pd.Series | None:
+    """ Flipped repeat medians of the blank cycle of a run, measured on command (see Photometer.command)
+
+    :param df: Pandas data frame as returned by read_measurements
+    :param intensities: LED duty powers to take, defaults to all but the dark measurement
+    :return: Pandas series of blank values indexed by (channel, intensity) like early_low_values,
+        None if the run has no blank
+    """
+
+    blank = df.attrs.get(HEADER_BLANK)
+    if blank is None:
+        return None
+    intensities = run_duty_cycles(df)[1:] if intensities is None else intensities
+    readings = [reading for reading in blank[BLANK_READINGS] if reading[1] in intensities]
+    return pd.Series(
+        [MAX_U16 - reading[2] for reading in readings],
+        index=pd.MultiIndex.from_tuples([tuple(reading[:2]) for reading in readings], names=[CHANNEL, INTENSITY]),
+        dtype=float,
+    )
+
+
+def subtract_baseline(
+        df: pd.DataFrame,
+        intensities: list[int] | None = None,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        column: str = MEDIAN,
+        baseline: pd.Series | None = None,
+) -> pd.DataFrame:
+    """ Subtract the early low value of each channel / intensity series, in place
+
+    @todo: find alternative - Remove low measurement of first [1, 10] h to get ~OD 0 - not great but current best fix?
+
+    :param df: Pandas data frame with repeat median, date in hours
+    :param intensities: LED duty powers to process, defaults to all but the dark measurement
+    :param baseline_window_hours: (start, end) hours to take the low value from,
+        only subtracted once the run is longer than end
+    :param baseline_quantile: quantile of the early values used as low value
+    :param column: column to subtract the low value from
+    :param baseline: low values as returned by early_low_values, always subtracted if given;
+        taken from df if None
+    :return: the same data frame; series without low value, such as of duty powers set after the baseline
+        window (see Photometer.command), are left as they are
+    """
+
+    intensities = run_duty_cycles(df)[1:] if intensities is None else intensities
+    if baseline is None:
+        if not (df[DATE] > baseline_window_hours[1]).any():
+            return df
+        baseline = early_low_values(
+            df,
+            intensities=intensities,
+            baseline_window_hours=baseline_window_hours,
+            baseline_quantile=baseline_quantile,
+            column=column,
+        )
+    selected = df[INTENSITY].isin(intensities)
+    offsets = baseline.reindex(pd.MultiIndex.from_frame(df.loc[selected, [CHANNEL, INTENSITY]])).fillna(0).to_numpy()
+    df.loc[selected, column] = df.loc[selected, column] - offsets
+    return df
+
+
+def scale_to_od(
+        df: pd.DataFrame,
+        od_scale: float = OD_SCALE,
+) -> pd.DataFrame:
+    """ Extrapolate from dark value, set to od_scale, in place
+
+    @todo: correct for low value subtraction
+
+    :param df: Pandas data frame with dark reference
+    :param od_scale: OD assigned to the dark value
+    :return: the same data frame
+    """
+
+    df[MEDIAN] = (df[MEDIAN] / df[FULLY_DARK]) * od_scale
+    return df
+
+
+def process_medians(
+        df: pd.DataFrame,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        od_scale: float = OD_SCALE,
+) -> pd.DataFrame:
+    """ Run the processing after the repeat median: hours, dark reference, filter, baseline, OD, in place
+
+    The baseline is the blank of the run if it has one (see blank_values), else the early low value.
+
+    :param df: Pandas data frame with repeat median, as returned by read_medians
+    :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+        defaults to those of the run profile
+    :param median_window: size of the median filter
+    :param baseline_window_hours: (start, end) hours to take the low value from
+    :param baseline_quantile: quantile of the early values used as low value
+    :param od_scale: OD assigned to the dark value
+    :return: the same data frame, date in hours and column MEDIAN holding the OD estimate
+    """
+
+    pwm_duty_cycles = run_duty_cycles(df, pwm_duty_cycles)
+    convert_to_hours(df)
+    add_dark_reference(df, dark_intensity=pwm_duty_cycles[0])
+    smooth_series(df, intensities=pwm_duty_cycles[1:], median_window=median_window)
+    subtract_baseline(
+        df,
+        intensities=pwm_duty_cycles[1:],
+        baseline_window_hours=baseline_window_hours,
+        baseline_quantile=baseline_quantile,
+        baseline=blank_values(df, intensities=pwm_duty_cycles[1:]),
+    )
+    return scale_to_od(df, od_scale=od_scale)
+
+
+def process_measurements(
+        df: pd.DataFrame,
+        pwm_duty_cycles: list[int] | None = None,
+        median_window: int = MEDIAN_WINDOW,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        od_scale: float = OD_SCALE,
+) -> pd.DataFrame:
+    """ Run the full processing: hours, median, dark reference, filter, baseline (blank if there is one), OD
+
+    # Example usage:
+    df = process_measurements(read_measurements('20241030-161800_output.csv'))
+    df.loc[(df[CHANNEL] == 0) & (df[INTENSITY] == PWM_DUTY_CYCLES[2]), [DATE, MEDIAN]]
+
+    :param df: Pandas data frame as returned by read_measurements, left unchanged
+    :param pwm_duty_cycles: LED duty powers of the run, first one is the dark measurement,
+        defaults to those of the run profile
+    :param median_window: size of the median filter
+    :param baseline_window_hours: (start, end) hours to take the low value from
+    :param baseline_quantile: quantile of the early values used as low value
+    :param od_scale: OD assigned to the dark value
+    :return: new Pandas data frame with date in hours and column MEDIAN holding the OD estimate
+    """
+
+    df = add_repeat_median(df.copy())
+    return process_medians(
+        df,
+        pwm_duty_cycles=pwm_duty_cycles,
+        median_window=median_window,
+        baseline_window_hours=baseline_window_hours,
+        baseline_quantile=baseline_quantile,
+        od_scale=od_scale,
+    )
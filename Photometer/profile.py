@@ -0,0 +1,147 @@
+""" Run profiles: measurement settings loaded from a JSON file by the firmware and written into the output header,
+so host side readers parse every result file with the layout it was actually recorded with.
+Runs on the Pico (MicroPython) and on the host.
+
+# Example profile file (JSON), missing settings fall back to Photometer.constants:
+{
+    "name": "burst",
+    "pwm_duty_cycles": [0, 16383, 65535],
+    "measurement_repeats": 5,
+    "measurement_repeat_interval_seconds": 0.05,
+    "measurement_frequency_seconds": 60,
+    "measurement_led_warmup_seconds": 0.5
+}
+"""
+
+import json
+
+from Photometer.constants import (
+    PWM_DUTY_CYCLES,
+    RESISTOR_LED_GPIO_PAIRS,
+    MEASUREMENT_REPEATS,
+    MEASUREMENT_REPEAT_INTERVAL_SECONDS,
+    MEASUREMENT_FREQUENCY_SECONDS,
+    MEASUREMENT_LED_WARMUP_SECONDS,
+    MEASUREMENT_OVERSAMPLE_WINDOW_SECONDS,
+    MAX_U16,
+)
+from Photometer.header import (
+    read_header,
+    HEADER_PROFILE,
+)
+
+# Profile keys, apart from PROFILE_NAME named like the Photometer.__init__ parameters they set
+PROFILE_NAME = 'name'
+PROFILE_PWM_DUTY_CYCLES = 'pwm_duty_cycles'
+PROFILE_GPIO_PAIRS = 'resistor_led_gpio_pairs'
+PROFILE_REPEATS = 'measurement_repeats'
+PROFILE_REPEAT_INTERVAL = 'measurement_repeat_interval_seconds'
+PROFILE_FREQUENCY = 'measurement_frequency_seconds'
+PROFILE_WARMUP = 'measurement_led_warmup_seconds'
+PROFILE_OVERSAMPLE_WINDOW = 'measurement_oversample_window_seconds'
+
+DEFAULT_PROFILE_NAME = 'default'
+# Profile the firmware looks for in the folder mounted by mpremote
+PROFILE_FILE_PATH = '/remote/profile.json'
+
+
+def default_profile() -> dict:
+    """ Profile with the settings of Photometer.constants
+
+    :return: profile dictionary
+    """
+
+    return {
+        PROFILE_NAME: DEFAULT_PROFILE_NAME,
+        PROFILE_PWM_DUTY_CYCLES: list(PWM_DUTY_CYCLES),
+        PROFILE_GPIO_PAIRS: [list(pair) for pair in RESISTOR_LED_GPIO_PAIRS],
+        PROFILE_REPEATS: MEASUREMENT_REPEATS,
+        PROFILE_REPEAT_INTERVAL: MEASUREMENT_REPEAT_INTERVAL_SECONDS,
+        PROFILE_FREQUENCY: MEASUREMENT_FREQUENCY_SECONDS,
+        PROFILE_WARMUP: MEASUREMENT_LED_WARMUP_SECONDS,
+        PROFILE_OVERSAMPLE_WINDOW: MEASUREMENT_OVERSAMPLE_WINDOW_SECONDS,
+    }
+
+
+def check_profile(profile: dict) -> dict:
+    """ Validate a profile, raise ValueError on unknown keys or impossible settings
+
+    :param profile: profile dictionary
+    :return: the same profile
+    """
+
+    unknown = [key for key in profile if key not in default_profile()]
+    if unknown:
+        raise ValueError(f"Unknown profile settings: {unknown}")
+    duty_cycles = profile[PROFILE_PWM_DUTY_CYCLES]
+    if not duty_cycles or any(not 0 <= duty <= MAX_U16 for duty in duty_cycles):
+        raise ValueError(f"LED duty powers have to be within [0, {MAX_U16}]: {duty_cycles}")
+    if not profile[PROFILE_GPIO_PAIRS] or any(len(pair) != 2 for pair in profile[PROFILE_GPIO_PAIRS]):
+        raise ValueError(f"GPIO pairs have to be (LED anode, resistor anode): {profile[PROFILE_GPIO_PAIRS]}")
+    if profile[PROFILE_REPEATS] < 1:
+        raise ValueError(f"At least one measurement repeat is needed: {profile[PROFILE_REPEATS]}")
+    if min(profile[PROFILE_REPEAT_INTERVAL], profile[PROFILE_FREQUENCY], profile[PROFILE_WARMUP],
+           profile[PROFILE_OVERSAMPLE_WINDOW]) < 0:
+        raise ValueError("Waiting times can't be negative")
+    return profile
+
+
+def load_profile(file_path: str | None = None) -> dict:
+    """ Load a profile file on top of the default profile
+
+    :param file_path: path of the .json profile, None for the default profile
+    :return: profile dictionary
+    """
+
+    profile = default_profile()
+    if file_path is not None:
+        with open(file_path) as f:
+            profile.update(json.load(f))
+    return check_profile(profile)
+
+
+def profile_settings(profile: dict) -> dict:
+    """ Profile without its name, as keyword arguments for Photometer.__init__
+
+    :param profile: profile dictionary
+    :return: dictionary of settings
+    """
+
+    return {key: value for key, value in profile.items() if key != PROFILE_NAME}
+
+
+def merge_profiles(profiles: list) -> dict:
+    """ Profile of a run whose settings were changed while running (see Photometer.command)
+
+    Later profiles override the settings of earlier ones. The LED duty powers are those of all profiles in the
+    order they were first used, so rows measured before and after a change are all processed;
+    the dark measurement can't change while running and stays the first.
+
+    :param profiles: profile entries of a result file in file order
+    :return: profile dictionary
+    """
+
+    profile = default_profile()
+    duty_cycles = []
+    for changed in profiles or [{}]:
+        profile.update(changed)
+        for duty in profile[PROFILE_PWM_DUTY_CYCLES]:
+            if duty not in duty_cycles:
+                duty_cycles.append(duty)
+    profile[PROFILE_PWM_DUTY_CYCLES] = duty_cycles
+    return profile
+
+
+def read_profile(file_path: str) -> dict:
+    """ Profile a result file was recorded with
+
+    Files without a profile header were recorded with the settings of Photometer.constants.
+    Only the header is read, settings changed while running are merged in by merge_profiles.
+
+    :param file_path: path of .csv result file
+    :return: profile dictionary
+    """
+
+    profile = default_profile()
+    profile.update(read_header(file_path).get(HEADER_PROFILE, {}))
+    return profile
@@ -0,0 +1,309 @@
+""" Multi-resolution min / max / median index of processed series, so plots of long runs draw a bounded number
+of points. Levels are updated incrementally: only bins at or after the first changed row are recomputed.
+
+Rows and bins are kept in arrays that grow by doubling and are only cut back at their end, so adding the rows of
+a cycle costs the same however long the run is (see SeriesPyramid.extend). Rows are expected in time order,
+as written by the firmware.
+"""
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.plotting import PLOT_POINTS
+
+# Bin widths of the levels in hours, each four times the previous one
+LEVEL_HOURS = (1, 4, 16, 64)
+
+# Columns of a level
+BIN = 'bin'
+BIN_MIN = 'min'
+BIN_MAX = 'max'
+BIN_MEDIAN = 'median'
+# Level of select() results taken directly from the rows
+RAW_LEVEL = 0
+
+ROW_COLUMNS = {DATE: float, CHANNEL: np.int64, INTENSITY: np.int64, BIN_MEDIAN: float}
+LEVEL_COLUMNS = {BIN: float, CHANNEL: np.int64, INTENSITY: np.int64, DATE: float,
+                 BIN_MIN: float, BIN_MAX: float, BIN_MEDIAN: float}
+
+
+class _Columns:
+    """ Named columns growing at their end, with amortized constant cost per appended row """
+
+    def __init__(self, dtypes: dict):
+        self.dtypes = dtypes
+        self.arrays = {name: np.empty(0, dtype=dtype) for name, dtype in dtypes.items()}
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name][:self.length]
+
+    def append(self, values: dict) -> None:
+        """ Append rows, values maps every column name to an array of the same length """
+
+        rows = len(next(iter(values.values())))
+        if self.length + rows > len(self.arrays[DATE]):
+            capacity = max(2 * len(self.arrays[DATE]), self.length + rows, 1024)
+            for name, array in self.arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.length] = array[:self.length]
+                self.arrays[name] = grown
+        for name, array in self.arrays.items():
+            array[self.length:self.length + rows] = values[name]
+        self.length += rows
+
+    def truncate(self, length: int) -> None:
+        """ Drop all rows from length on """
+
+        self.length = min(self.length, length)
+
+    def frame(self, start: int = 0, end: int | None = None) -> pd.DataFrame:
+        """ Copy of the rows from start to end as Pandas data frame """
+
+        end = self.length if end is None else end
+        return pd.DataFrame({name: array[start:end].copy() for name, array in self.arrays.items()})
+
+
+class SeriesPyramid:
+    """ Min / max / median of every channel / intensity series at several time resolutions
+
+    # Example usage:
+    pyramid = SeriesPyramid()
+    pyramid.update(process_measurements(read_measurements('20241030-161800_output.csv')), column=MEDIAN)
+    level_hours, df_level = pyramid.select(0, 720, points=1000)
+    """
+
+    def __init__(
+            self,
+            level_hours: tuple[float, ...] = LEVEL_HOURS,
+    ):
+        """ Initialize SeriesPyramid.
+
+        :param level_hours: bin widths of the levels in hours, ascending
+        """
+
+        self.level_hours = level_hours
+        self.column = None
+        self.rows = None
+        self.levels = {}
+        # Rows before this one are final, the ones after it provisional (see extend)
+        self.final_rows = 0
+        # Series in order of their first row
+        self.series = {}
+
+    def reset(self) -> None:
+        """ Forget all rows, e.g. when the run is read anew """
+
+        self.column = None
+        self.rows = None
+        self.levels = {}
+        self.final_rows = 0
+        self.series = {}
+
+    def update(
+            self,
+            df: pd.DataFrame,
+            column: str,
+    ) -> float | None:
+        """ Bring the levels up to date with the rows of a run
+
+        Rows are expected in file order, each call with the rows of the previous one plus newly appended ones.
+        Rows whose value changed since the last call (e.g. by median filtering at the end of a series)
+        are found by comparison; bins before the first changed or new row are kept as they are.
+        If the rows are not a continuation of the previous ones all levels are rebuilt.
+        Callers that know which rows are new use extend instead, which doesn't compare the whole run.
+
+        :param df: Pandas data frame with date in hours, CHANNEL, INTENSITY and column
+        :param column: column holding the values
+        :return: hour from which bins were recomputed, None if nothing changed
+        """
+
+        rows = self._row_values(df, column)
+        changed_from = self._first_change(rows) if column == self.column else -np.inf
+        if changed_from is None:
+            return None
+        if changed_from == -np.inf:
+            self.reset()
+            self.rows = _Columns(ROW_COLUMNS)
+        self.column = column
+        self.rows.truncate(0)
+        self.rows.append(rows)
+        self.final_rows = len(self.rows)
+        self._add_series(rows)
+        self._rebin(changed_from)
+        return changed_from
+
+    def extend(
+            self,
+            df: pd.DataFrame | None,
+            column: str,
+            tail: pd.DataFrame | None = None,
+    ) -> float | None:
+        """ Add the rows appended to a run since the last call
+
+        The provisional rows of the last call are replaced by tail, the bins from the earliest added or replaced
+        row on are recomputed. Cost depends on the number of new rows and the widest bin, not on the run length.
+
+        :param df: Pandas data frame of final rows following those of the previous calls, with date in hours,
+            CHANNEL, INTENSITY and column; None if there are none
+        :param column: column holding the values, all levels are rebuilt when it changes
+        :param tail: provisional rows following df, whose values may still change, e.g. by median filtering at
+            the end of a series; None if there are none
+        :return: hour from which bins were recomputed, None if nothing changed
+        """
+
+        if column != self.column:
+            self.reset()
+            self.column = column
+        if self.rows is None:
+            self.rows = _Columns(ROW_COLUMNS)
+        hours = []
+        if len(self.rows) > self.final_rows:
+            hours.append(self.rows[DATE][self.final_rows])
+        self.rows.truncate(self.final_rows)
+        for added in (df, tail):
+            if added is None or added.empty:
+                continue
+            rows = self._row_values(added, column)
+            hours.append(rows[DATE][0])
+            self.rows.append(rows)
+            self._add_series(rows)
+            if added is df:
+                self.final_rows = len(self.rows)
+        if not hours:
+            return None
+        changed_from = min(hours) if self.levels else -np.inf
+        self._rebin(changed_from)
+        return changed_from
+
+    @staticmethod
+    def _row_values(
+            df: pd.DataFrame,
+            column: str,
+    ) -> dict:
+        """ Row columns as arrays """
+
+        return {
+            DATE: df[DATE].to_numpy(dtype=float),
+            CHANNEL: df[CHANNEL].to_numpy(dtype=np.int64),
+            INTENSITY: df[INTENSITY].to_numpy(dtype=np.int64),
+            BIN_MEDIAN: df[column].to_numpy(dtype=float),
+        }
+
+    def _add_series(
+            self,
+            rows: dict,
+    ) -> None:
+        """ Note series seen for the first time """
+
+        for key in pd.MultiIndex.from_arrays([rows[CHANNEL], rows[INTENSITY]]).unique():
+            self.series.setdefault(key, len(self.series))
+
+    def channels(self) -> list[int]:
+        """ Channels in the order of their first row
+
+        :return: list of channels
+        """
+
+        return list(dict.fromkeys(channel for channel, _ in self.series))
+
+    def _first_change(
+            self,
+            rows: dict,
+    ) -> float | None:
+        """ Hour of the earliest row that differs from or was added since the previous update
+
+        :param rows: new rows
+        :return: hour, -inf if everything has to be rebuilt, None if nothing changed
+        """
+
+        if self.rows is None or len(self.rows) > len(rows[DATE]):
+            return -np.inf
+        previous = len(self.rows)
+        if not all(np.array_equal(rows[name][:previous], self.rows[name]) for name in (DATE, CHANNEL, INTENSITY)):
+            return -np.inf
+        new_values, old_values = rows[BIN_MEDIAN][:previous], self.rows[BIN_MEDIAN]
+        changed = ~((new_values == old_values) | (np.isnan(new_values) & np.isnan(old_values)))
+        hours = np.concatenate([rows[DATE][:previous][changed], rows[DATE][previous:]])
+        return hours.min() if hours.size else None
+
+    def _rebin(
+            self,
+            changed_from: float,
+    ) -> None:
+        """ Recompute the bins of every level from the one holding changed_from on """
+
+        dates = self.rows[DATE]
+        for hours in self.level_hours:
+            level = self.levels.setdefault(hours, _Columns(LEVEL_COLUMNS))
+            if changed_from == -np.inf:
+                first_bin, start = -np.inf, 0
+            else:
+                first_bin = np.floor(changed_from / hours)
+                # One bin early, floor and multiplication may round differently at a bin edge
+                start = np.searchsorted(dates, (first_bin - 1) * hours)
+            level.truncate(np.searchsorted(level[BIN], first_bin))
+            recomputed = self._bin_rows(self.rows.frame(start), hours)
+            recomputed = recomputed.loc[recomputed[BIN] >= first_bin]
+            level.append({name: recomputed[name].to_numpy() for name in LEVEL_COLUMNS})
+
+    @staticmethod
+    def _bin_rows(
+            rows: pd.DataFrame,
+            hours: float,
+    ) -> pd.DataFrame:
+        """ Aggregate rows into bins of one level
+
+        :param rows: rows to aggregate
+        :param hours: bin width in hours
+        :return: Pandas data frame sorted by (bin, channel, intensity) with BIN, CHANNEL, INTENSITY,
+            DATE (mean hour), BIN_MIN, BIN_MAX and BIN_MEDIAN
+        """
+
+        grouped = rows.groupby([np.floor(rows[DATE] / hours).rename(BIN), rows[CHANNEL], rows[INTENSITY]])
+        level = grouped[BIN_MEDIAN].agg(['min', 'max', 'median'])
+        level.columns = [BIN_MIN, BIN_MAX, BIN_MEDIAN]
+        level.insert(0, DATE, grouped[DATE].mean())
+        return level.reset_index()
+
+    def select(
+            self,
+            start_hours: float | None = None,
+            end_hours: float | None = None,
+            points: int = PLOT_POINTS,
+    ) -> (float, pd.DataFrame):
+        """ Finest level that gives at most points bins per series over the time window
+
+        :param start_hours: start of the window, defaults to the first row
+        :param end_hours: end of the window, defaults to the last row
+        :param points: maximum number of points per series
+        :return: bin width in hours (RAW_LEVEL for rows) and Pandas data frame with DATE, CHANNEL, INTENSITY,
+            BIN_MIN, BIN_MAX and BIN_MEDIAN
+        """
+
+        assert self.rows is not None, "No rows, call update() first"
+        dates = self.rows[DATE]
+        start_hours = (dates[0] if len(dates) else 0) if start_hours is None else start_hours
+        end_hours = (dates[-1] if len(dates) else 0) if end_hours is None else end_hours
+        first, last = np.searchsorted(dates, start_hours), np.searchsorted(dates, end_hours, side='right')
+        # More rows than points for every series means at least one series has too many, without counting
+        if last - first <= points * max(len(self.series), 1):
+            rows = self.rows.frame(first, last)
+            if rows.empty or rows.groupby([CHANNEL, INTENSITY]).size().max() <= points:
+                return RAW_LEVEL, rows.assign(**{BIN_MIN: rows[BIN_MEDIAN], BIN_MAX: rows[BIN_MEDIAN]})
+        for hours in self.level_hours:
+            if (end_hours - start_hours) / hours <= points or hours == self.level_hours[-1]:
+                level = self.levels[hours]
+                bins = level[BIN]
+                # Bin means lie within their bin
+                level = level.frame(np.searchsorted(bins, np.floor(start_hours / hours)),
+                                    np.searchsorted(bins, np.floor(end_hours / hours), side='right'))
+                return hours, level.loc[(level[DATE] >= start_hours) & (level[DATE] <= end_hours)]
@@ -0,0 +1,308 @@
+""" Replay archived result files through the processing stages of the live path, at full speed.
+
+Files are processed in chunks with bounded memory (see Photometer.chunked), in parallel
+worker processes and written as versioned derived outputs next to a JSON description of how they were made:
+    <output directory>/<run>.replay-<key>.tsv
+    <output directory>/<run>.replay-<key>.json
+The key is derived from REPLAY_VERSION and the processing parameters, so outputs of different parameter sets
+live side by side and a replay with unchanged parameters and source file is skipped.
+
+# Example usage:
+python -m Photometer.replay -i runs/*.csv -o derived --median_window 7 --baseline_quantile .05
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from Photometer.constants import (
+    SEPERATOR,
+    DATE,
+    CHANNEL,
+    DETECTOR,
+    INTENSITY,
+)
+from Photometer.files import atomic_write
+from Photometer.header import (
+    read_header,
+    HEADER_FIRMWARE,
+    HEADER_PROFILE,
+)
+from Photometer.chunked import process_chunks
+from Photometer.processing import (
+    MEDIAN,
+    FULLY_DARK,
+    MEDIAN_WINDOW,
+    BASELINE_WINDOW_HOURS,
+    BASELINE_QUANTILE,
+    OD_SCALE,
+    CHUNK_ROWS,
+)
+
+# Raised whenever the processing stages or the output layout change, so old outputs are not reused
+REPLAY_VERSION = 1
+OUTPUT_COLUMNS = [DATE, CHANNEL, DETECTOR, INTENSITY, MEDIAN, FULLY_DARK]
+
+# Keys of the output description
+REPLAY_KEY = 'key'
+REPLAY_SOURCE = 'source'
+REPLAY_SOURCE_SIZE = 'source_size'
+REPLAY_SOURCE_MTIME_NS = 'source_mtime_ns'
+REPLAY_PARAMETERS = 'parameters'
+REPLAY_ROWS = 'rows'
+
+
+def replay_parameters(
+        median_window: int = MEDIAN_WINDOW,
+        baseline_window_hours: tuple[float, float] = BASELINE_WINDOW_HOURS,
+        baseline_quantile: float = BASELINE_QUANTILE,
+        od_scale: float = OD_SCALE,
+) -> dict:
+    """ Processing parameters of a replay, keyword arguments of process_medians
+
+    :param median_window: size of the median filter
+    :param baseline_window_hours: (start, end) hours to take the low value from
+    :param baseline_quantile: quantile of the early values used as low value
+    :param od_scale: OD assigned to the dark value
+    :return: dictionary of parameter name to value, JSON serialisable
+    """
+
+    return {
+        'median_window': median_window,
+        'baseline_window_hours': list(baseline_window_hours),
+        'baseline_quantile': baseline_quantile,
+        'od_scale': od_scale,
+    }
+
+
+def replay_key(parameters: dict) -> str:
+    """ Short stable key of REPLAY_VERSION and a parameter set, part of the output file names
+
+    :param parameters: dictionary as returned by replay_parameters
+    :return: hex string
+    """
+
+    text = json.dumps({'version': REPLAY_VERSION, REPLAY_PARAMETERS: parameters}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:10]
+
+
+def output_paths(
+        csv_file_path: str,
+        output_directory: str,
+        parameters: dict,
+) -> (str, str):
+    """ Paths of the derived output and its description for one result file and parameter set
+
+    :param csv_file_path: path of .csv result file
+    :param output_directory: folder for derived outputs
+    :param parameters: dictionary as returned by replay_parameters
+    :return: path of the .tsv output, path of the .json description
+    """
+
+    stem = os.path.splitext(os.path.basename(csv_file_path))[0]
+    base = os.path.join(output_directory, f"{stem}.replay-{replay_key(parameters)}")
+    return f"{base}.tsv", f"{base}.json"
+
+
+def is_current(
+        csv_file_path: str,
+        description_path: str,
+) -> bool:
+    """ Whether a derived output was made from the result file as it is now
+
+    :param csv_file_path: path of .csv result file
+    :param description_path: path of the .json description of the output
+    :return: True if the description matches size and modification time of the result file
+    """
+
+    try:
+        with open(description_path) as f:
+            description = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stat = os.stat(csv_file_path)
+    return (description.get(REPLAY_SOURCE_SIZE) == stat.st_size and
+            description.get(REPLAY_SOURCE_MTIME_NS) == stat.st_mtime_ns)
+
+
+def replay_run(
+        csv_file_path: str,
+        output_directory: str,
+        parameters: dict,
+        chunk_rows: int = CHUNK_ROWS,
+        force: bool = False,
+) -> str | None:
+    """ Process one result file and write its derived output, used by the worker processes
+
+    :param csv_file_path: path of .csv result file
+    :param output_directory: folder for derived outputs
+    :param parameters: dictionary as returned by replay_parameters
+    :param chunk_rows: number of rows read at once
+    :param force: replay even if an output of the current file and parameters exists
+    :return: path of the .tsv output, None if the file could not be parsed
+    """
+
+    output_path, description_path = output_paths(csv_file_path, output_directory, parameters)
+    if not force and os.path.exists(output_path) and is_current(csv_file_path, description_path):
+        return output_path
+    # Taken before reading, a file still being written is replayed again next time
+    stat = os.stat(csv_file_path)
+    rows = 0
+    try:
+        with atomic_write(output_path) as f:
+            # Written chunk by chunk, memory does not grow with the length of the run
+            for df in process_chunks(
+                    csv_file_path,
+                    median_window=parameters['median_window'],
+                    baseline_window_hours=tuple(parameters['baseline_window_hours']),
+                    baseline_quantile=parameters['baseline_quantile'],
+                    od_scale=parameters['od_scale'],
+                    chunk_rows=chunk_rows,
+            ):
+                df[OUTPUT_COLUMNS].to_csv(f, sep=SEPERATOR, index=False, header=not rows)
+                rows += len(df)
+            if not rows:
+                f.write(SEPERATOR.join(OUTPUT_COLUMNS) + '\n')
+    except pd.errors.ParserError:
+        return None
+    header = read_header(csv_file_path)
+    # Description last: an output without current description is never taken as done
+    with atomic_write(description_path) as f:
+        json.dump({
+            'version': REPLAY_VERSION,
+            REPLAY_KEY: replay_key(parameters),
+            REPLAY_SOURCE: os.path.abspath(csv_file_path),
+            REPLAY_SOURCE_SIZE: stat.st_size,
+            REPLAY_SOURCE_MTIME_NS: stat.st_mtime_ns,
+            REPLAY_PARAMETERS: parameters,
+            REPLAY_ROWS: rows,
+            HEADER_FIRMWARE: header.get(HEADER_FIRMWARE),
+            HEADER_PROFILE: header.get(HEADER_PROFILE),
+        }, f, indent=2)
+    return output_path
+
+
+def replay_runs(
+        csv_file_paths: list[str],
+        output_directory: str,
+        parameters: dict | None = None,
+        processes: int | None = None,
+        chunk_rows: int = CHUNK_ROWS,
+        force: bool = False,
+) -> dict[str, str | None]:
+    """ Replay many result files, one file per worker process at a time
+
+    # Example usage:
+    replay_runs(glob.glob('runs/*.csv'), 'derived', replay_parameters(median_window=7))
+
+    :param csv_file_paths: paths of .csv result files
+    :param output_directory: folder for derived outputs, created if missing
+    :param parameters: dictionary as returned by replay_parameters, defaults to the live processing parameters
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :param chunk_rows: number of rows read at once per worker
+    :param force: replay even if an output of the current file and parameters exists
+    :return: dictionary of result file path to output path, None for files that could not be parsed
+    """
+
+    parameters = replay_parameters() if parameters is None else parameters
+    os.makedirs(output_directory, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        outputs = list(executor.map(
+            functools.partial(
+                replay_run,
+                output_directory=output_directory,
+                parameters=parameters,
+                chunk_rows=chunk_rows,
+                force=force,
+            ),
+            csv_file_paths,
+        ))
+    return dict(zip(csv_file_paths, outputs))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay archived result files through the processing stages")
+    parser.add_argument(
+        "--input", "-i",
+        nargs='+',
+        help="input filename(s)",
+        required=True,
+    )
+    parser.add_argument(
+        "--output", "-o",
+        help="Folder for the derived outputs",
+        required=True,
+    )
+    parser.add_argument(
+        "--median_window", "-w",
+        type=int,
+        help=f"Size of the median filter, defaults to {MEDIAN_WINDOW}",
+        default=MEDIAN_WINDOW,
+    )
+    parser.add_argument(
+        "--baseline_window",
+        type=float,
+        nargs=2,
+        help=f"Start and end hour to take the low value from, defaults to {BASELINE_WINDOW_HOURS}",
+        default=BASELINE_WINDOW_HOURS,
+    )
+    parser.add_argument(
+        "--baseline_quantile", "-q",
+        type=float,
+        help=f"Quantile of the early values used as low value, defaults to {BASELINE_QUANTILE}",
+        default=BASELINE_QUANTILE,
+    )
+    parser.add_argument(
+        "--od_scale",
+        type=float,
+        help=f"OD assigned to the dark value, defaults to {OD_SCALE}",
+        default=OD_SCALE,
+    )
+    parser.add_argument(
+        "--processes", "-p",
+        type=int,
+        help="Number of worker processes, defaults to the number of CPUs",
+        default=None,
+    )
+    parser.add_argument(
+        "--chunk_rows",
+        type=int,
+        help=f"Rows read at once per worker, defaults to {CHUNK_ROWS}",
+        default=CHUNK_ROWS,
+    )
+    parser.add_argument(
+        "--force", "-f",
+        action='store_true',
+        help="Replay files even if an output of the current file and parameters exists",
+    )
+    args = parser.parse_args(argv)
+
+    parameters = replay_parameters(
+        median_window=args.median_window,
+        baseline_window_hours=tuple(args.baseline_window),
+        baseline_quantile=args.baseline_quantile,
+        od_scale=args.od_scale,
+    )
+    print(f"Parameters {replay_key(parameters)}: {json.dumps(parameters)}")
+    outputs = replay_runs(
+        args.input,
+        output_directory=args.output,
+        parameters=parameters,
+        processes=args.processes,
+        chunk_rows=args.chunk_rows,
+        force=args.force,
+    )
+    for csv_file_path, output_path in outputs.items():
+        if output_path is None:
+            print(f"Couldn't read {csv_file_path}, skipping")
+        else:
+            print(f"{csv_file_path} -> {output_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+""" Measurement schedule of a cycle: which channels are lit together at which LED duty power, and in which order.
+Runs on the Pico (MicroPython) and on the host.
+
+Every step of a schedule switches the LEDs of its channels to one duty power and waits for the warmup once,
+then reads the channels one after the other, the ADC is shared. Channels that don't see each other's LED
+share a step; the dark measurement lights nothing, so all channels share it. Without crosstalk matrix and
+geometry every lit channel gets steps of its own.
+
+# Example crosstalk file (JSON), measured once at calibration by Photometer.measure_crosstalk,
+# light of LED (outer key) seen by photoresistor (inner key) as fraction of the photoresistor's own LED,
+# and the fraction each photoresistor can't tell from the noise of its reads:
+{"channels": [0, 1], "crosstalk": {"0": {"0": 1.0, "1": 0.02}, "1": {"0": 0.0, "1": 1.0}},
+ "noise": {"0": 0.0012, "1": 0.0011}}
+"""
+
+import json
+
+# Crosstalk matrix the firmware looks for in the folder mounted by mpremote
+CROSSTALK_FILE_PATH = '/remote/crosstalk.json'
+# Channels seeing more of another LED than this fraction of their own are not lit together: extra light of
+# .001 shifts a reading by log10(1.001) ~ .0004 OD, the lower end of the plotted OD range
+CROSSTALK_THRESHOLD = .001
+# Crosstalk within this many standard errors of the difference of lit and dark median is noise of the reads,
+# it is stored as 0; per reading noise is about .001 of the full signal, so it can't be told from the threshold.
+# Pairs of noise alone pass 4 standard errors about once in 15000
+NOISE_MULTIPLE = 4
+# Standard error of the median of normal reads relative to that of their mean, sqrt(pi / 2)
+MEDIAN_ERROR_RATIO = 1.253
+# Channels closer than this (in units of the channel positions) are not lit together, if there is no matrix
+MIN_DISTANCE = 2
+
+# Seconds after selecting a photoresistor before reading it, in steps of several channels
+SELECT_SECONDS = .01
+
+# Keys of a crosstalk file
+CROSSTALK_CHANNELS = 'channels'
+CROSSTALK_MATRIX = 'crosstalk'
+CROSSTALK_NOISE = 'noise'
+# Keys of a schedule header entry
+SCHEDULE_STEPS = 'steps'
+SCHEDULE_WARMUPS = 'warmups'
+SCHEDULE_PREDICTED_SECONDS = 'predicted_seconds'
+SCHEDULE_SEQUENTIAL_SECONDS = 'sequential_seconds'
+
+
+def load_crosstalk(file_path: str = CROSSTALK_FILE_PATH) -> dict | None:
+    """ Crosstalk matrix measured at calibration
+
+    :param file_path: path of the .json crosstalk file
+    :return: dictionary of LED channel to {photoresistor channel: fraction}, None if there is no matrix
+    """
+
+    try:
+        with open(file_path) as f:
+            matrix = json.load(f)[CROSSTALK_MATRIX]
+    except OSError:
+        return None
+    return {int(led): {int(ch): value for ch, value in seen.items()} for led, seen in matrix.items()}
+
+
+def save_crosstalk(
+        matrix: dict,
+        file_path: str = CROSSTALK_FILE_PATH,
+        noise: dict | None = None,
+) -> None:
+    """ Store a crosstalk matrix for later runs
+
+    :param matrix: dictionary of LED channel to {photoresistor channel: fraction}
+    :param file_path: path of the .json crosstalk file
+    :param noise: dictionary of channel to noise floor as returned by crosstalk_noise, stored for reference
+    :return: None
+    """
+
+    content = {
+        CROSSTALK_CHANNELS: sorted(matrix),
+        # JSON keys have to be strings
+        CROSSTALK_MATRIX: {str(led): {str(ch): value for ch, value in seen.items()}
+                           for led, seen in matrix.items()},
+    }
+    if noise is not None:
+        content[CROSSTALK_NOISE] = {str(ch): value for ch, value in noise.items()}
+    with open(file_path, 'w') as f:
+        json.dump(content, f)
+
+
+def _median(values: list[int]) -> int:
+    return sorted(values)[len(values) // 2]
+
+
+def crosstalk_noise(
+        dark_readings: dict,
+        lit_readings: dict,
+        noise_multiple: float = NOISE_MULTIPLE,
+) -> dict:
+    """ Smallest crosstalk fraction each photoresistor can tell from the noise of its reads
+
+    A crosstalk value is the difference of two medians of reads, lit and dark.
+
+    :param dark_readings: dictionary of channel to list of raw readings with all LEDs off
+    :param lit_readings: dictionary of LED channel to {photoresistor channel: list of raw readings}
+    :param noise_multiple: standard errors a crosstalk value has to exceed
+    :return: dictionary of channel to fraction of the photoresistor's own signal, for channels with their own LED
+    """
+
+    noise = {}
+    for ch, values in dark_readings.items():
+        if ch not in lit_readings or ch not in lit_readings[ch]:
+            continue
+        mean = sum(values) / len(values)
+        variance = sum((value - mean) ** 2 for value in values) / max(len(values) - 1, 1)
+        standard_error = MEDIAN_ERROR_RATIO * (2 * variance / len(values)) ** .5
+        signal = max(_median(lit_readings[ch][ch]) - _median(values), 1)
+        noise[ch] = round(noise_multiple * standard_error / signal, 4)
+    return noise
+
+
+def crosstalk_matrix(
+        dark_readings: dict,
+        lit_readings: dict,
+        noise_multiple: float = NOISE_MULTIPLE,
+) -> dict:
+    """ Crosstalk fractions from readings of every photoresistor with all LEDs off and with one LED on at a time
+
+    Fractions within the noise floor of the photoresistor (see crosstalk_noise) are set to 0, otherwise noise
+    alone would make most channel pairs exceed CROSSTALK_THRESHOLD.
+
+    :param dark_readings: dictionary of channel to list of raw readings with all LEDs off
+    :param lit_readings: dictionary of LED channel to {photoresistor channel: list of raw readings}
+    :param noise_multiple: standard errors a crosstalk value has to exceed
+    :return: dictionary of LED channel to {photoresistor channel: fraction of the photoresistor's own signal}
+    """
+
+    dark = {ch: _median(values) for ch, values in dark_readings.items()}
+    noise = crosstalk_noise(dark_readings, lit_readings, noise_multiple=noise_multiple)
+    # Raw readings rise with light
+    signal = {
+        led: {ch: _median(values) - dark[ch] for ch, values in seen.items()}
+        for led, seen in lit_readings.items()
+    }
+    matrix = {}
+    for led, seen in signal.items():
+        matrix[led] = {}
+        for ch, value in seen.items():
+            if ch not in signal:
+                matrix[led][ch] = None
+                continue
+            fraction = round(value / max(signal[ch][ch], 1), 4)
+            matrix[led][ch] = fraction if led == ch or abs(fraction) > noise[ch] else 0.0
+    return matrix
+
+
+def interfering(
+        channels: list[int],
+        crosstalk: dict | None = None,
+        positions: dict | None = None,
+        threshold: float = CROSSTALK_THRESHOLD,
+        min_distance: float = MIN_DISTANCE,
+) -> dict:
+    """ Channels that must not be lit while another one is read
+
+    Taken from the crosstalk matrix if it covers both channels, from the channel positions otherwise;
+    channels known to neither interfere.
+
+    :param channels: LED anode GPIO numbers
+    :param crosstalk: dictionary as returned by load_crosstalk
+    :param positions: dictionary of channel to (x, y) position
+    :param threshold: largest crosstalk fraction of channels lit together
+    :param min_distance: smallest distance of channels lit together
+    :return: dictionary of channel to set of interfering channels
+    """
+
+    conflicts = {ch: set() for ch in channels}
+    for i, a in enumerate(channels):
+        for b in channels[i + 1:]:
+            if crosstalk is not None and a in crosstalk and b in crosstalk:
+                seen = (crosstalk[a].get(b), crosstalk[b].get(a))
+                # Not measured counts as interfering
+                conflict = any(value is None or value > threshold for value in seen)
+            elif positions is not None and a in positions and b in positions:
+                (xa, ya), (xb, yb) = positions[a], positions[b]
+                conflict = ((xa - xb) ** 2 + (ya - yb) ** 2) ** .5 < min_distance
+            else:
+                conflict = True
+            if conflict:
+                conflicts[a].add(b)
+                conflicts[b].add(a)
+    return conflicts
+
+
+def group_channels(
+        channels: list[int],
+        conflicts: dict,
+) -> list[list[int]]:
+    """ Split channels into as few groups of mutually non-interfering channels as greedily possible
+
+    Channels with the most conflicts are placed first, each into the first group it fits.
+
+    :param channels: LED anode GPIO numbers
+    :param conflicts: dictionary as returned by interfering
+    :return: list of groups, channels of a group in the given order
+    """
+
+    groups = []
+    for ch in sorted(channels, key=lambda c: -len(conflicts[c])):
+        for group in groups:
+            if not conflicts[ch] & set(group):
+                group.append(ch)
+                break
+        else:
+            groups.append([ch])
+    order = {ch: i for i, ch in enumerate(channels)}
+    groups = [sorted(group, key=lambda c: order[c]) for group in groups]
+    return sorted(groups, key=lambda group: order[group[0]])
+
+
+def plan_schedule(
+        channels: list[int],
+        pwm_duty_cycles: list[int],
+        conflicts: dict | None = None,
+) -> list[(int, list[int])]:
+    """ Steps of a measurement cycle with the fewest warmups
+
+    A dark step of all channels comes first, so the dark measurement of a channel precedes its other rows
+    as in sequential cycles, then every group of non-interfering channels goes through the other duty powers.
+
+    :param channels: LED anode GPIO numbers
+    :param pwm_duty_cycles: LED duty powers, the first one is the dark measurement
+    :param conflicts: dictionary as returned by interfering, all channels interfere if None
+    :return: list of steps (duty power, channels)
+    """
+
+    if conflicts is None:
+        conflicts = interfering(channels)
+    steps = []
+    intensities = pwm_duty_cycles
+    if pwm_duty_cycles[0] == 0:
+        steps.append((pwm_duty_cycles[0], list(channels)))
+        intensities = pwm_duty_cycles[1:]
+    for group in group_channels(channels, conflicts):
+        steps.extend((duty, group) for duty in intensities)
+    return steps
+
+
+def sequential_schedule(
+        channels: list[int],
+        pwm_duty_cycles: list[int],
+) -> list[(int, list[int])]:
+    """ Steps of the classic cycle: channel by channel, every duty power with its own warmup
+
+    :param channels: LED anode GPIO numbers
+    :param pwm_duty_cycles: LED duty powers
+    :return: list of steps (duty power, channels)
+    """
+
+    return [(duty, [ch]) for ch in channels for duty in pwm_duty_cycles]
+
+
+def predict_cycle_seconds(
+        steps: list[(int, list[int])],
+        measurement_led_warmup_seconds: float,
+        measurement_repeats: int,
+        measurement_repeat_interval_seconds: float,
+        select_seconds: float = SELECT_SECONDS,
+) -> float:
+    """ Duration of a measurement cycle from its waits, time of ADC reads and writing is left out
+
+    :param steps: list of steps as returned by plan_schedule
+    :param measurement_led_warmup_seconds: wait after switching the LEDs of a step
+    :param measurement_repeats: readings per channel and step
+    :param measurement_repeat_interval_seconds: wait after every reading
+    :param select_seconds: wait after selecting a photoresistor in steps of several channels
+    :return: seconds
+    """
+
+    seconds = 0
+    for _, channels in steps:
+        seconds += measurement_led_warmup_seconds
+        seconds += len(channels) * measurement_repeats * measurement_repeat_interval_seconds
+        if len(channels) > 1:
+            seconds += len(channels) * select_seconds
+    return seconds
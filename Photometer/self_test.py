@@ -0,0 +1,153 @@
+""" Pass / fail evaluation of the start up self-test against thresholds and stored per channel baselines.
+Runs on the Pico (MicroPython) and on the host.
+
+# Example baseline file (JSON), channel (LED anode GPIO) to median dark and bright reading:
+{"0": {"dark": 15023, "bright": 58112}, "1": {"dark": 14987, "bright": 57650}}
+"""
+
+import json
+
+from Photometer.constants import (
+    MAX_U16,
+    SEPERATOR,
+)
+from Photometer.header import (
+    HEADER_PREFIX,
+    HEADER_SELF_TEST,
+)
+from Photometer.health import MIN_CONTRAST
+
+# Back to back ADC reads per channel and light state
+SELF_TEST_READS = 16
+# Seconds for all photoresistors to settle after switching every LED off or on
+SELF_TEST_SETTLE_SECONDS = 2
+# Seconds after selecting a photoresistor before reading it
+SELF_TEST_SELECT_SECONDS = .01
+# Largest spread of the burst reads of one channel
+MAX_SPREAD = 2000
+# Allowed deviation of dark reading and contrast from the baseline, as fraction of the baseline contrast
+BASELINE_TOLERANCE = .25
+# Baseline the firmware looks for in the folder mounted by mpremote, created from the first self-test if missing
+BASELINE_FILE_PATH = '/remote/self_test_baseline.json'
+
+# Keys of a report
+REPORT_TIME = 'time'
+REPORT_PASSED = 'passed'
+REPORT_DURATION_MS = 'duration_ms'
+REPORT_BASELINE = 'baseline'
+REPORT_CHANNELS = 'channels'
+# Keys per channel
+DARK = 'dark'
+BRIGHT = 'bright'
+DARK_SPREAD = 'dark_spread'
+BRIGHT_SPREAD = 'bright_spread'
+CONTRAST = 'contrast'
+CHECKS = 'checks'
+# Checks per channel
+CHECK_NOT_PINNED = 'not_pinned'
+CHECK_CONTRAST = 'contrast'
+CHECK_SPREAD = 'spread'
+CHECK_BASELINE_DARK = 'baseline_dark'
+CHECK_BASELINE_CONTRAST = 'baseline_contrast'
+
+
+def load_baseline(file_path: str = BASELINE_FILE_PATH) -> dict | None:
+    """ Per channel baseline of an earlier self-test
+
+    :param file_path: path of the .json baseline
+    :return: dictionary of channel to {DARK, BRIGHT}, None if there is no baseline
+    """
+
+    try:
+        with open(file_path) as f:
+            return {int(channel): values for channel, values in json.load(f).items()}
+    except OSError:
+        return None
+
+
+def save_baseline(
+        report: dict,
+        file_path: str = BASELINE_FILE_PATH,
+) -> None:
+    """ Store the readings of a self-test as baseline for later ones
+
+    :param report: report as returned by evaluate_self_test
+    :param file_path: path of the .json baseline
+    :return: None
+    """
+
+    with open(file_path, 'w') as f:
+        json.dump({
+            channel: {DARK: values[DARK], BRIGHT: values[BRIGHT]}
+            for channel, values in report[REPORT_CHANNELS].items()
+        }, f)
+
+
+def evaluate_self_test(
+        dark_readings: dict,
+        bright_readings: dict,
+        baseline: dict | None = None,
+        time_stamp=None,
+        duration_ms: int | None = None,
+) -> dict:
+    """ Check the burst readings of every channel and build the self-test report
+
+    :param dark_readings: dictionary of channel to readings with every LED off
+    :param bright_readings: dictionary of channel to readings with every LED on
+    :param baseline: dictionary of channel to {DARK, BRIGHT} as returned by load_baseline, optional
+    :param time_stamp: time stamp of the self-test, copied to the report
+    :param duration_ms: duration of the self-test, copied to the report
+    :return: report dictionary with string channel keys (JSON keys have to be strings),
+        REPORT_PASSED is True if every check of every channel passed
+    """
+
+    channels = {}
+    for channel in dark_readings:
+        dark, bright = sorted(dark_readings[channel]), sorted(bright_readings[channel])
+        values = {
+            DARK: dark[len(dark) // 2],
+            BRIGHT: bright[len(bright) // 2],
+            DARK_SPREAD: dark[-1] - dark[0],
+            BRIGHT_SPREAD: bright[-1] - bright[0],
+        }
+        # Raw readings rise with light
+        values[CONTRAST] = values[BRIGHT] - values[DARK]
+        checks = {
+            CHECK_NOT_PINNED: 0 < values[DARK] and values[BRIGHT] < MAX_U16,
+            CHECK_CONTRAST: values[CONTRAST] >= MIN_CONTRAST,
+            CHECK_SPREAD: max(values[DARK_SPREAD], values[BRIGHT_SPREAD]) <= MAX_SPREAD,
+        }
+        if baseline is not None and channel in baseline:
+            reference = baseline[channel]
+            tolerance = BASELINE_TOLERANCE * abs(reference[BRIGHT] - reference[DARK])
+            checks[CHECK_BASELINE_DARK] = abs(values[DARK] - reference[DARK]) <= tolerance
+            checks[CHECK_BASELINE_CONTRAST] = \
+                abs(values[CONTRAST] - (reference[BRIGHT] - reference[DARK])) <= tolerance
+        values[CHECKS] = checks
+        values[REPORT_PASSED] = all(checks.values())
+        channels[str(channel)] = values
+    return {
+        REPORT_TIME: time_stamp,
+        REPORT_PASSED: all(values[REPORT_PASSED] for values in channels.values()),
+        REPORT_DURATION_MS: duration_ms,
+        REPORT_BASELINE: baseline is not None,
+        REPORT_CHANNELS: channels,
+    }
+
+
+def parse_self_test_line(line: str) -> dict | None:
+    """ Report of a HEADER_SELF_TEST line as written to the output file and printed by Photometer
+
+    :param line: output line without line break
+    :return: report dictionary with integer channel keys, None if the line is no complete self-test line
+    """
+
+    prefix = f"{HEADER_PREFIX}{HEADER_SELF_TEST}{SEPERATOR}"
+    if not line.startswith(prefix):
+        return None
+    try:
+        report = json.loads(line[len(prefix):])
+    except ValueError:
+        return None
+    report[REPORT_CHANNELS] = {int(channel): values for channel, values in report[REPORT_CHANNELS].items()}
+    return report
@@ -0,0 +1,115 @@
+""" Closed loop settle detection of a photoresistor after an LED change, replaces the fixed warmup sleep.
+Runs on the Pico (MicroPython) and on the host.
+
+The selected photoresistor is sampled every SETTLE_SAMPLE_SECONDS after the LED duty power is set. It counts as
+settled once the last SETTLE_WINDOW samples lie within a tolerance of each other; the fixed warmup is the
+timeout, so a channel that doesn't settle is measured no earlier than before.
+The tolerance follows the read noise of each channel and duty power, estimated from the samples of its previous
+settles (see settle_tolerance), so noisy channels still settle and quiet ones don't settle early.
+"""
+
+# Seconds between settle samples
+SETTLE_SAMPLE_SECONDS = .02
+# Samples that have to agree
+SETTLE_WINDOW = 5
+# Largest raw spread of the agreeing samples in read noise standard deviations, about 1 in 200 windows of
+# normally distributed reads spreads wider
+SETTLE_NOISE_MULTIPLE = 5
+# Largest raw spread while the noise of a channel is unknown, and the least one, two steps of the 12 bit ADC
+SETTLE_TOLERANCE = 100
+SETTLE_MIN_TOLERANCE = 32
+# Weight of the latest settle in the running noise estimate of a channel
+SETTLE_NOISE_WEIGHT = .1
+
+
+def settle_tolerance(
+        noise: float | None,
+        noise_multiple: float = SETTLE_NOISE_MULTIPLE,
+        min_tolerance: int = SETTLE_MIN_TOLERANCE,
+) -> int:
+    """ Largest raw spread of settled readings given the read noise of a channel
+
+    :param noise: standard deviation of single raw reads, None if not measured yet
+    :param noise_multiple: allowed spread in standard deviations
+    :param min_tolerance: least allowed spread, below it quantisation decides
+    :return: tolerance for SettleDetector, SETTLE_TOLERANCE without a noise estimate
+    """
+
+    if noise is None:
+        return SETTLE_TOLERANCE
+    return max(int(noise_multiple * noise), min_tolerance)
+
+
+def update_noise(
+        previous: float | None,
+        noise: float | None,
+        weight: float = SETTLE_NOISE_WEIGHT,
+) -> float | None:
+    """ Running read noise estimate of a channel, a single window of samples is too few to rely on
+
+    :param previous: running estimate, None if there is none yet
+    :param noise: estimate of the latest settle as returned by SettleDetector.noise
+    :param weight: weight of the latest estimate
+    :return: new running estimate
+    """
+
+    if noise is None or previous is None:
+        return previous if noise is None else noise
+    return previous + weight * (noise - previous)
+
+
+class SettleDetector:
+    """ Decide from a stream of raw readings whether a photoresistor has settled, constant work per reading
+
+    # Example usage:
+    detector = SettleDetector(tolerance=settle_tolerance(noise))
+    while not detector.add(adc.read_u16()):
+        time.sleep(SETTLE_SAMPLE_SECONDS)
+    noise = update_noise(noise, detector.noise())
+    """
+
+    def __init__(
+            self,
+            window: int = SETTLE_WINDOW,
+            tolerance: int = SETTLE_TOLERANCE,
+    ):
+        """ Initialize SettleDetector.
+
+        :param window: number of consecutive readings that have to agree
+        :param tolerance: largest raw spread of the agreeing readings
+        """
+
+        self.window = window
+        self.tolerance = tolerance
+        # Ring buffer of the last readings
+        self.readings = [0] * window
+        self.count = 0
+
+    def add(self, reading: int) -> bool:
+        """ Add a reading
+
+        :param reading: raw ADC reading
+        :return: True if the last window readings are within tolerance
+        """
+
+        self.readings[self.count % self.window] = reading
+        self.count += 1
+        if self.count < self.window:
+            return False
+        return max(self.readings) - min(self.readings) <= self.tolerance
+
+    def noise(self) -> float | None:
+        """ Read noise standard deviation from the last window readings
+
+        Second differences cancel a linear drift, a photoresistor that is still settling doesn't pass for noise.
+        Each one has the variance of six reads.
+
+        :return: standard deviation of single reads, None before window readings were added
+        """
+
+        if self.count < self.window:
+            return None
+        oldest = self.count % self.window
+        ordered = self.readings[oldest:] + self.readings[:oldest]
+        squares = [(ordered[i] - 2 * ordered[i + 1] + ordered[i + 2]) ** 2 for i in range(self.window - 2)]
+        return (sum(squares) / len(squares) / 6) ** .5
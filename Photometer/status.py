@@ -0,0 +1,182 @@
+""" Quick status of a result file: header, progress, last row, self-test and active alerts.
+
+Only needs the standard library, so it answers right away without loading the analysis stack.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from Photometer.constants import SEPERATOR
+from Photometer.header import (
+    read_header,
+    HEADER_PREFIX,
+    HEADER_ALERT,
+    HEADER_FIRMWARE,
+    HEADER_START,
+    HEADER_PROFILE,
+)
+from Photometer.health import (
+    ALERT_CHANNEL,
+    ALERT_INTENSITY,
+    ALERT_KIND,
+    ALERT_VALUE,
+    ALERT_ACTIVE,
+)
+from Photometer.profile import (
+    PROFILE_NAME,
+    PROFILE_PWM_DUTY_CYCLES,
+    PROFILE_FREQUENCY,
+)
+from Photometer.decode import open_result
+from Photometer.self_test import (
+    parse_self_test_line,
+    REPORT_PASSED,
+    REPORT_CHANNELS,
+)
+
+# Keys of a status
+STATUS_FILE = 'file'
+STATUS_BYTES = 'bytes'
+STATUS_AGE_SECONDS = 'age_seconds'
+STATUS_ROWS = 'rows'
+STATUS_CHANNELS = 'channels'
+STATUS_CYCLES = 'cycles'
+STATUS_FIRST = 'first'
+STATUS_LAST = 'last'
+STATUS_SELF_TEST = 'self_test'
+STATUS_FAILED_CHANNELS = 'failed_channels'
+STATUS_ALERTS = 'alerts'
+
+
+def format_time_stamp(time_stamp: str) -> str:
+    """ Time string of a row time stamp, epoch seconds are shown in the time string format
+
+    :param time_stamp: first column of a result row, time string or epoch seconds
+    :return: time string
+    """
+
+    if time_stamp.isdigit():
+        # Pico clock runs on local time, so the seconds are formatted without time zone conversion
+        return time.strftime('%Y%m%d-%H%M%S', time.gmtime(int(time_stamp)))
+    return time_stamp
+
+
+def run_status(csv_file_path: str) -> dict:
+    """ Summarize a result file in a single pass over its lines
+
+    :param csv_file_path: path of .csv result file
+    :return: status dictionary, see the STATUS_ keys; header entries are added under their own keys
+    """
+
+    header = read_header(csv_file_path)
+    alert_prefix = f"{HEADER_PREFIX}{HEADER_ALERT}{SEPERATOR}"
+    profile_prefix = f"{HEADER_PREFIX}{HEADER_PROFILE}{SEPERATOR}"
+    # Latest settings, profiles are written again once a command changes them while running
+    profile = header.get(HEADER_PROFILE, {})
+    rows = 0
+    channels = set()
+    first = last = None
+    self_test = None
+    alerts = {}
+    with open_result(csv_file_path) as f:
+        for line in f:
+            if line.startswith(HEADER_PREFIX):
+                if line.startswith(alert_prefix):
+                    try:
+                        alert = json.loads(line[len(alert_prefix):])
+                    except ValueError:
+                        continue
+                    key = (alert[ALERT_CHANNEL], alert[ALERT_INTENSITY], alert[ALERT_KIND])
+                    if alert[ALERT_ACTIVE]:
+                        alerts[key] = alert
+                    else:
+                        alerts.pop(key, None)
+                elif line.startswith(profile_prefix):
+                    try:
+                        profile = json.loads(line[len(profile_prefix):])
+                    except ValueError:
+                        continue
+                else:
+                    self_test = parse_self_test_line(line.rstrip('\r\n')) or self_test
+                continue
+            fields = line.split(SEPERATOR, 2)
+            if len(fields) < 3 or not line.endswith('\n'):
+                # Incomplete last row of a file still being written
+                continue
+            rows += 1
+            channels.add(int(fields[1]))
+            if first is None:
+                first = fields[0]
+            last = fields[0]
+
+    intensities = len(profile.get(PROFILE_PWM_DUTY_CYCLES, [])) or None
+    stat = os.stat(csv_file_path)
+    return {
+        STATUS_FILE: os.path.abspath(csv_file_path),
+        STATUS_BYTES: stat.st_size,
+        STATUS_AGE_SECONDS: time.time() - stat.st_mtime,
+        HEADER_FIRMWARE: header.get(HEADER_FIRMWARE),
+        HEADER_START: header.get(HEADER_START),
+        PROFILE_NAME: profile.get(PROFILE_NAME),
+        PROFILE_FREQUENCY: profile.get(PROFILE_FREQUENCY),
+        STATUS_ROWS: rows,
+        STATUS_CHANNELS: sorted(channels),
+        STATUS_CYCLES: rows // (len(channels) * intensities) if channels and intensities else None,
+        STATUS_FIRST: format_time_stamp(first) if first is not None else None,
+        STATUS_LAST: format_time_stamp(last) if last is not None else None,
+        STATUS_SELF_TEST: self_test[REPORT_PASSED] if self_test is not None else None,
+        STATUS_FAILED_CHANNELS: sorted(
+            ch for ch, values in self_test[REPORT_CHANNELS].items() if not values[REPORT_PASSED]
+        ) if self_test is not None else [],
+        STATUS_ALERTS: list(alerts.values()),
+    }
+
+
+def print_status(status: dict) -> None:
+    """ Print a status in a few human readable lines
+
+    :param status: dictionary as returned by run_status
+    :return: None
+    """
+
+    print(f"{status[STATUS_FILE]} ({status[STATUS_BYTES] / 2 ** 20:.1f} MiB, "
+          f"last change {status[STATUS_AGE_SECONDS] / 60:.1f} min ago)")
+    print(f"Profile {status[PROFILE_NAME]}, firmware {status[HEADER_FIRMWARE]}, started {status[HEADER_START]}")
+    print(f"{status[STATUS_ROWS]} rows, {status[STATUS_CYCLES]} cycles over channels {status[STATUS_CHANNELS]}, "
+          f"{status[STATUS_FIRST]} to {status[STATUS_LAST]}")
+    if status[STATUS_SELF_TEST] is not None:
+        print(f"Self-test {'passed' if status[STATUS_SELF_TEST] else 'FAILED'}"
+              f"{f', failed channels {status[STATUS_FAILED_CHANNELS]}' if status[STATUS_FAILED_CHANNELS] else ''}")
+    for alert in status[STATUS_ALERTS]:
+        print(f"Alert {alert[ALERT_KIND]} on channel {alert[ALERT_CHANNEL]}"
+              f"{f' at intensity {alert[ALERT_INTENSITY]}' if alert[ALERT_INTENSITY] is not None else ''}"
+              f" ({alert[ALERT_VALUE]})")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Show the status of result files")
+    parser.add_argument(
+        "--input", "-i",
+        nargs='+',
+        help="input filename(s)",
+        required=True,
+    )
+    parser.add_argument(
+        "--json",
+        action='store_true',
+        help="Print the status as JSON",
+    )
+    args = parser.parse_args(argv)
+
+    statuses = [run_status(csv_file_path) for csv_file_path in args.input]
+    if args.json:
+        print(json.dumps(statuses, indent=2))
+    else:
+        for status in statuses:
+            print_status(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+""" Indexed measurement store: result rows of many runs in one SQLite database, queried by run, channel,
+intensity and time instead of parsing and filtering whole result files.
+
+Rows go in batched transactions; the database runs in WAL mode, so figures and analysis scripts can read
+while the fleet ingestor writes. Readings of a row are kept as one blob of little endian uint16 values.
+read_run returns the same data frame as Photometer.processing.read_measurements, so all processing steps apply.
+
+# Example usage:
+python -m Photometer.store -d measurements.sqlite -i 20241030-161800_output.csv
+python -m Photometer.store -d measurements.sqlite --list
+
+with MeasurementStore('measurements.sqlite') as store:
+    df = store.read_run('20241030-161800_output', channels=[3], intensities=[32767], last_hours=6)
+
+for _ in watch_store('measurements.sqlite', '20241030-161800_output'):
+    print("New rows committed")
+"""
+
+import argparse
+import calendar
+import json
+import os
+import sqlite3
+import sys
+import time
+from array import array
+
+from Photometer.constants import (
+    SEPERATOR,
+    DATE,
+    CHANNEL,
+    DETECTOR,
+    INTENSITY,
+)
+from Photometer.header import (
+    parse_header_line,
+    HEADER_PREFIX,
+    HEADER_SCHEMA,
+    HEADER_START,
+    HEADER_PROFILE,
+    HEADER_BLANK,
+    SCHEMA_COLUMNS,
+    SCHEMA_TYPES,
+    TYPE_EPOCH,
+    TYPE_U16,
+)
+from Photometer.files import (
+    cycle_settle_seconds,
+    watch_source,
+    SETTLE_SECONDS,
+    POLL_SECONDS,
+)
+from Photometer.profile import (
+    merge_profiles,
+)
+from Photometer.decode import open_result
+
+# Rows per transaction, pending rows are also written by flush
+BATCH_ROWS = 1000
+# Header entries written between result rows that change how the rows of a run are read
+RUN_ENTRIES = (HEADER_PROFILE, HEADER_BLANK)
+# Time string stamps of older result files, taken as UTC like Photometer.processing.epoch_seconds does
+TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    header TEXT NOT NULL,
+    repeats INTEGER NOT NULL,
+    epoch INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    time INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    detector INTEGER NOT NULL,
+    intensity INTEGER NOT NULL,
+    readings BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_series ON measurements (run, channel, intensity, time);
+"""
+
+
+def row_layout(header: dict, fields: list[str]) -> (int, bool):
+    """ Number of readings per row and time stamp type of a run
+
+    :param header: header entries of the run, see Photometer.header
+    :param fields: fields of the first result row, for runs without schema
+    :return: number of readings, whether rows are time stamped in epoch seconds
+    """
+
+    schema = header.get(HEADER_SCHEMA)
+    if schema is not None:
+        return schema[SCHEMA_TYPES].count(TYPE_U16), schema[SCHEMA_TYPES][0] == TYPE_EPOCH
+    return len(fields) - 4, fields[0].isdigit()
+
+
+def header_profile(header: dict) -> dict:
+    """ Profile a run was recorded with, including settings changed while running (see MeasurementStore.update_header)
+
+    :param header: header entries of the run
+    :return: profile dictionary, settings missing from the header taken from Photometer.constants
+    """
+
+    return merge_profiles([header.get(HEADER_PROFILE, {})])
+
+
+def row_seconds(time_field: str) -> int:
+    """ Seconds since the epoch of the time stamp of a result row
+
+    :param time_field: epoch seconds or time string
+    :return: seconds
+    """
+
+    if time_field.isdigit():
+        return int(time_field)
+    return calendar.timegm(time.strptime(time_field, TIME_FORMAT))
+
+
+class MeasurementStore:
+    """ SQLite store of result rows
+
+    Also an ingestion target of Photometer.fleet: header and row lines printed by a device open a run named
+    after the device and its start time, rows of a run are committed every batch_rows rows and by flush.
+    """
+
+    def __init__(
+            self,
+            file_path: str,
+            batch_rows: int = BATCH_ROWS,
+    ):
+        """ Initialize MeasurementStore, creating the database if needed.
+
+        :param file_path: path of the SQLite database
+        :param batch_rows: rows per transaction
+        """
+
+        self.file_path = file_path
+        self.batch_rows = batch_rows
+        self.connection = sqlite3.connect(file_path)
+        # Readers don't block the writer and vice versa; a crash loses at most the last transactions
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        # (run id, time, channel, detector, intensity, readings) not committed yet
+        self.pending = []
+        # Device name to header entries of a run whose rows haven't started yet, and to (run id, repeats, epoch)
+        self.headers = {}
+        self.runs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def open_run(
+            self,
+            name: str,
+            header: dict,
+            fields: list[str],
+            replace: bool = False,
+    ) -> (int, int, bool):
+        """ Run id of a run, created if new
+
+        :param name: name of the run
+        :param header: header entries of the run
+        :param fields: fields of the first result row
+        :param replace: drop rows of an existing run of the same name
+        :return: run id, number of readings per row, whether rows are time stamped in epoch seconds
+        """
+
+        repeats, epoch = row_layout(header, fields)
+        found = self.connection.execute('SELECT id, repeats, epoch FROM runs WHERE name = ?', (name,)).fetchone()
+        if found is not None and not replace:
+            return found[0], found[1], bool(found[2])
+        with self.connection:
+            if found is not None:
+                self.connection.execute('DELETE FROM measurements WHERE run = ?', (found[0],))
+                self.connection.execute('DELETE FROM runs WHERE id = ?', (found[0],))
+            cursor = self.connection.execute(
+                'INSERT INTO runs (name, header, repeats, epoch) VALUES (?, ?, ?, ?)',
+                (name, json.dumps(header), repeats, int(epoch)),
+            )
+        return cursor.lastrowid, repeats, epoch
+
+    def update_header(
+            self,
+            run: (int, int, bool),
+            key: str,
+            value,
+    ) -> None:
+        """ Add a header entry written between the result rows of a run
+
+        A profile written once settings changed while running is merged into the profile of the run
+        (see Photometer.profile.merge_profiles), other entries replace earlier ones of the same name.
+
+        :param run: run as returned by open_run
+        :param key: header entry name
+        :param value: header entry value
+        :return: None
+        """
+
+        run_id = run[0]
+        header = json.loads(self.connection.execute('SELECT header FROM runs WHERE id = ?', (run_id,)).fetchone()[0])
+        if key == HEADER_PROFILE:
+            value = merge_profiles([header.get(HEADER_PROFILE, {}), value])
+        header[key] = value
+        with self.connection:
+            self.connection.execute('UPDATE runs SET header = ? WHERE id = ?', (json.dumps(header), run_id))
+
+    def add_row(
+            self,
+            run: (int, int, bool),
+            fields: list[str],
+    ) -> None:
+        """ Queue a result row, commits once batch_rows rows are pending
+
+        :param run: run as returned by open_run
+        :param fields: fields of the result row
+        :return: None
+        """
+
+        run_id, repeats, _ = run
+        if len(fields) != repeats + 4:
+            # Incomplete row of a file still being written
+            return
+        readings = array('H', [int(i) for i in fields[4:]])
+        if sys.byteorder != 'little':
+            readings.byteswap()
+        self.pending.append((
+            run_id, row_seconds(fields[0]), int(fields[1]), int(fields[2]), int(fields[3]), readings.tobytes(),
+        ))
+        if len(self.pending) >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Commit all pending rows in one transaction
+
+        :return: None
+        """
+
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+        self.pending = []
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    def header(
+            self,
+            device: str,
+            key: str,
+            value,
+    ) -> None:
+        """ Header consumer of Photometer.fleet.Ingestor, a schema entry starts the header of a new run
+
+        :param device: device name
+        :param key: header entry name
+        :param value: header entry value
+        :return: None
+        """
+
+        if key == HEADER_SCHEMA:
+            self.runs.pop(device, None)
+            self.headers[device] = {}
+        if device in self.headers:
+            self.headers[device][key] = value
+        elif device in self.runs and key in RUN_ENTRIES:
+            self.update_header(self.runs[device], key, value)
+
+    def row(
+            self,
+            device: str,
+            fields: list[str],
+    ) -> None:
+        """ Row consumer of Photometer.fleet.Ingestor
+
+        :param device: device name
+        :param fields: fields of the result row
+        :return: None
+        """
+
+        if device not in self.runs:
+            header = self.headers.pop(device, {})
+            name = f"{device}_{header[HEADER_START]}" if HEADER_START in header else device
+            self.runs[device] = self.open_run(name, header, fields)
+        self.add_row(self.runs[device], fields)
+
+    def import_file(
+            self,
+            csv_file_path: str,
+            name: str | None = None,
+    ) -> int:
+        """ Add all rows of a result file as one run, replacing an earlier import of the same name
+
+        :param csv_file_path: path of .csv result file or stream
+        :param name: name of the run, defaults to the file name without extension
+        :return: number of rows added
+        """
+
+        if name is None:
+            name = os.path.splitext(os.path.basename(csv_file_path))[0]
+        header = {}
+        run = None
+        rows = 0
+        with open_result(csv_file_path) as f:
+            for line in f:
+                if line.startswith(HEADER_PREFIX):
+                    try:
+                        key, value = parse_header_line(line)
+                    except ValueError:
+                        continue
+                    if run is None:
+                        header[key] = value
+                    elif key in RUN_ENTRIES:
+                        self.update_header(run, key, value)
+                    continue
+                fields = line.rstrip('\r\n').split(SEPERATOR)
+                if len(fields) < 5:
+                    continue
+                if run is None:
+                    run = self.open_run(name, header, fields, replace=True)
+                self.add_row(run, fields)
+                rows += 1
+        self.flush()
+        return rows
+
+    def list_runs(self) -> list[(str, int, int, int)]:
+        """ Runs in the store
+
+        :return: list of (name, rows, first time stamp, last time stamp), time stamps in epoch seconds
+        """
+
+        return self.connection.execute(
+            'SELECT name, COUNT(time), MIN(time), MAX(time) FROM runs LEFT JOIN measurements ON run = id '
+            'GROUP BY id ORDER BY name'
+        ).fetchall()
+
+    def read_run(
+            self,
+            name: str,
+            channels: list[int] | None = None,
+            intensities: list[int] | None = None,
+            start: int | None = None,
+            end: int | None = None,
+            last_hours: float | None = None,
+    ):
+        """ Rows of a run as returned by Photometer.processing.read_measurements for its result file
+
+        :param name: name of the run
+        :param channels: LED anode GPIO numbers to read, all if None
+        :param intensities: LED duty powers to read, all if None
+        :param start: first epoch second to read, optional
+        :param end: last epoch second to read, optional
+        :param last_hours: only read this many hours before the last row of the run, optional
+        :return: Pandas data frame, None if there is no run of that name
+        """
+
+        import numpy as np
+        import pandas as pd
+
+        found = self.connection.execute('SELECT id, header, repeats, epoch FROM runs WHERE name = ?',
+                                        (name,)).fetchone()
+        if found is None:
+            return None
+        run_id, header, repeats, epoch = found
+        header = json.loads(header)
+        conditions = ['run = ?']
+        parameters = [run_id]
+        for column, values in (('channel', channels), ('intensity', intensities)):
+            if values is not None:
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                parameters.extend(int(i) for i in values)
+        if last_hours is not None:
+            last = self.connection.execute('SELECT MAX(time) FROM measurements WHERE run = ?', (run_id,)).fetchone()
+            if last[0] is not None:
+                start = max(start, last[0] - last_hours * 3600) if start is not None else last[0] - last_hours * 3600
+        if start is not None:
+            conditions.append('time >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('time <= ?')
+            parameters.append(end)
+        # rowid keeps the order rows were written in, as in the result file
+        rows = self.connection.execute(
+            f"SELECT time, channel, detector, intensity, readings FROM measurements "
+            f"WHERE {' AND '.join(conditions)} ORDER BY rowid",
+            parameters,
+        ).fetchall()
+
+        keys = np.array([row[:4] for row in rows], dtype=np.int64).reshape(len(rows), 4)
+        readings = np.frombuffer(b''.join(row[4] for row in rows), dtype='<u2').reshape(len(rows), repeats)
+        schema = header.get(HEADER_SCHEMA)
+        repeat_names = [int(c) for c, t in zip(schema[SCHEMA_COLUMNS], schema[SCHEMA_TYPES]) if t == TYPE_U16] \
+            if schema is not None else list(range(repeats))
+        df = pd.DataFrame({
+            # Microseconds give the datetime unit pd.read_csv parses time strings to
+            DATE: keys[:, 0] if epoch else pd.to_datetime(keys[:, 0] * 1000000, unit='us'),
+            CHANNEL: keys[:, 1],
+            DETECTOR: keys[:, 2],
+            INTENSITY: keys[:, 3],
+        })
+        df[repeat_names] = pd.DataFrame(readings.astype(np.uint16), columns=repeat_names)
+        df.attrs.update(header)
+        df.attrs[HEADER_PROFILE] = header_profile(header)
+        return df
+
+
+class _DataVersionSource:
+    """ Wait for commits to a store by polling PRAGMA data_version on a connection of its own.
+
+    data_version changes whenever another connection commits, so commits of any writer are seen
+    however SQLite lays them out in the database and write ahead log files.
+    """
+
+    def __init__(self, file_path: str, poll_seconds: float = POLL_SECONDS):
+        self.connection = sqlite3.connect(file_path)
+        self.poll_seconds = poll_seconds
+        self.last_version = self._version()
+
+    def _version(self) -> int:
+        return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def wait(self, timeout: float | None) -> bool:
+        """ Wait for a commit to the store
+
+        :param timeout: seconds to wait at most, None waits indefinitely
+        :return: True if another connection committed, False on timeout
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current_version = self._version()
+            if current_version != self.last_version:
+                self.last_version = current_version
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_seconds if deadline is None else
+                       min(self.poll_seconds, max(deadline - time.monotonic(), 0)))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def run_settle_seconds(connection: sqlite3.Connection, name: str) -> float:
+    """ Quiet time after which the rows of a measurement cycle of a run in the store are complete
+
+    :param connection: connection to the store
+    :param name: name of the run
+    :return: seconds, from the profile in the run header; SETTLE_SECONDS if the run isn't in the store yet
+    """
+
+    try:
+        found = connection.execute('SELECT header FROM runs WHERE name = ?', (name,)).fetchone()
+    except sqlite3.Error:
+        return SETTLE_SECONDS
+    if found is None:
+        return SETTLE_SECONDS
+    try:
+        return cycle_settle_seconds(header_profile(json.loads(found[0])))
+    except (ValueError, KeyError, TypeError):
+        return SETTLE_SECONDS
+
+
+def watch_store(
+        file_path: str,
+        name: str,
+        settle_seconds: float | None = None,
+        poll_seconds: float = POLL_SECONDS,
+):
+    """ Yield once per burst of commits to a store, after it has been quiet for settle_seconds.
+
+    Rows of a measurement cycle are committed within a short burst, so each cycle triggers one yield.
+
+    # Example usage:
+    for _ in watch_store('measurements.sqlite', 'pico-1_20241030-161800'):
+        make_figure('measurements.sqlite', run='pico-1_20241030-161800')
+
+    :param file_path: path of the SQLite database
+    :param name: name of the run whose profile sets the settle time
+    :param settle_seconds: quiet time after the last commit before a burst is considered finished,
+        None derives it from the profile in the header of the run (see run_settle_seconds)
+    :param poll_seconds: polling interval of the data version
+    :return: generator yielding None after each finished burst
+    """
+
+    source = _DataVersionSource(file_path, poll_seconds=poll_seconds)
+    yield from watch_source(
+        source,
+        (lambda: run_settle_seconds(source.connection, name)) if settle_seconds is None else settle_seconds,
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Import result files into a measurement store, list its runs")
+    parser.add_argument(
+        "--database", "-d",
+        help="SQLite database of the store, created if needed",
+        required=True,
+    )
+    parser.add_argument(
+        "--input", "-i",
+        nargs='+',
+        help="result files or streams to import, each as run named after the file",
+        default=[],
+    )
+    parser.add_argument(
+        "--list", "-l",
+        action='store_true',
+        help="List the runs in the store",
+    )
+    args = parser.parse_args(argv)
+
+    with MeasurementStore(args.database) as store:
+        for csv_file_path in args.input:
+            print(f"{csv_file_path}: {store.import_file(csv_file_path)} rows")
+        if args.list:
+            for name, rows, first, last in store.list_runs():
+                span = f"{time.strftime(TIME_FORMAT, time.gmtime(first))} to " \
+                       f"{time.strftime(TIME_FORMAT, time.gmtime(last))}" if rows else "empty"
+                print(f"{name}\t{rows} rows\t{span}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+""" Compact binary encoding of result files for slow links and long logging on flash.
+Runs on the Pico (MicroPython), the streaming decoder lives on the host in Photometer.decode.
+
+A stream is a sequence of frames:
+    SYNC  type  payload length (varint)  payload  Fletcher-16 checksum of type, length and payload (2 bytes)
+- FRAME_TEXT: a line as is, header and alert lines or rows with time string stamps
+- FRAME_KEY: a full row; series id, row count, epoch time, channel, detector, duty power, repeats, readings
+- FRAME_DELTA: a row of a series with a key frame; series id, row count, time since the previous row of the series,
+  first reading minus the first reading of the previous row of the series, every other reading minus the one before it
+Numbers are unsigned LEB128 varints, differences zigzag encoded first. Every series (channel and duty power) gets
+a key frame every KEYFRAME_ROWS rows. Row counts run per series modulo ROW_COUNT_MODULO, a delta frame is only
+decoded if it directly follows the last decoded row of its series. The decoder drops frames failing the checksum,
+searches the next SYNC and skips delta frames after a gap until the next key frame of their series, so a damaged
+stream loses rows, never values.
+Decoded lines are the same as the text rows Photometer would have written.
+Row frames printed over the serial link go base64 encoded on a line of their own after FRAME_LINE_PREFIX
+(see frame_line), so the link carries the compact rows as well.
+
+# Example usage:
+python -m Photometer.decode -i 20241030-161800_output.pms -o 20241030-161800_output.csv
+"""
+
+import binascii
+
+# File ending of streams written by Photometer
+STREAM_SUFFIX = '.pms'
+SYNC = 0xA5
+SYNC_BYTE = bytes([SYNC])
+FRAME_TEXT = 0x54
+FRAME_KEY = 0x4B
+FRAME_DELTA = 0x44
+FRAME_TYPES = (FRAME_TEXT, FRAME_KEY, FRAME_DELTA)
+# Longest payload, longer lengths are taken for damage instead of waiting for the bytes
+MAX_PAYLOAD = 2 ** 14
+MAX_LENGTH_BYTES = 2
+# Rows of a series between key frames
+KEYFRAME_ROWS = 16
+# Row counts wrap around here, one varint byte
+ROW_COUNT_MODULO = 128
+# Start of printed frame lines, no result row or header line starts with it
+FRAME_LINE_PREFIX = '~'
+
+
+def _varint(buffer: bytearray, value: int) -> None:
+    """ Append an unsigned LEB128 varint """
+
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _zigzag(value: int) -> int:
+    """ Signed to unsigned, small magnitudes stay small """
+
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def fletcher16(data) -> int:
+    """ Fletcher-16 checksum
+
+    :param data: bytes
+    :return: 16 bit checksum
+    """
+
+    sum1 = 0
+    sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+def _frame(frame_type: int, payload) -> bytes:
+    """ Frame a payload, see module docstring """
+
+    body = bytearray([frame_type])
+    _varint(body, len(payload))
+    body.extend(payload)
+    checksum = fletcher16(body)
+    return SYNC_BYTE + bytes(body) + bytes([checksum >> 8, checksum & 0xFF])
+
+
+class StreamEncoder:
+    """ Encode header lines and result rows into frames, keeps the state of every series
+
+    # Example usage:
+    encoder = StreamEncoder()
+    f.write(encoder.text(header_line))
+    f.write(encoder.row(1730305080, 0, 8, 9000, [20012, 20015, 20011]))
+    """
+
+    def __init__(
+            self,
+            keyframe_rows: int = KEYFRAME_ROWS,
+    ):
+        """ Initialize StreamEncoder.
+
+        :param keyframe_rows: rows of a series between key frames
+        """
+
+        self.keyframe_rows = keyframe_rows
+        # (channel, duty power) to series id and row count, kept by reset so ids and counts go on within a stream
+        self.ids = {}
+        self.rows = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """ Forget all series, the next row of each is a key frame; needed whenever a frame got lost
+
+        :return: None
+        """
+
+        # (channel, duty power) to [series id, detector, rows since key frame, first reading, repeats, time]
+        self.series = {}
+
+    @staticmethod
+    def text(line: str) -> bytes:
+        """ Frame of a text line
+
+        :param line: line without line break
+        :return: frame bytes
+        """
+
+        return _frame(FRAME_TEXT, line.encode())
+
+    def row(
+            self,
+            time_stamp: int,
+            channel: int,
+            detector: int,
+            led_duty_power: int,
+            readings: list[int],
+    ) -> bytes:
+        """ Frame of a result row with epoch time stamp
+
+        :param time_stamp: seconds since the epoch
+        :param channel: LED anode GPIO
+        :param detector: photoresistor anode GPIO
+        :param led_duty_power: LED duty power
+        :param readings: raw readings
+        :return: frame bytes
+        """
+
+        key = (channel, led_duty_power)
+        if key not in self.ids:
+            self.ids[key] = len(self.ids)
+            self.rows[key] = 0
+        row_count = self.rows[key] = (self.rows[key] + 1) % ROW_COUNT_MODULO
+        series = self.series.get(key)
+        payload = bytearray()
+        if (series is None or series[2] >= self.keyframe_rows or series[1] != detector
+                or series[4] != len(readings) or time_stamp < series[5]):
+            values = [self.ids[key], row_count, time_stamp, channel, detector, led_duty_power, len(readings)]
+            for value in values + readings:
+                _varint(payload, value)
+            self.series[key] = [self.ids[key], detector, 1, readings[0], len(readings), time_stamp]
+            frame_type = FRAME_KEY
+        else:
+            for value in (series[0], row_count, time_stamp - series[5], _zigzag(readings[0] - series[3])):
+                _varint(payload, value)
+            for i in range(1, len(readings)):
+                _varint(payload, _zigzag(readings[i] - readings[i - 1]))
+            series[2] += 1
+            series[3] = readings[0]
+            series[5] = time_stamp
+            frame_type = FRAME_DELTA
+        return _frame(frame_type, payload)
+
+
+def frame_line(frame: bytes) -> str:
+    """ Printable line of a frame, for the serial link
+
+    :param frame: frame bytes
+    :return: FRAME_LINE_PREFIX followed by the base64 encoded frame, without line break
+    """
+
+    return FRAME_LINE_PREFIX + binascii.b2a_base64(frame).decode().rstrip('\n')
@@ -0,0 +1,301 @@
+""" Sweep the smoothing and baseline parameters of the processing over one run, scored against reference ODs.
+
+The run is read and prepared once: repeat median, hours and dark reference do not depend on the swept
+parameters and are shared by all combinations. Each median window is one task for the worker processes,
+which get the prepared run once at start up, filter once per window and evaluate every baseline window,
+quantile and OD scale on the filtered series.
+
+# Example usage:
+scores = sweep_measurements(
+    '20241030-161800_output.csv',
+    median_windows=[3, 5, 9],
+    baseline_windows_hours=[(1, 10), (0, 5)],
+    baseline_quantiles=[.01, .05],
+    df_truth=read_reference('truth.tsv'),
+)
+scores.sort_values(RMSE).head()
+"""
+
+import argparse
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Photometer.constants import (
+    SEPERATOR,
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.files import atomic_write
+from Photometer.calibration import (
+    read_reference,
+    REFERENCE_OD,
+)
+from Photometer.processing import (
+    read_medians,
+    run_duty_cycles,
+    epoch_seconds,
+    convert_to_hours,
+    add_dark_reference,
+    smooth_series,
+    subtract_baseline,
+    scale_to_od,
+    MEDIAN,
+    MEDIAN_WINDOW,
+    BASELINE_WINDOW_HOURS,
+    BASELINE_QUANTILE,
+    OD_SCALE,
+)
+
+# Parameter and score columns
+MEDIAN_WINDOW_COLUMN = 'median_window'
+BASELINE_START = 'baseline_start'
+BASELINE_END = 'baseline_end'
+QUANTILE = 'baseline_quantile'
+SCALE = 'od_scale'
+PARAMETER_COLUMNS = [MEDIAN_WINDOW_COLUMN, BASELINE_START, BASELINE_END, QUANTILE, SCALE]
+RMSE = 'rmse'
+POINTS = 'points'
+
+# Prepared run and reference of a worker process, set once by _init_worker
+_shared = {}
+
+
+def prepare_run(
+        df: pd.DataFrame,
+        df_truth: pd.DataFrame | None = None,
+) -> (pd.DataFrame, pd.DataFrame | None):
+    """ Steps of the processing that no swept parameter depends on, in place
+
+    :param df: Pandas data frame with repeat median, as returned by read_medians
+    :param df_truth: Pandas data frame as returned by read_reference, optional
+    :return: the same data frame with date in hours and dark reference,
+        reference in long form with CHANNEL, DATE in hours of the run and REFERENCE_OD, None without reference
+    """
+
+    start_seconds = epoch_seconds(df[DATE]).min() if len(df) else 0
+    convert_to_hours(df)
+    add_dark_reference(df)
+    if df_truth is None:
+        return df, None
+    reference = df_truth.melt(id_vars=[DATE], var_name=CHANNEL, value_name=REFERENCE_OD).dropna()
+    reference[DATE] = (epoch_seconds(reference[DATE]) - start_seconds) / 3600
+    return df, reference
+
+
+def score_series(
+        df: pd.DataFrame,
+        reference: pd.DataFrame,
+        intensities: list[int],
+) -> pd.DataFrame:
+    """ Root mean squared difference of each intensity's OD estimate to the reference
+
+    Estimates are interpolated at the reference time points, points outside a series are left out.
+
+    :param df: processed Pandas data frame, date in hours
+    :param reference: reference as returned by prepare_run
+    :param intensities: LED duty powers to score
+    :return: Pandas data frame indexed by intensity with RMSE and POINTS
+    """
+
+    squared = {intensity: [] for intensity in intensities}
+    for (ch, intensity), series in df.loc[df[INTENSITY].isin(intensities)].groupby([CHANNEL, INTENSITY]):
+        selected = reference.loc[reference[CHANNEL] == ch]
+        hours = series[DATE].to_numpy()
+        inside = selected.loc[(selected[DATE] >= hours.min()) & (selected[DATE] <= hours.max())]
+        estimate = np.interp(inside[DATE].to_numpy(), hours, series[MEDIAN].to_numpy())
+        squared[intensity].append((estimate - inside[REFERENCE_OD].to_numpy()) ** 2)
+    scores = {}
+    for intensity, values in squared.items():
+        values = np.concatenate(values) if values else np.array([])
+        values = values[np.isfinite(values)]
+        scores[intensity] = {
+            RMSE: np.sqrt(values.mean()) if values.size else np.nan,
+            POINTS: values.size,
+        }
+    return pd.DataFrame.from_dict(scores, orient='index').rename_axis(INTENSITY)
+
+
+def _init_worker(
+        df: pd.DataFrame,
+        reference: pd.DataFrame | None,
+) -> None:
+    """ Keep the prepared run and reference for all tasks of a worker process """
+
+    _shared['df'] = df
+    _shared['reference'] = reference
+
+
+def _sweep_window(
+        median_window: int,
+        baseline_windows_hours: list[tuple[float, float]],
+        baseline_quantiles: list[float],
+        od_scales: list[float],
+) -> pd.DataFrame:
+    """ Filter the prepared run once, then evaluate every other parameter combination on it
+
+    :param median_window: size of the median filter
+    :param baseline_windows_hours: (start, end) hours to take the low value from
+    :param baseline_quantiles: quantiles of the early values used as low value
+    :param od_scales: ODs assigned to the dark value
+    :return: Pandas data frame with PARAMETER_COLUMNS, INTENSITY, RMSE and POINTS
+    """
+
+    df, reference = _shared['df'], _shared['reference']
+    intensities = run_duty_cycles(df)[1:]
+    smoothed = smooth_series(df.copy(), intensities=intensities, median_window=median_window)
+    scores = []
+    for (start, end), quantile in itertools.product(baseline_windows_hours, baseline_quantiles):
+        subtracted = subtract_baseline(
+            smoothed.copy(),
+            intensities=intensities,
+            baseline_window_hours=(start, end),
+            baseline_quantile=quantile,
+        )
+        for od_scale in od_scales:
+            processed = scale_to_od(subtracted.copy(), od_scale=od_scale)
+            if reference is not None:
+                score = score_series(processed, reference, intensities)
+            else:
+                score = pd.DataFrame({RMSE: np.nan, POINTS: 0}, index=pd.Index(intensities, name=INTENSITY))
+            scores.append(score.reset_index().assign(**{
+                MEDIAN_WINDOW_COLUMN: median_window,
+                BASELINE_START: start,
+                BASELINE_END: end,
+                QUANTILE: quantile,
+                SCALE: od_scale,
+            }))
+    return pd.concat(scores, ignore_index=True)
+
+
+def sweep_measurements(
+        csv_file_path: str,
+        median_windows: list[int] = (MEDIAN_WINDOW,),
+        baseline_windows_hours: list[tuple[float, float]] = (BASELINE_WINDOW_HOURS,),
+        baseline_quantiles: list[float] = (BASELINE_QUANTILE,),
+        od_scales: list[float] = (OD_SCALE,),
+        df_truth: pd.DataFrame | None = None,
+        processes: int | None = None,
+) -> pd.DataFrame | None:
+    """ Evaluate every combination of processing parameters on one run
+
+    :param csv_file_path: path of .csv result file
+    :param median_windows: sizes of the median filter
+    :param baseline_windows_hours: (start, end) hours to take the low value from
+    :param baseline_quantiles: quantiles of the early values used as low value
+    :param od_scales: ODs assigned to the dark value
+    :param df_truth: Pandas data frame as returned by read_reference, combinations are not scored without it
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :return: Pandas data frame with one row per combination and intensity: PARAMETER_COLUMNS, INTENSITY,
+        RMSE of the OD estimate to the reference and number of reference POINTS it is based on;
+        None if the file could not be parsed
+    """
+
+    df = read_medians(csv_file_path)
+    if df is None:
+        return None
+    df, reference = prepare_run(df, df_truth)
+    with ProcessPoolExecutor(
+            max_workers=min(processes or len(median_windows), len(median_windows)),
+            initializer=_init_worker,
+            initargs=(df, reference),
+    ) as executor:
+        scores = list(executor.map(
+            functools.partial(
+                _sweep_window,
+                baseline_windows_hours=list(baseline_windows_hours),
+                baseline_quantiles=list(baseline_quantiles),
+                od_scales=list(od_scales),
+            ),
+            median_windows,
+        ))
+    return pd.concat(scores, ignore_index=True)[PARAMETER_COLUMNS + [INTENSITY, RMSE, POINTS]]
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Sweep processing parameters over a result file")
+    parser.add_argument(
+        "--input", "-i",
+        help="input filename",
+        required=True,
+    )
+    parser.add_argument(
+        "--odreader", "-od",
+        help="file path for tab seperated sheet of true values, combinations are only scored with it",
+        default=None,
+    )
+    parser.add_argument(
+        "--median_windows", "-w",
+        type=int,
+        nargs='+',
+        help=f"Sizes of the median filter, defaults to {MEDIAN_WINDOW}",
+        default=[MEDIAN_WINDOW],
+    )
+    parser.add_argument(
+        "--baseline_starts",
+        type=float,
+        nargs='+',
+        help=f"Start hours of the baseline window, defaults to {BASELINE_WINDOW_HOURS[0]}",
+        default=[BASELINE_WINDOW_HOURS[0]],
+    )
+    parser.add_argument(
+        "--baseline_ends",
+        type=float,
+        nargs='+',
+        help=f"End hours of the baseline window, combined with every earlier start, "
+             f"defaults to {BASELINE_WINDOW_HOURS[1]}",
+        default=[BASELINE_WINDOW_HOURS[1]],
+    )
+    parser.add_argument(
+        "--baseline_quantiles", "-q",
+        type=float,
+        nargs='+',
+        help=f"Quantiles of the early values used as low value, defaults to {BASELINE_QUANTILE}",
+        default=[BASELINE_QUANTILE],
+    )
+    parser.add_argument(
+        "--od_scales",
+        type=float,
+        nargs='+',
+        help=f"ODs assigned to the dark value, defaults to {OD_SCALE}",
+        default=[OD_SCALE],
+    )
+    parser.add_argument(
+        "--processes", "-p",
+        type=int,
+        help="Number of worker processes, defaults to the number of CPUs",
+        default=None,
+    )
+    parser.add_argument(
+        "--output", "-o",
+        help="Output .csv file path for the score table, printed only if not given",
+        default=None,
+    )
+    args = parser.parse_args(argv)
+
+    scores = sweep_measurements(
+        args.input,
+        median_windows=args.median_windows,
+        baseline_windows_hours=[
+            (start, end) for start, end in itertools.product(args.baseline_starts, args.baseline_ends) if start < end
+        ],
+        baseline_quantiles=args.baseline_quantiles,
+        od_scales=args.od_scales,
+        df_truth=read_reference(args.odreader) if args.odreader is not None else None,
+        processes=args.processes,
+    )
+    if scores is None:
+        print(f"Couldn't read {args.input}")
+        return
+    print(scores.sort_values(RMSE).to_string(index=False))
+    if args.output is not None:
+        with atomic_write(args.output) as f:
+            scores.to_csv(f, sep=SEPERATOR, index=False)
+
+
+if __name__ == '__main__':
+    main()
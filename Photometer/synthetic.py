@@ -0,0 +1,222 @@
+""" Synthetic result files in the exact layout of Photometer.format_result, for benchmarks and offline testing. """
+
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from Photometer.constants import (
+    SEPERATOR,
+    FIRMWARE_VERSION,
+    EPOCH_TIMESTAMPS,
+    MAX_U16,
+    PWM_DUTY_CYCLES,
+    MEASUREMENT_REPEATS,
+    MEASUREMENT_REPEAT_INTERVAL_SECONDS,
+    MEASUREMENT_FREQUENCY_SECONDS,
+    MEASUREMENT_LED_WARMUP_SECONDS,
+)
+from Photometer.files import atomic_write
+from Photometer.header import header_lines
+from Photometer.profile import (
+    default_profile,
+    PROFILE_NAME,
+    PROFILE_PWM_DUTY_CYCLES,
+    PROFILE_GPIO_PAIRS,
+    PROFILE_REPEATS,
+    PROFILE_FREQUENCY,
+)
+
+# Simulated hardware
+DARK_READING = 15000
+LIGHT_RANGE = 45000
+READING_NOISE = 50
+# Simulated culture: logistic growth from START_OD to PLATEAU_OD
+START_OD = .01
+PLATEAU_OD = 1.4
+GROWTH_RATE = .3
+LAG_HOURS = 15
+# Rows are generated in blocks of this many cycles to bound memory for long runs
+CYCLES_PER_BLOCK = 1000
+
+
+def synthetic_duty_cycles(
+        intensities: int,
+) -> list[int]:
+    """ Dark measurement followed by intensities - 1 LED duty powers up to MAX_U16
+
+    :param intensities: number of duty powers including the dark measurement
+    :return: list of duty powers
+    """
+
+    if intensities == len(PWM_DUTY_CYCLES):
+        return list(PWM_DUTY_CYCLES)
+    return [0] + [int(MAX_U16 * (i / (intensities - 1)) ** 2) for i in range(1, intensities)]
+
+
+def growth_curve(
+        hours: np.ndarray,
+        lag_hours: float = LAG_HOURS,
+        growth_rate: float = GROWTH_RATE,
+        start_od: float = START_OD,
+        plateau_od: float = PLATEAU_OD,
+) -> np.ndarray:
+    """ Logistic growth with lag phase
+
+    :param hours: time points
+    :param lag_hours: hours before growth starts
+    :param growth_rate: exponential growth rate per hour
+    :param start_od: OD during the lag phase
+    :param plateau_od: OD growth saturates at
+    :return: OD at every time point
+    """
+
+    exponential = np.exp(growth_rate * np.clip(hours - lag_hours, 0, None))
+    return start_od * exponential / (1 + start_od * (exponential - 1) / plateau_od)
+
+
+def write_synthetic_run(
+        file_path: str,
+        channels: int = 8,
+        pwm_duty_cycles: list[int] | None = None,
+        measurement_repeats: int = MEASUREMENT_REPEATS,
+        days: float = 1,
+        measurement_frequency_seconds: int = MEASUREMENT_FREQUENCY_SECONDS,
+        start: datetime = datetime(2024, 10, 30, 16, 18),
+        seed: int = 0,
+        epoch_timestamps: bool = EPOCH_TIMESTAMPS,
+        start_od: float = START_OD,
+) -> int:
+    """ Write a synthetic result file
+
+    Every third channel stays blank, the others grow with lags staggered by channel.
+    Time stamps advance per row like a real cycle (warmup plus repeats), GPIO pairs follow the default
+    layout (channel, channel + channels). The file starts with a header like a recorded one.
+
+    # Example usage:
+    write_synthetic_run('synthetic_output.csv', channels=8, days=30)
+
+    :param file_path: path of the .csv file to write
+    :param channels: number of LED / photoresistor pairs
+    :param pwm_duty_cycles: LED duty powers, first one is the dark measurement
+    :param measurement_repeats: number of repeat readings per row
+    :param days: length of the run
+    :param measurement_frequency_seconds: seconds between cycles
+    :param start: time of the first cycle
+    :param seed: random seed
+    :param epoch_timestamps: time stamp rows with seconds since the epoch instead of time strings
+    :param start_od: OD of the cultures during the lag phase (inoculum)
+    :return: number of rows written
+    """
+
+    pwm_duty_cycles = PWM_DUTY_CYCLES if pwm_duty_cycles is None else pwm_duty_cycles
+    rng = np.random.default_rng(seed)
+    cycles = int(days * 24 * 3600 // measurement_frequency_seconds)
+    row_seconds = MEASUREMENT_LED_WARMUP_SECONDS + measurement_repeats * MEASUREMENT_REPEAT_INTERVAL_SECONDS
+    duty = np.array(pwm_duty_cycles, dtype=float)
+    light = LIGHT_RANGE * np.sqrt(duty / MAX_U16)
+    channel_numbers = np.arange(channels)
+    growing = channel_numbers % 3 != 0
+    lag = LAG_HOURS + channel_numbers
+    # Naive start is taken as wall clock time, like the Pico clock set by mpremote setrtc
+    start_seconds = int((start - datetime(1970, 1, 1)).total_seconds())
+
+    profile = default_profile()
+    profile.update({
+        PROFILE_NAME: 'synthetic',
+        PROFILE_PWM_DUTY_CYCLES: list(pwm_duty_cycles),
+        PROFILE_GPIO_PAIRS: [[channel, channel + channels] for channel in range(channels)],
+        PROFILE_REPEATS: measurement_repeats,
+        PROFILE_FREQUENCY: measurement_frequency_seconds,
+    })
+
+    rows_written = 0
+    with atomic_write(file_path) as f:
+        f.writelines(line + "\n" for line in header_lines(
+            profile=profile,
+            firmware_version=FIRMWARE_VERSION,
+            start_time=start.strftime('%Y%m%d-%H%M%S'),
+            measurement_repeats=measurement_repeats,
+            epoch_timestamps=epoch_timestamps,
+        ))
+        for block_start in range(0, cycles, CYCLES_PER_BLOCK):
+            cycle = np.arange(block_start, min(block_start + CYCLES_PER_BLOCK, cycles))
+            # Shape: cycle x channel x intensity
+            row_index = (channel_numbers[None, :, None] * len(pwm_duty_cycles) +
+                         np.arange(len(pwm_duty_cycles))[None, None, :])
+            seconds = cycle[:, None, None] * measurement_frequency_seconds + row_index * row_seconds
+            od = np.where(
+                growing[None, :, None],
+                growth_curve(seconds / 3600, lag_hours=lag[None, :, None], start_od=start_od),
+                start_od,
+            )
+            expected = DARK_READING + light[None, None, :] * 10 ** -od
+            readings = expected[..., None] + rng.normal(0, READING_NOISE, expected.shape + (measurement_repeats,))
+            readings = np.clip(readings, 0, MAX_U16).astype(np.int64).reshape(-1, measurement_repeats)
+
+            if epoch_timestamps:
+                times = (start_seconds + seconds.ravel()).astype(np.int64).tolist()
+            else:
+                times = [(start + timedelta(seconds=int(s))).strftime('%Y%m%d-%H%M%S') for s in seconds.ravel()]
+            leds = np.broadcast_to(channel_numbers[None, :, None], seconds.shape).ravel()
+            duties = np.broadcast_to(np.array(pwm_duty_cycles)[None, None, :], seconds.shape).ravel()
+            f.writelines(
+                SEPERATOR.join([str(t), str(led), str(led + channels), str(d)] + [str(r) for r in reading]) + "\n"
+                for t, led, d, reading in zip(times, leds.tolist(), duties.tolist(), readings.tolist())
+            )
+            rows_written += len(times)
+    return rows_written
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic result file")
+    parser.add_argument(
+        "--output", "-o",
+        help="Output .csv file path",
+        required=True,
+    )
+    parser.add_argument(
+        "--channels", "-c",
+        type=int,
+        help="Number of LED / photoresistor pairs, defaults to 8",
+        default=8,
+    )
+    parser.add_argument(
+        "--intensities", "-n",
+        type=int,
+        help=f"Number of LED duty powers including the dark measurement, defaults to {len(PWM_DUTY_CYCLES)}",
+        default=len(PWM_DUTY_CYCLES),
+    )
+    parser.add_argument(
+        "--repeats", "-r",
+        type=int,
+        help=f"Number of repeat readings per row, defaults to {MEASUREMENT_REPEATS}",
+        default=MEASUREMENT_REPEATS,
+    )
+    parser.add_argument(
+        "--days", "-d",
+        type=float,
+        help="Length of the run in days, defaults to 1",
+        default=1,
+    )
+    parser.add_argument(
+        "--seed", "-s",
+        type=int,
+        help="Random seed, defaults to 0",
+        default=0,
+    )
+    args = parser.parse_args(argv)
+
+    rows = write_synthetic_run(
+        args.output,
+        channels=args.channels,
+        pwm_duty_cycles=synthetic_duty_cycles(args.intensities),
+        measurement_repeats=args.repeats,
+        days=args.days,
+        seed=args.seed,
+    )
+    print(f"{rows} rows written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
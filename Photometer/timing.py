@@ -0,0 +1,179 @@
+""" Per phase and per channel timing of measurement cycles, runs on the Pico (MicroPython) and on the host. """
+
+import gc
+import json
+import time
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+# Phases recorded by Photometer
+PHASE_WARMUP = 'warmup'
+PHASE_ADC = 'adc'
+PHASE_REPEAT_SLEEP = 'repeat_sleep'
+PHASE_FORMAT = 'format'
+PHASE_PRINT = 'print'
+PHASE_WRITE = 'write'
+PHASE_GC = 'gc'
+PHASES = [PHASE_WARMUP, PHASE_ADC, PHASE_REPEAT_SLEEP, PHASE_FORMAT, PHASE_PRINT, PHASE_WRITE, PHASE_GC]
+
+# Keys of a timing record
+RECORD_TIME = 'time'
+RECORD_CYCLE = 'cycle'
+RECORD_TOTAL_US = 'total_us'
+RECORD_PREDICTED_US = 'predicted_us'
+RECORD_MEM_FREE = 'mem_free'
+RECORD_MEM_ALLOC = 'mem_alloc'
+RECORD_PHASES = 'phases'
+# Per channel: [intensity, milliseconds, settled before the timeout] of every adaptive settle, see Photometer.settle
+RECORD_SETTLE = 'settle'
+# Phase spans outside of any channel
+NO_CHANNEL = -1
+
+
+class CycleProfiler:
+    """ Accumulate ticks_us spans per phase and channel during one measurement cycle
+
+    # Example usage:
+    profiler = CycleProfiler()
+    profiler.start_cycle()
+    profiler.channel = 0
+    start = profiler.start()
+    time.sleep(2)
+    profiler.stop(PHASE_WARMUP, start)
+    line = profiler.record(get_time_string())
+    """
+
+    def __init__(self):
+        self.cycle = -1
+        self.channel = NO_CHANNEL
+        self.spans = {}
+        self.settle = {}
+        self.cycle_start = ticks_us()
+
+    def start_cycle(self) -> None:
+        """ Reset all spans, start timing a new cycle
+
+        :return: None
+        """
+
+        self.cycle += 1
+        self.channel = NO_CHANNEL
+        self.spans = {}
+        self.settle = {}
+        self.cycle_start = ticks_us()
+
+    @staticmethod
+    def start() -> int:
+        """ Start of a span
+
+        :return: current ticks
+        """
+
+        return ticks_us()
+
+    def stop(
+            self,
+            phase: str,
+            start: int,
+    ) -> None:
+        """ Add the time since start to phase of the current channel
+
+        :param phase: phase name, see PHASES
+        :param start: ticks as returned by start()
+        :return: None
+        """
+
+        span = ticks_diff(ticks_us(), start)
+        channels = self.spans.setdefault(phase, {})
+        channels[self.channel] = channels.get(self.channel, 0) + span
+
+    def settled(
+            self,
+            intensity: int,
+            start: int,
+            converged: bool,
+    ) -> None:
+        """ Record how long the current channel took to settle at an intensity
+
+        :param intensity: LED duty power
+        :param start: ticks as returned by start(), taken when the LED was set
+        :param converged: whether readings settled before the timeout
+        :return: None
+        """
+
+        ms = ticks_diff(ticks_us(), start) // 1000
+        self.settle.setdefault(self.channel, []).append([intensity, ms, converged])
+
+    def record(
+            self,
+            time_string: str,
+            collect_garbage: bool = True,
+            predicted_us: int | None = None,
+    ) -> str:
+        """ Finish the cycle and return its compact timing record
+
+        Optionally runs the garbage collector first (timed as PHASE_GC), so free heap is comparable between cycles.
+
+        :param time_string: time stamp of the record
+        :param collect_garbage: whether to run and time gc.collect()
+        :param predicted_us: predicted cycle duration (see Photometer.schedule), recorded next to the total
+        :return: one line JSON record without line break
+        """
+
+        if collect_garbage:
+            self.channel = NO_CHANNEL
+            start = self.start()
+            gc.collect()
+            self.stop(PHASE_GC, start)
+        try:
+            mem_free, mem_alloc = gc.mem_free(), gc.mem_alloc()
+        except AttributeError:
+            # Not available in CPython
+            mem_free, mem_alloc = None, None
+        return json.dumps({
+            RECORD_TIME: time_string,
+            RECORD_CYCLE: self.cycle,
+            RECORD_TOTAL_US: ticks_diff(ticks_us(), self.cycle_start),
+            RECORD_PREDICTED_US: predicted_us,
+            RECORD_MEM_FREE: mem_free,
+            RECORD_MEM_ALLOC: mem_alloc,
+            # JSON keys have to be strings
+            RECORD_PHASES: {p: {str(c): v for c, v in s.items()} for p, s in self.spans.items()},
+            RECORD_SETTLE: {str(c): v for c, v in self.settle.items()},
+        })
+
+
+class DummyCycleProfiler:
+    """ Dummy class in case timing is not recorded. """
+
+    channel = NO_CHANNEL
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def start_cycle(*args, **kwargs) -> None:
+        pass
+
+    @staticmethod
+    def start(*args, **kwargs) -> int:
+        return 0
+
+    @staticmethod
+    def stop(*args, **kwargs) -> None:
+        pass
+
+    @staticmethod
+    def settled(*args, **kwargs) -> None:
+        pass
+
+    @staticmethod
+    def record(*args, **kwargs) -> None:
+        return None
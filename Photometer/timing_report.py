@@ -0,0 +1,203 @@
+""" Host side report of the timing records written by Photometer with profile_timing enabled. """
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from Photometer.timing import (
+    RECORD_TIME,
+    RECORD_CYCLE,
+    RECORD_TOTAL_US,
+    RECORD_PREDICTED_US,
+    RECORD_MEM_FREE,
+    RECORD_MEM_ALLOC,
+    RECORD_PHASES,
+    RECORD_SETTLE,
+    NO_CHANNEL,
+)
+
+PHASE = 'phase'
+CHANNEL = 'channel'
+MICROSECONDS = 'us'
+INTENSITY = 'intensity'
+MILLISECONDS = 'ms'
+CONVERGED = 'converged'
+OTHER = 'other'
+
+
+def read_timing(
+        file_path: str,
+) -> (pd.DataFrame, pd.DataFrame):
+    """ Read a timing file, skipping incomplete lines (e.g. the one currently being written)
+
+    :param file_path: path of the _timing.jsonl file
+    :return: per cycle data frame (time, cycle, total, predicted total, memory) and long data frame of spans
+        (cycle, phase, channel, us)
+    """
+
+    cycles = []
+    spans = []
+    with open(file_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            cycles.append({k: record[k] for k in [RECORD_TIME, RECORD_CYCLE, RECORD_TOTAL_US,
+                                                  RECORD_MEM_FREE, RECORD_MEM_ALLOC]})
+            # Records written before cycles were scheduled have no prediction
+            cycles[-1][RECORD_PREDICTED_US] = record.get(RECORD_PREDICTED_US)
+            spans.extend(
+                (record[RECORD_CYCLE], phase, int(channel), us)
+                for phase, channels in record[RECORD_PHASES].items()
+                for channel, us in channels.items()
+            )
+    df_cycles = pd.DataFrame(cycles, columns=[RECORD_TIME, RECORD_CYCLE, RECORD_TOTAL_US, RECORD_PREDICTED_US,
+                                              RECORD_MEM_FREE, RECORD_MEM_ALLOC])
+    df_cycles[RECORD_TIME] = pd.to_datetime(df_cycles[RECORD_TIME], format='%Y%m%d-%H%M%S')
+    return df_cycles, pd.DataFrame(spans, columns=[RECORD_CYCLE, PHASE, CHANNEL, MICROSECONDS])
+
+
+def read_settle(
+        file_path: str,
+) -> pd.DataFrame:
+    """ Read the adaptive settle times of a timing file (see Photometer.settle)
+
+    :param file_path: path of the _timing.jsonl file
+    :return: long data frame of settles (cycle, channel, intensity, ms, converged), empty without adaptive settle
+    """
+
+    settles = []
+    with open(file_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            settles.extend(
+                (record[RECORD_CYCLE], int(channel), intensity, ms, converged)
+                for channel, values in record.get(RECORD_SETTLE, {}).items()
+                for intensity, ms, converged in values
+            )
+    return pd.DataFrame(settles, columns=[RECORD_CYCLE, CHANNEL, INTENSITY, MILLISECONDS, CONVERGED])
+
+
+def phase_summary(
+        df_cycles: pd.DataFrame,
+        df_spans: pd.DataFrame,
+) -> pd.DataFrame:
+    """ Mean time per cycle of every phase, its share of the cycle and its trend over the run
+
+    Time of the cycle not covered by any phase (pin switching, loop overhead) is reported as OTHER.
+
+    :param df_cycles: per cycle data frame as returned by read_timing
+    :param df_spans: span data frame as returned by read_timing
+    :return: Pandas data frame indexed by phase, sorted by mean time, times in seconds
+    """
+
+    per_cycle = df_spans.pivot_table(index=RECORD_CYCLE, columns=PHASE, values=MICROSECONDS, aggfunc='sum')
+    per_cycle = per_cycle.reindex(df_cycles[RECORD_CYCLE]).fillna(0)
+    per_cycle[OTHER] = df_cycles.set_index(RECORD_CYCLE)[RECORD_TOTAL_US] - per_cycle.sum(axis=1)
+    per_cycle = per_cycle / 1e6
+
+    hours = ((df_cycles[RECORD_TIME] - df_cycles[RECORD_TIME].min()).dt.total_seconds() / 3600).to_numpy()
+    if len(hours) > 1 and np.ptp(hours) > 0:
+        # Least squares slope of every phase against run time
+        centred = hours - hours.mean()
+        trend = centred @ (per_cycle.to_numpy() - per_cycle.to_numpy().mean(axis=0)) / (centred @ centred)
+    else:
+        trend = np.full(per_cycle.shape[1], np.nan)
+
+    mean = per_cycle.mean()
+    summary = pd.DataFrame({
+        'mean_s': mean,
+        'share': mean / mean.sum(),
+        'max_s': per_cycle.max(),
+        'trend_s_per_day': trend * 24,
+    })
+    return summary.sort_values('mean_s', ascending=False)
+
+
+def channel_summary(
+        df_spans: pd.DataFrame,
+) -> pd.DataFrame:
+    """ Mean time per cycle of every phase and channel
+
+    :param df_spans: span data frame as returned by read_timing
+    :return: Pandas data frame indexed by channel, one column per phase, times in seconds
+    """
+
+    cycles = df_spans[RECORD_CYCLE].nunique()
+    table = df_spans.pivot_table(index=CHANNEL, columns=PHASE, values=MICROSECONDS, aggfunc='sum') / cycles / 1e6
+    return table.rename(index={NO_CHANNEL: 'none'})
+
+
+def settle_summary(
+        df_settle: pd.DataFrame,
+) -> pd.DataFrame:
+    """ Median and longest settle time of every channel and intensity, and the share that timed out
+
+    :param df_settle: settle data frame as returned by read_settle
+    :return: Pandas data frame indexed by channel and intensity
+    """
+
+    grouped = df_settle.groupby([CHANNEL, INTENSITY])
+    return pd.DataFrame({
+        'median_ms': grouped[MILLISECONDS].median(),
+        'max_ms': grouped[MILLISECONDS].max(),
+        'timed_out': 1 - grouped[CONVERGED].mean(),
+    })
+
+
+def memory_summary(
+        df_cycles: pd.DataFrame,
+) -> pd.DataFrame:
+    """ First, last and lowest free heap of the run, a falling free heap after gc points to a leak
+
+    :param df_cycles: per cycle data frame as returned by read_timing
+    :return: Pandas data frame indexed by first / last / min
+    """
+
+    memory = df_cycles[[RECORD_MEM_FREE, RECORD_MEM_ALLOC]]
+    return pd.DataFrame({
+        'first': memory.iloc[0],
+        'last': memory.iloc[-1],
+        'min': memory.min(),
+    }).T
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Report where the time of the measurement cycles goes")
+    parser.add_argument(
+        "--input", "-i",
+        help="timing file (_timing.jsonl) written next to the results",
+        required=True,
+    )
+    args = parser.parse_args(argv)
+
+    df_cycles, df_spans = read_timing(args.input)
+    if df_cycles.empty:
+        print(f"No timing records in {args.input}")
+        return
+    print(f"{len(df_cycles)} cycles, mean cycle duration {df_cycles[RECORD_TOTAL_US].mean() / 1e6:.2f} s")
+    if df_cycles[RECORD_PREDICTED_US].notna().any():
+        overhead = (df_cycles[RECORD_TOTAL_US] - df_cycles[RECORD_PREDICTED_US]).mean()
+        print(f"Predicted cycle duration {df_cycles[RECORD_PREDICTED_US].mean() / 1e6:.2f} s, "
+              f"{overhead / 1e6:.2f} s spent outside of the predicted waits")
+    print("\nPhases per cycle:")
+    print(phase_summary(df_cycles, df_spans).to_string(float_format='{:.4f}'.format))
+    print("\nPhases per channel and cycle (s):")
+    print(channel_summary(df_spans).to_string(float_format='{:.4f}'.format))
+    df_settle = read_settle(args.input)
+    if not df_settle.empty:
+        print("\nAdaptive settle per channel and intensity:")
+        print(settle_summary(df_settle).to_string(float_format='{:.2f}'.format))
+    if df_cycles[RECORD_MEM_FREE].notna().any():
+        print("\nHeap (bytes):")
+        print(memory_summary(df_cycles).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,36 @@
-import pandas as pd
 import os
 import argparse
-
-from scipy.ndimage import median_filter
-from scipy.signal import savgol_filter
-from scipy.special import euler
+from typing import TYPE_CHECKING
 
 from Photometer.constants import (
-    SEPERATOR,
-    PWM_DUTY_CYCLES,
     MAX_U16,
-    MEASUREMENT_REPEATS,
     DATE,
     CHANNEL,
-    DETECTOR,
-    INTENSITY, MEASUREMENT_FREQUENCY_SECONDS,
+    INTENSITY,
+)
+from Photometer.files import watch_file
+from Photometer.plotting import (
+    style_context,
+    iter_series,
+    format_od_axis,
+    save_figure,
+    STYLES,
+    STYLE_SCREEN,
+    STYLE_LINE_COLOR,
+    YAXIS_MIN,
+    YAXIS_MAX,
+    OD_LABEL,
+    PLOT_POINTS,
 )
-from matplotlib import pyplot as plt
 from datetime import datetime
 import time
+import traceback
+
+# pandas, scipy and matplotlib are imported once a figure is drawn, so --help and argument errors answer right away
+if TYPE_CHECKING:
+    import pandas as pd
+    from Photometer.chunked import LiveProcessor
+    from Photometer.pyramid import SeriesPyramid
 
 '''
 # Example true value data frame:
@@ -55,172 +67,249 @@ df_truth[DATE] = (df_truth[DATE] - df_truth[DATE].min()).dt.total_seconds() / 36
 def make_figure(
         csv_file_path: str,
         image_file_path: str | None = None,
-        df_truth: pd.DataFrame | None = None,
-        yaxis_min: float | int = .0004,
-        yaxis_max: float | int = 2.5,
+        df_truth: 'pd.DataFrame | str | None' = None,
+        yaxis_min: float | int = YAXIS_MIN,
+        yaxis_max: float | int = YAXIS_MAX,
         titles: list[str] | None = None,
+        calibration: 'pd.DataFrame | str | None' = None,
+        fuse: bool = False,
+        points: int | None = PLOT_POINTS,
+        pyramid: 'SeriesPyramid | None' = None,
+        live: 'LiveProcessor | None' = None,
+        chunk_rows: int | None = None,
+        run: str | None = None,
+        last_hours: float | None = None,
+        style: str = STYLE_SCREEN,
 ) -> None:
     """ Create a figure from the measurements
 
-    :param csv_file_path: path of .csv result file
+    :param csv_file_path: path of .csv result file, or of the measurement store with run (see Photometer.store)
     :param image_file_path: path to save image under
-    :param df_truth: Pandas data frame with measured values
+    :param df_truth: Pandas data frame with measured values as returned by read_reference, or its file path
     :param yaxis_min: min value on the y-axis
     :param yaxis_max: max value on the y-axis
     :param titles: Optional list of strings for the titles of each axis
+    :param calibration: Optional calibration models as returned by load_calibration, or their file path;
+        if given, calibrated OD and the combined OD of all intensities are shown instead of the dark scaled values
+    :param fuse: Show one OD trace per channel fused from all intensities by SNR and saturation,
+        uses calibration if given
+    :param points: Maximum number of points drawn per channel and intensity, longer series are drawn
+        as median of time bins with their min / max range; None draws every measurement
+    :param pyramid: SeriesPyramid kept between calls to only update the bins of new rows, optional
+    :param live: LiveProcessor of csv_file_path kept between calls to only read and process the rows appended
+        since the last call, with pyramid; ignored with calibration, fuse, run or points None
+    :param chunk_rows: Process the file this many rows at a time and keep only the plotted columns, for runs
+        too long to load at once; ignored with calibration, fuse or run
+    :param run: Name of the run to draw from the measurement store at csv_file_path, optional
+    :param last_hours: Only draw this many hours before the last row of the run, with run
+    :param style: Style preset of the figure, see Photometer.plotting
     :return: None
     """
-    repeats = [i for i in range(MEASUREMENT_REPEATS)]
-    column_names = [DATE, CHANNEL, DETECTOR, INTENSITY, ] + repeats
+    # Imported here, pyplot alone takes about half a second to load
+    from matplotlib import pyplot as plt
+    import pandas as pd
 
-    if df_truth is not None:
-        try:
-            df_truth = pd.read_csv(
-                args.odreader,
-                sep=SEPERATOR,
-                header=0,
-                names=[DATE, 0, 1, 2, 3, 4, 5, 6, 7],
-                date_format='%Y%m%d %H:%M',
-                parse_dates=[DATE],
-            )
+    from Photometer.processing import (
+        read_measurements,
+        run_duty_cycles,
+        epoch_seconds,
+        process_measurements,
+        MEDIAN,
+    )
+    from Photometer.calibration import (
+        read_reference,
+        load_calibration,
+        calibrate_measurements,
+        combine_intensities,
+        CALIBRATED_OD,
+    )
+    from Photometer.fusion import (
+        fuse_measurements,
+        fuse_intensities,
+        FUSED_OD,
+    )
+    from Photometer.chunked import (
+        read_processed,
+        START_SECONDS,
+    )
+    from Photometer.store import MeasurementStore
+    from Photometer.pyramid import (
+        SeriesPyramid,
+        RAW_LEVEL,
+        BIN_MIN,
+        BIN_MAX,
+        BIN_MEDIAN,
+    )
 
-            df_truth[DATE] = (df_truth[DATE] - df_truth[DATE].min()).dt.total_seconds() / 3600
-            print(max(df_truth[DATE]))
-        except pd.errors.ParserError:
+    if isinstance(df_truth, str):
+        try:
+            df_truth = read_reference(df_truth)
+        except (pd.errors.ParserError, ValueError):
             print("Couldn't read truth values, continuing without")
             df_truth = None
-    try:
-        df = pd.read_csv(
-            filepath_or_buffer=csv_file_path,
-            sep=SEPERATOR,
-            header=None,
-            names=column_names,
-            date_format='%Y%m%d-%H%M%S',
-            parse_dates=[DATE],
-        )
-    except pd.errors.ParserError:
-        return None
+    if isinstance(calibration, str):
+        calibration = load_calibration(calibration)
+
+    plain = calibration is None and not fuse and run is None
+    incremental = live is not None and plain and points is not None
+    chunked = chunk_rows is not None and plain and not incremental
+    if points is not None:
+        pyramid = SeriesPyramid() if pyramid is None else pyramid
+    df_combined = None
+    if incremental:
+        # Only the rows appended since the last call are read and processed
+        df_final, df_tail, restarted = live.update()
+        if restarted:
+            pyramid.reset()
+        pwm_duty_cycles = live.pwm_duty_cycles
+        df_final, df_tail = [
+            None if rows is None else rows.loc[rows[INTENSITY].isin(pwm_duty_cycles[1:])]
+            for rows in (df_final, df_tail)
+        ]
+        pyramid.extend(df_final, column=MEDIAN, tail=df_tail)
+        if pyramid.rows is None or not len(pyramid.rows):
+            return None
+        channels = pyramid.channels()
+        start_seconds = live.start_seconds
+        last_hour = pyramid.rows[DATE][-1]
+    else:
+        if run is not None:
+            with MeasurementStore(csv_file_path) as store:
+                df = store.read_run(run, last_hours=last_hours)
+        elif chunked:
+            df = read_processed(csv_file_path, columns=[DATE, CHANNEL, INTENSITY, MEDIAN], chunk_rows=chunk_rows)
+        else:
+            df = read_measurements(csv_file_path)
+        if df is None:
+            return None
+        pwm_duty_cycles = run_duty_cycles(df)
+        channels = df[CHANNEL].unique()
     if titles is not None:
-        assert len(df[CHANNEL].unique()) == len(titles), f"Wrong number of titles provided: {df[CHANNEL].unique()}"
+        assert len(channels) == len(titles), f"Wrong number of titles provided: {channels}"
 
-    # Convert to hours for display
-    df[DATE] = (df[DATE] - df[DATE].min()).dt.total_seconds() / 3600
     if df_truth is not None:
-        print(max(df[DATE]))
-        print(max(df_truth[DATE]) - max(df[DATE]))
-
-    # Take median measurement
-    df['med'] = df[repeats].median(axis=1)
-    # Flip all measurements so low values are low measurements
-    df['med'] = MAX_U16 - df['med']
+        # Same time axis as the measurements
+        if not incremental:
+            start_seconds = df.attrs[START_SECONDS] if chunked else epoch_seconds(df[DATE]).min()
+        df_truth = df_truth.copy()
+        df_truth[DATE] = (epoch_seconds(df_truth[DATE]) - start_seconds) / 3600
+    if incremental:
+        # Processed while reading
+        value_column = MEDIAN
+    else:
+        if fuse:
+            df_combined = fuse_intensities(fuse_measurements(df, models=calibration))
+            combined_column = FUSED_OD
+        if chunked:
+            # Processed while reading
+            value_column = MEDIAN
+        elif calibration is not None:
+            df = calibrate_measurements(df, calibration)
+            value_column = CALIBRATED_OD
+            if df_combined is None:
+                df_combined = combine_intensities(df)
+                combined_column = CALIBRATED_OD
+        else:
+            df = process_measurements(df)
+            value_column = MEDIAN
+        last_hour = max(df[DATE])
+    if df_truth is not None:
+        print(last_hour)
+        print(max(df_truth[DATE]) - last_hour)
 
-    # Take no light measurement, expand so we can use it later
-    df['fully_dark'] = df.loc[(df[INTENSITY] == PWM_DUTY_CYCLES[0]), 'med']
-    df['fully_dark'] = df['fully_dark'].ffill()
+    if points is not None:
+        # Draw a bounded number of points, however long the run is
+        if not incremental:
+            pyramid.update(df.loc[df[INTENSITY].isin(pwm_duty_cycles[1:])], column=value_column)
+        level_hours, df_plot = pyramid.select(points=points)
+        plot_column = BIN_MEDIAN
+    else:
+        level_hours, df_plot, plot_column = RAW_LEVEL, df, value_column
 
-    for intensity_select in PWM_DUTY_CYCLES[1:]:
-        for ch in df[CHANNEL].unique():
-            # @ todo: find alternative - Remove low measurement of first [5, 10] h to get ~OD 0
-            #  - not great but current best fix?
+    with style_context(style) as style_preset:
+        fig, axes = plt.subplots(
+            len(channels), 1,
+            sharex='all',
+            sharey='all',
+            figsize=(10, 16 / 8 * len(channels)),
+            constrained_layout=True,
+        )
 
-            # Median filter:
-            median_window = 5
-            if df.loc[(df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch), 'med'].size > median_window:
-                df.loc[(df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch), 'med'] = median_filter(
-                    df.loc[(df[CHANNEL] == ch) & (df[INTENSITY] == intensity_select)]['med'],
-                    size=median_window,
-                    mode='nearest',
+        plot_series = {(ch, i): series for ch, i, series in iter_series(df_plot, intensities=pwm_duty_cycles[1:])}
+        for idx, (ch, ax) in enumerate(zip(channels, axes)):
+            for int_idx, intensity_select in enumerate(pwm_duty_cycles[1:]):
+                if (ch, intensity_select) not in plot_series:
+                    continue
+                series = plot_series[ch, intensity_select]
+                line, = ax.plot(
+                    series[DATE],
+                    series[plot_column],
+                    label=f"{intensity_select/MAX_U16:.2f}",
+                    zorder=1+int_idx,
                 )
-
-                # Savitzky-Golay filter to smoothe the thing
-                # df.loc[(df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch), 'med'] = savgol_filter(
-                #     df.loc[(df[CHANNEL] == ch) & (df[INTENSITY] == intensity_select)]['med'],
-                #     polyorder=3,
-                #     window_length=median_window,
-                #     mode='nearest',
-                # )
-            if any(df[DATE] > 10):
-                df.loc[(df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch),
-                'med'] = df.loc[(df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch),
-                'med'] + df.loc[(df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch) & (df[DATE] < 10) & (df[DATE] > 1),
-                'med'].quantile(.01) * -1
-
-
-    # Extrapolate from dark value, set to OD 2.5 - @todo: correct for low value subtraction
-    df['med'] = (df['med'] / df['fully_dark']) * 2.5
-
-    fig, axes = plt.subplots(
-        len(df[CHANNEL].unique()), 1,
-        sharex='all',
-        sharey='all',
-        figsize=(10, 16 / 8 * len(df[CHANNEL].unique())),
-        constrained_layout=True,
-    )
-
-    for idx, (ch, ax) in enumerate(zip(df[CHANNEL].unique(), axes)):
-        for int_idx, intensity_select in enumerate(PWM_DUTY_CYCLES[1:]):
-            ax.plot(
-                df.loc[(df[CHANNEL] == ch) & (df[INTENSITY] == intensity_select)][DATE],
-                df.loc[(df[CHANNEL] == ch) & (df[INTENSITY] == intensity_select)]['med'],
-                label=f"{intensity_select/MAX_U16:.2f}",
-                zorder=1+int_idx,
-            )
-        if df_truth is not None:
-            if ch in df_truth.columns:
-                # ax2 = ax.twinx()
+                if level_hours != RAW_LEVEL:
+                    ax.fill_between(
+                        series[DATE],
+                        series[BIN_MIN],
+                        series[BIN_MAX],
+                        color=line.get_color(),
+                        alpha=.2,
+                        linewidth=0,
+                        zorder=1+int_idx,
+                    )
+            if df_combined is not None:
                 ax.plot(
-                    df_truth[DATE],
-                    df_truth[ch],
-                    label="OD$_{600}$",
-                    c='black',
-                    marker='+',
-                    zorder=10+idx,
+                    df_combined.loc[df_combined[CHANNEL] == ch, DATE],
+                    df_combined.loc[df_combined[CHANNEL] == ch, combined_column],
+                    label="OD",
+                    c='grey',
+                    linewidth=2,
+                    zorder=len(pwm_duty_cycles)+1,
                 )
-                # ax2.set_yscale('log')
-                # ax2.set_ylim(yaxis_min, yaxis_max)
-                # ax2.set_zorder(0)
-        ax.set_ylim(yaxis_min, yaxis_max)
-        ax.set_yscale('log')
-        ax.grid(visible='both', which='both', zorder=0,)
-        if titles is not None:
-            ax.set_ylabel(f"{titles[idx]}")
-        else:
-            ax.set_ylabel(f"Ch {ch}")
-        ax.legend(
-            loc='upper left',
-            ncols=2 if len(PWM_DUTY_CYCLES) > 3 else 1,
-            # Transparency of the box
-            framealpha=.5,
-            # Length of the line in the legend
-            handlelength=1,
-            # title='Lamp Power',
-        )
+            if df_truth is not None:
+                if ch in df_truth.columns:
+                    # ax2 = ax.twinx()
+                    ax.plot(
+                        df_truth[DATE],
+                        df_truth[ch],
+                        label=OD_LABEL,
+                        c=style_preset[STYLE_LINE_COLOR] or 'black',
+                        marker='+',
+                        zorder=10+idx,
+                    )
+                    # ax2.set_yscale('log')
+                    # ax2.set_ylim(yaxis_min, yaxis_max)
+                    # ax2.set_zorder(0)
+            format_od_axis(ax, yaxis_min, yaxis_max, ylabel=f"{titles[idx]}" if titles is not None else f"Ch {ch}")
+            ax.legend(
+                loc='upper left',
+                ncols=2 if len(pwm_duty_cycles) > 3 else 1,
+                # Transparency of the box
+                framealpha=.5,
+                # Length of the line in the legend
+                handlelength=1,
+                # title='Lamp Power',
+            )
 
-    axes[-1].set_xlabel('Time (h)')
+        axes[-1].set_xlabel('Time (h)')
 
-    plt.suptitle(f"{datetime.now()} ({time_since_last_mod(csv_file_path) / 60:.2f} min)")
+        plt.suptitle(f"{datetime.now()} ({time_since_last_mod(csv_file_path) / 60:.2f} min)")
 
-    save_path = image_file_path if image_file_path is not None else os.path.join(
-        os.path.split(csv_file_path)[0], 'img.png'
-    )
-
-    plt.savefig(
-        save_path,
-        bbox_inches='tight',
-        dpi=300,
-    )
-    plt.close()
+        save_path = image_file_path if image_file_path is not None else os.path.join(
+            os.path.split(csv_file_path)[0], 'img.png'
+        )
+        save_figure(fig, save_path, style_preset)
 
 
 def time_since_last_mod(file):
     return time.time() - os.path.getmtime(file)
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Draw a figure of a result file and redraw it whenever rows are added")
     parser.add_argument(
         "--input", "-i",
-        help="input filename",
+        help="input filename, the measurement store with --run",
         required=True,
     )
     parser.add_argument(
@@ -239,40 +328,91 @@ if __name__ == '__main__':
         help='Names for the individual axes in the image - has to be as many as there are axes',
         default=None,
     )
+    parser.add_argument(
+        "--calibration", "-c",
+        help="file path for calibration models as written by Photometer.calibration, optional",
+        default=None,
+    )
+    parser.add_argument(
+        "--fuse", "-f",
+        action='store_true',
+        help="Add one OD trace per channel fused from all intensities",
+    )
+    parser.add_argument(
+        "--chunk_rows",
+        type=int,
+        help="Process the input this many rows at a time to bound memory, for very long runs; "
+             "not used with --calibration or --fuse",
+        default=None,
+    )
+    parser.add_argument(
+        "--run", "-r",
+        help="Draw this run of the measurement store given as input, see Photometer.store",
+        default=None,
+    )
+    parser.add_argument(
+        "--last_hours",
+        type=float,
+        help="Only draw this many hours before the last row of the run, with --run",
+        default=None,
+    )
+    parser.add_argument(
+        "--style",
+        choices=list(STYLES),
+        help=f"Style preset of the figure, defaults to {STYLE_SCREEN}",
+        default=STYLE_SCREEN,
+    )
+    parser.add_argument(
+        "--settle", "-s",
+        type=float,
+        help="Seconds without changes to the input file or run before the figure is redrawn, defaults to twice "
+             "the time between rows of a cycle with the profile in the file or run header",
+        default=None,
+    )
 
+    args = parser.parse_args(argv)
+    from Photometer.pyramid import SeriesPyramid
+    from Photometer.chunked import LiveProcessor
+    # Kept between redraws: only the rows appended to the file are read and processed,
+    # only bins with new rows are recomputed
+    series_pyramid = SeriesPyramid()
+    live = LiveProcessor(args.input) if args.run is None else None
 
-    args = parser.parse_args()
-
-    test = True
-    min_time_diff = 180
-    while True:
+    def draw() -> None:
+        print(f"Ding: {datetime.now()}")
         try:
-            print(f"Ding: {datetime.now()}")
             make_figure(
                 csv_file_path=args.input,
                 image_file_path=args.image_path,
                 titles=args.namelist,
                 df_truth=args.odreader,
+                calibration=args.calibration,
+                fuse=args.fuse,
+                pyramid=series_pyramid,
+                live=live,
+                chunk_rows=args.chunk_rows,
+                run=args.run,
+                last_hours=args.last_hours,
+                style=args.style,
             )
-            time_mod = time_since_last_mod(args.input)
-            if test:
-                print(time_mod)
-            if MEASUREMENT_FREQUENCY_SECONDS > time_mod > min_time_diff:
-                time.sleep(MEASUREMENT_FREQUENCY_SECONDS - time_mod)
-            time_mod = time_since_last_mod(args.input)
-            if test:
-                print(time_mod)
-            if time_mod > 3 * MEASUREMENT_FREQUENCY_SECONDS:
-                time.sleep(MEASUREMENT_FREQUENCY_SECONDS)
-            else:
-                time_check_error = MEASUREMENT_FREQUENCY_SECONDS
-                while time_mod < min_time_diff and time_check_error:
-                    time_mod = time_since_last_mod(args.input)
-                    if time_mod < (min_time_diff - 2) // 2:
-                        time.sleep((min_time_diff - 2) // 2)
-                    time_check_error -= 1
-                    time.sleep(1)
-            test = False
-        except KeyboardInterrupt:
-            print('Stopping')
-            break
\ No newline at end of file
+        except Exception:
+            # A half-written or odd cycle shouldn't end the watch, the next change redraws
+            print(f"{datetime.now()} Drawing failed, waiting for the next change:")
+            traceback.print_exc()
+
+    try:
+        draw()
+        # Redraw once per measurement cycle, as soon as its rows have been written or committed
+        if args.run is not None:
+            from Photometer.store import watch_store
+            changes = watch_store(args.input, args.run, settle_seconds=args.settle)
+        else:
+            changes = watch_file(args.input, settle_seconds=args.settle)
+        for _ in changes:
+            draw()
+    except KeyboardInterrupt:
+        print('Stopping')
+
+
+if __name__ == '__main__':
+    main()
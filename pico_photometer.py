@@ -14,6 +14,7 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
+import gc
 import time
 import sys
 from micropython import opt_level
@@ -29,9 +30,130 @@ from Photometer.constants import (
     MAX_U16,
     MEASUREMENT_LED_WARMUP_SECONDS,
     MEASUREMENT_FREQUENCY_SECONDS,
+    MEASUREMENT_OVERSAMPLE_WINDOW_SECONDS,
     RESISTOR_LED_GPIO_PAIRS,
     PWM_DUTY_CYCLES,
     NAMEDTUPLE_LED_RESISTOR_PAIR,
+    PROFILE_TIMING,
+    FIRMWARE_VERSION,
+    EPOCH_TIMESTAMPS,
+    EXCLUDE_FAILING_CHANNELS,
+    SELF_TEST_REQUIRED,
+    SCHEDULE_MEASUREMENTS,
+    CHANNEL_POSITIONS,
+    ADAPTIVE_SETTLE,
+    ADC_CAPTURE,
+    STREAM_RESULTS,
+    COMMAND_CHANNEL,
+)
+from Photometer.timing import (
+    CycleProfiler,
+    DummyCycleProfiler,
+    PHASE_WARMUP,
+    PHASE_ADC,
+    PHASE_REPEAT_SLEEP,
+    PHASE_FORMAT,
+    PHASE_PRINT,
+    PHASE_WRITE,
+    NO_CHANNEL,
+    ticks_us,
+    ticks_diff,
+)
+from Photometer.header import (
+    header_line,
+    header_lines,
+    HEADER_ALERT,
+    HEADER_SELF_TEST,
+    HEADER_SCHEDULE,
+    HEADER_COMMAND,
+    HEADER_PROFILE,
+    HEADER_BLANK,
+    BLANK_TIME,
+    BLANK_READINGS,
+)
+from Photometer.health import (
+    HealthMonitor,
+    ALERT_ACTIVE,
+    ALERT_KIND,
+    EXCLUDING_ALERTS,
+)
+from Photometer.self_test import (
+    evaluate_self_test,
+    load_baseline,
+    save_baseline,
+    SELF_TEST_READS,
+    SELF_TEST_SETTLE_SECONDS,
+    SELF_TEST_SELECT_SECONDS,
+    BASELINE_FILE_PATH,
+    REPORT_PASSED,
+    REPORT_CHANNELS,
+    DARK,
+    BRIGHT,
+    DARK_SPREAD,
+    BRIGHT_SPREAD,
+    CHECKS,
+)
+from Photometer.schedule import (
+    load_crosstalk,
+    save_crosstalk,
+    crosstalk_matrix,
+    crosstalk_noise,
+    interfering,
+    plan_schedule,
+    sequential_schedule,
+    predict_cycle_seconds,
+    CROSSTALK_FILE_PATH,
+    SELECT_SECONDS,
+    SCHEDULE_STEPS,
+    SCHEDULE_WARMUPS,
+    SCHEDULE_PREDICTED_SECONDS,
+    SCHEDULE_SEQUENTIAL_SECONDS,
+)
+from Photometer.settle import (
+    SettleDetector,
+    settle_tolerance,
+    update_noise,
+    SETTLE_SAMPLE_SECONDS,
+)
+from Photometer.oversample import (
+    integration_window_us,
+    flicker_residual,
+)
+from Photometer.capture import make_capture
+from Photometer.command import (
+    CommandReader,
+    COMMAND_FILE_PATH,
+    COMMAND_POLL_SECONDS,
+    COMMAND,
+    COMMAND_SECONDS,
+    COMMAND_VALUES,
+    COMMAND_TIME,
+    COMMAND_OK,
+    COMMAND_ERROR,
+    COMMAND_MEASURE,
+    COMMAND_INTERVAL,
+    COMMAND_DUTY_CYCLES,
+    COMMAND_BLANK,
+    COMMAND_STATS,
+)
+from Photometer.stream import (
+    StreamEncoder,
+    frame_line,
+    STREAM_SUFFIX,
+)
+from Photometer.profile import (
+    load_profile,
+    profile_settings,
+    PROFILE_NAME,
+    PROFILE_PWM_DUTY_CYCLES,
+    PROFILE_GPIO_PAIRS,
+    PROFILE_REPEATS,
+    PROFILE_REPEAT_INTERVAL,
+    PROFILE_FREQUENCY,
+    PROFILE_WARMUP,
+    PROFILE_OVERSAMPLE_WINDOW,
+    PROFILE_FILE_PATH,
+    DEFAULT_PROFILE_NAME,
 )
 
 # import errno
@@ -85,12 +207,26 @@ class Photometer:
             measurement_repeats: int = MEASUREMENT_REPEATS,
             measurement_repeat_interval_seconds: float = MEASUREMENT_REPEAT_INTERVAL_SECONDS,
             measurement_frequency_seconds: int = MEASUREMENT_FREQUENCY_SECONDS,
+            measurement_oversample_window_seconds: float = MEASUREMENT_OVERSAMPLE_WINDOW_SECONDS,
             pwm_duty_cycles: list[int] = None,
             resistor_led_gpio_pairs: list[(int, int)] | None = None,
             write_path_accessible_for_pi: str | None = None,
             working_led: Pin | None = None,
             pwm_frequency: int = PWM_FREQUENCY,
             adc_pin: int | None = None,
+            profile_timing: bool = False,
+            timing_file_path: str | None = None,
+            profile_name: str = DEFAULT_PROFILE_NAME,
+            epoch_timestamps: bool = EPOCH_TIMESTAMPS,
+            exclude_failing_channels: bool = EXCLUDE_FAILING_CHANNELS,
+            schedule_measurements: bool = SCHEDULE_MEASUREMENTS,
+            channel_positions: dict | None = CHANNEL_POSITIONS,
+            crosstalk_file_path: str | None = CROSSTALK_FILE_PATH,
+            adaptive_settle: bool = ADAPTIVE_SETTLE,
+            adc_capture: str = ADC_CAPTURE,
+            stream_results: bool = STREAM_RESULTS,
+            command_channel: bool = COMMAND_CHANNEL,
+            command_file_path: str = COMMAND_FILE_PATH,
     ):
         """ Initialize Photometer.
 
@@ -125,24 +261,60 @@ class Photometer:
         :param measurement_repeats: How many measurements to take
         :param measurement_repeat_interval_seconds: How long to wait in between measurements
         :param measurement_frequency_seconds: How long to wait between measurement cycles
+        :param measurement_oversample_window_seconds: Average back to back ADC reads over this window, rounded to
+            whole PWM periods, into each repeat; 0 for a single read per repeat (see Photometer.oversample)
         :param pwm_duty_cycles: List of lamp intensity values to test
         :param resistor_led_gpio_pairs: List of tuples indicating which GPIO pairs controls which LED/Photoresistor
         :param write_path_accessible_for_pi: Path for output .csv file
         :param working_led: Active measuring indicator LED, optional
         :param pwm_frequency: Frequency for PWM modulation, will be used to set LEDs to fully on
         :param adc_pin: GPIO number for analog-to-digital converter output, defaults to ADC0 / GPIO pin 26
+        :param profile_timing: Record how long each phase of a measurement cycle takes per channel,
+            written as one JSON line per cycle to timing_file_path
+        :param timing_file_path: Path for timing records, defaults to the output file path ending in _timing.jsonl
+        :param profile_name: Name of the run profile the settings came from, written to the output header
+        :param epoch_timestamps: Time stamp result rows with integer seconds since the epoch instead of
+            YYYYMMDD-HHMMSS strings, the column type is recorded in the output header
+        :param exclude_failing_channels: Leave channels that are stuck or lost their dark / bright contrast
+            out of future measurement cycles, alerts are written to the output file either way
+        :param schedule_measurements: Light channels that don't interfere together and measure all dark values at
+            once instead of going channel by channel (see Photometer.schedule)
+        :param channel_positions: Dictionary of LED anode GPIO to (x, y) position, tells interfering channels apart
+            if there is no crosstalk matrix
+        :param crosstalk_file_path: Path of the crosstalk matrix .json file written by measure_crosstalk,
+            None to go by channel_positions only
+        :param adaptive_settle: Start reading as soon as the photoresistor settled after an LED change,
+            measurement_led_warmup_seconds is the timeout (see Photometer.settle)
+        :param adc_capture: Backend capturing oversampled repeats, 'read', 'dma' or 'simulated' (see Photometer.capture)
+        :param stream_results: Write the output file as compact delta encoded stream instead of text rows,
+            the default output file path ends in .pms then (see Photometer.stream)
+        :param command_channel: Pick up commands appended to command_file_path while waiting between
+            measurement cycles (see Photometer.command)
+        :param command_file_path: Path of the command file
         """
 
         assert any([resistor_led_gpio_pairs, RESISTOR_LED_GPIO_PAIRS]), \
             "No GPIO pairs specified!"
         self.working_led = working_led if working_led else DummyWorkingLED()
         self.adc = ADC(Pin(adc_pin if adc_pin is not None else PIN_ADC0))
+        self.capture = make_capture(
+            adc_capture,
+            adc_pin=adc_pin if adc_pin is not None else PIN_ADC0,
+            read_u16=self.adc.read_u16,
+        )
         # Initialise time point
         self.utc_time_point_then = time.time()
+        self.start_time = get_time_string()
         # Write to the PC that's controlling the Pi or supplied path
-        self.file_path = f"/remote/{get_time_string()}_output.csv" if write_path_accessible_for_pi is None \
-            else write_path_accessible_for_pi
+        self.file_path = f"/remote/{self.start_time}_output{STREAM_SUFFIX if stream_results else '.csv'}" \
+            if write_path_accessible_for_pi is None else write_path_accessible_for_pi
+        self.encoder = StreamEncoder() if stream_results else None
         self.file_writable = True
+        self.profiler = CycleProfiler() if profile_timing else DummyCycleProfiler()
+        # MicroPython's str.endswith takes no tuple of endings
+        stem = self.file_path.rsplit('.', 1)[0] \
+            if self.file_path.endswith('.csv') or self.file_path.endswith(STREAM_SUFFIX) else self.file_path
+        self.timing_file_path = timing_file_path if timing_file_path is not None else f"{stem}_timing.jsonl"
         # self.dict_pins_led = {a: PWM(Pin(a), freq=PWM_FREQUENCY, duty_u16=0) for a in PINS_LED_ANODE}
         # self.dict_pins_resistors = {a: Pin(a, mode=Pin.OUT, value=0) for a in PINS_RESISTORS_ANODE}
         self.pwm_frequency = pwm_frequency
@@ -152,11 +324,10 @@ class Photometer:
         # Resistor anode pins are set to output pins and logical off
         # Named tuples are chosen as to have an easier time referencing values later
         self.dict_pin_pairs = {}
+        # Go with RESISTOR_LED_GPIO_PAIRS unless resistor_led_gpio_pairs has been specified
+        self.resistor_led_gpio_pairs = resistor_led_gpio_pairs if resistor_led_gpio_pairs else RESISTOR_LED_GPIO_PAIRS
 
-        for number, (pin_led, pin_resistor) in enumerate(
-                # Go with RESISTOR_LED_GPIO_PAIRS unless resistor_led_gpio_pairs has been specified
-                resistor_led_gpio_pairs if resistor_led_gpio_pairs else RESISTOR_LED_GPIO_PAIRS
-        ):
+        for number, (pin_led, pin_resistor) in enumerate(self.resistor_led_gpio_pairs):
             try:
                 # This used to work but there appears to be a bug with PWM initialisation
                 _pwm = PWM(Pin(pin_led, Pin.OUT, value=0), freq=self.pwm_frequency, duty_u16=0)
@@ -174,18 +345,62 @@ class Photometer:
 
         # Convenience conversion so we can iterate over the keys
         self.keys_pin_pairs = list(self.dict_pin_pairs.keys())
+        # Schedules refer to channels by LED anode GPIO
+        self.keys_by_channel = {pair.NR_LED_ANODE: key for key, pair in self.dict_pin_pairs.items()}
 
         self.measurement_led_warmup_seconds = measurement_led_warmup_seconds
         self.measurement_repeat_interval_seconds = measurement_repeat_interval_seconds
         self.measurement_repeats = measurement_repeats
         self.measurement_frequency_seconds = measurement_frequency_seconds
+        self.measurement_oversample_window_seconds = measurement_oversample_window_seconds
+        self.oversample_window_us = integration_window_us(
+            measurement_oversample_window_seconds, pwm_frequency,
+        ) if measurement_oversample_window_seconds else 0
+        if self.oversample_window_us and flicker_residual(self.oversample_window_us / 1000000) > .1:
+            print(f"Oversample window of {self.oversample_window_us} us doesn't span whole periods of mains flicker")
+        self.capture_samples = 0
+        if self.capture is not None and self.oversample_window_us:
+            self.capture_samples = self.capture.fit_window(self.oversample_window_us)
+            if self.capture.rate < self.capture.max_rate:
+                print(f"Oversample window sampled at {self.capture.rate} per second to fit the capture buffer")
+        # Bookkeeping of the last row, done while the first capture of the next row runs
+        self.deferred_row = None
         self.pwm_duty_cycles = pwm_duty_cycles if pwm_duty_cycles else PWM_DUTY_CYCLES
+        self.profile_name = profile_name
+        self.epoch_timestamps = epoch_timestamps
+        self.exclude_failing_channels = exclude_failing_channels
+        self.schedule_measurements = schedule_measurements
+        self.channel_positions = channel_positions
+        self.crosstalk_file_path = crosstalk_file_path
+        self.schedule = []
+        self.predicted_cycle_seconds = 0
+        self.adaptive_settle = adaptive_settle
+        # Milliseconds every measurement of the current cycle took to settle, and how many timed out
+        self.settle_ms = []
+        self.settle_timeouts = 0
+        # Read noise of every (channel, LED duty power) seen while settling, sets the settle tolerance
+        self.settle_noise = {}
+        self.health = HealthMonitor(
+            dark_intensity=self.pwm_duty_cycles[0],
+            bright_intensity=max(self.pwm_duty_cycles),
+        )
         # First round: perform measurement directly, don't wait for self.measurement_repeat_interval_seconds
         self.first_call = True
+        self.commands = CommandReader(command_file_path) if command_channel else None
+        # Extra cycle requested by command, the regular cycle times stay the same
+        self.measure_now = False
+        # Extra cycle requested by command that is measured as blank, see perform_blank
+        self.blank_now = False
+        # [LED anode, LED duty power, repeat median] of the rows of a blank cycle while one is measured
+        self.blank_readings = None
+        self.cycles = 0
+        self.last_cycle_seconds = 0
 
         self.reset_pins()
 
         print(self.file_path)
+        self.save_header()
+        self.plan_cycle()
 
     @staticmethod
     def change_pair_settings(
@@ -229,6 +444,7 @@ class Photometer:
             namedtuple_led_resistor_pair: namedtuple,
             led_duty_power: int,
             result_list: list[str | int],
+            time_stamp: str | int | None = None,
     ) -> str:
         """ Format results, spaced by tabs.
 
@@ -238,18 +454,30 @@ class Photometer:
         :param namedtuple_led_resistor_pair: used NAMEDTUPLE_LED_RESISTOR_PAIR instance
         :param led_duty_power: used LED duty power setting
         :param result_list: list of results
+        :param time_stamp: Time stamp of the row, defaults to the current time string
         :return: Formatted result string for .csv
         """
 
         return SEPERATOR.join(
             str(i) for i in [
-                get_time_string(),
+                get_time_string() if time_stamp is None else time_stamp,
                 namedtuple_led_resistor_pair.NR_LED_ANODE,
                 namedtuple_led_resistor_pair.NR_RESISTOR_ANODE,
                 led_duty_power,
             ] + result_list
         )
 
+    def get_time_stamp(self) -> str | int:
+        """ Time stamp for a result row
+
+        :return: Seconds since the epoch if epoch_timestamps is set, time string otherwise
+        """
+
+        if self.epoch_timestamps:
+            # Pico clock is set to local time by mpremote setrtc, as are the time strings
+            return int(time.time())
+        return get_time_string()
+
     def reset_pins(self) -> None:
         """ Reset used GPIO pins to no output / off state
 
@@ -278,6 +506,28 @@ class Photometer:
             return ADC(Pin(adc_pin)).read_u16()
         return self.adc.read_u16()
 
+    def read_integrated(self) -> int:
+        """ Mean of back to back ADC reads over the oversample window, see Photometer.oversample
+
+        With a capture backend the samples are taken at its fixed rate while the interpreter waits idle.
+
+        :return: 16 bit mean reading
+        """
+
+        if self.capture is not None:
+            self.capture.start(self.capture_samples)
+            return self.capture.mean_u16()
+        # Bound once, keeps the loop tight on the Pico
+        read_u16 = self.adc.read_u16
+        window_us = self.oversample_window_us
+        total = 0
+        reads = 0
+        start = ticks_us()
+        while ticks_diff(ticks_us(), start) < window_us:
+            total += read_u16()
+            reads += 1
+        return total // reads if reads else read_u16()
+
     def perform_measurement(
             self,
             namedtuple_led_resistor_pair: namedtuple,
@@ -315,12 +565,32 @@ class Photometer:
 
         if measurement_led_warmup_seconds:
             # Wait so photoresistor has time to acclimate
-            time.sleep(measurement_led_warmup_seconds)
+            span_start = self.profiler.start()
+            if self.adaptive_settle:
+                self.wait_for_settle(
+                    namedtuple_led_resistor_pair.NR_LED_ANODE,
+                    led_duty_power,
+                    measurement_led_warmup_seconds,
+                )
+            else:
+                time.sleep(measurement_led_warmup_seconds)
+            self.profiler.stop(PHASE_WARMUP, span_start)
 
         # Measure n times, wait between measurements
         for i in range(0, measurement_repeats):
-            result.append(self.read_light())
+            if self.capture_samples:
+                self.capture.start(self.capture_samples)
+                # The previous row is formatted, written and checked while the samples come in
+                self.save_deferred_row()
+                span_start = self.profiler.start()
+                result.append(self.capture.mean_u16())
+            else:
+                span_start = self.profiler.start()
+                result.append(self.read_integrated() if self.oversample_window_us else self.read_light())
+            self.profiler.stop(PHASE_ADC, span_start)
+            span_start = self.profiler.start()
             time.sleep(measurement_repeat_interval_seconds)
+            self.profiler.stop(PHASE_REPEAT_SLEEP, span_start)
 
         if cleanup_after:
             # Switch LED off, deselect photoresistor
@@ -331,28 +601,85 @@ class Photometer:
             )
         return result
 
-    def perform_self_test(self) -> None:
+    def wait_for_settle(
+            self,
+            channel: int,
+            led_duty_power: int,
+            timeout_seconds: float,
+    ) -> bool:
+        """ Sample the selected photoresistor until its readings settle (see Photometer.settle) or time runs out
+
+        The tolerance follows the read noise of the channel at this duty power, estimated from its last settles.
+
+        :param channel: GPIO number of the LED anode of the selected pair
+        :param led_duty_power: used LED duty power setting, recorded with the settle time
+        :param timeout_seconds: longest wait, the fixed warmup
+        :return: True if the readings settled before the timeout
+        """
+
+        start = ticks_us()
+        key = (channel, led_duty_power)
+        detector = SettleDetector(tolerance=settle_tolerance(self.settle_noise.get(key)))
+        converged = False
+        while ticks_diff(ticks_us(), start) < timeout_seconds * 1000000:
+            if detector.add(self.read_light()):
+                converged = True
+                break
+            time.sleep(SETTLE_SAMPLE_SECONDS)
+        self.settle_noise[key] = update_noise(self.settle_noise.get(key), detector.noise())
+        self.profiler.settled(led_duty_power, start, converged)
+        self.settle_ms.append(ticks_diff(ticks_us(), start) // 1000)
+        self.settle_timeouts += not converged
+        return converged
+
+    def read_burst(
+            self,
+            namedtuple_led_resistor_pair: namedtuple,
+            reads: int = SELF_TEST_READS,
+    ) -> list[int]:
+        """ Select a photoresistor and read it back to back without waiting in between
+
+        LED settings are left as they are.
+
+        :param namedtuple_led_resistor_pair: used NAMEDTUPLE_LED_RESISTOR_PAIR instance
+        :param reads: number of ADC reads
+        :return: list of measured results
+        """
+
+        namedtuple_led_resistor_pair.PIN_RESISTOR_ANODE.on()
+        time.sleep(SELF_TEST_SELECT_SECONDS)
+        result = [self.read_light() for _ in range(reads)]
+        namedtuple_led_resistor_pair.PIN_RESISTOR_ANODE.off()
+        return result
+
+    def perform_self_test(
+            self,
+            baseline_file_path: str | None = BASELINE_FILE_PATH,
+            reads: int = SELF_TEST_READS,
+    ) -> dict:
         """Perform check of all Photoresistors without and with light.
 
-        To speed up the process, bring all to correct state, then do an abbreviated reading.
-        End results are currently printed to screen for manual inspection, but could be automatically used.
+        To speed up the process, bring all to correct state and wait once, then burst read every photoresistor.
+        Results are checked against thresholds and the per channel baseline (see Photometer.self_test),
+        the report is printed and written to the output file.
+        If there is no baseline yet, the readings of a passing self-test are stored as baseline.
 
-        :return: None
+        :param baseline_file_path: Path of the baseline .json file, None to skip baseline checks
+        :param reads: Number of back to back ADC reads per channel and light state
+        :return: report dictionary, see Photometer.self_test.evaluate_self_test
         """
 
+        start = ticks_us()
         dark_values = {}
         bright_values = {}
 
         # Switch off light, wait for acclimatisation
         self.reset_pins()
-        time.sleep(2)
+        time.sleep(SELF_TEST_SETTLE_SECONDS)
         # Get dark values
         for key in self.keys_pin_pairs:
-            dark_values[key] = self.perform_measurement(
-                namedtuple_led_resistor_pair=self.dict_pin_pairs[key],
-                led_duty_power=0,
-                measurement_led_warmup_seconds=0,
-            )
+            pin_pair = self.dict_pin_pairs[key]
+            dark_values[pin_pair.NR_LED_ANODE] = self.read_burst(pin_pair, reads=reads)
 
         # Switch everything to maximum, which should be self.pwm_frequency, wait again for acclimatisation
         for key in self.keys_pin_pairs:
@@ -361,83 +688,472 @@ class Photometer:
                 value=self.pwm_frequency,
                 photoresistor_gpio_on=False,
             )
-        time.sleep(2)
+        time.sleep(SELF_TEST_SETTLE_SECONDS)
         # Get bright values
         for key in self.keys_pin_pairs:
-            bright_values[key] = self.perform_measurement(
-                namedtuple_led_resistor_pair=self.dict_pin_pairs[key],
-                led_duty_power=self.pwm_frequency,
-                measurement_led_warmup_seconds=0,
-            )
-        print('Average dark values:')
-        for k, v in dark_values.items():
-            print(f"GPIO LED {self.dict_pin_pairs[k].NR_LED_ANODE}: {sum(v) / len(v)} (min: {min(v)}, max: {max(v)})")
-        print('Average bright values:')
-        for k, v in bright_values.items():
-            print(f"GPIO LED {self.dict_pin_pairs[k].NR_LED_ANODE}: {sum(v) / len(v)} (min: {min(v)}, max: {max(v)})")
+            pin_pair = self.dict_pin_pairs[key]
+            bright_values[pin_pair.NR_LED_ANODE] = self.read_burst(pin_pair, reads=reads)
         self.reset_pins()
 
-    def perform_blank(self):
-        # @todo: create self correcting blank function to set PWM_CORRECTIVE_RATIO
-        pass
+        baseline = load_baseline(baseline_file_path) if baseline_file_path is not None else None
+        report = evaluate_self_test(
+            dark_readings=dark_values,
+            bright_readings=bright_values,
+            baseline=baseline,
+            time_stamp=self.get_time_stamp(),
+            duration_ms=ticks_diff(ticks_us(), start) // 1000,
+        )
+        # Only a healthy device makes a useful reference
+        if baseline is None and baseline_file_path is not None and report[REPORT_PASSED]:
+            try:
+                save_baseline(report, baseline_file_path)
+                print(f"Self-test baseline saved to {baseline_file_path}")
+            except OSError as er:
+                print(f"Self-test baseline could not be saved: {er}")
+
+        for channel, values in report[REPORT_CHANNELS].items():
+            failed = [check for check, passed in values[CHECKS].items() if not passed]
+            # Built outside the f-string, MicroPython doesn't allow its quotes within one
+            suffix = ', failed: ' + ', '.join(failed) if failed else ''
+            print(f"GPIO LED {channel}: dark {values[DARK]} (spread {values[DARK_SPREAD]}), "
+                  f"bright {values[BRIGHT]} (spread {values[BRIGHT_SPREAD]}){suffix}")
+        print(f"Self-test {'passed' if report[REPORT_PASSED] else 'FAILED'}")
+        self.save_result(header_line(HEADER_SELF_TEST, report))
+        return report
+
+    def measure_crosstalk(
+            self,
+            crosstalk_file_path: str | None = None,
+            reads: int = SELF_TEST_READS,
+    ) -> dict:
+        """ Measure how much of every LED each photoresistor sees, once at calibration
+
+        All photoresistors are read with every LED off, then with one LED at a time fully on.
+        Crosstalk within the noise of the reads is stored as 0 (see Photometer.schedule.crosstalk_matrix).
+        The matrix is stored for later runs and the measurement cycle is planned anew (see Photometer.schedule).
+
+        :param crosstalk_file_path: Path of the crosstalk .json file, defaults to crosstalk_file_path of the class
+        :param reads: Number of back to back ADC reads per channel and light state
+        :return: dictionary of LED channel to {photoresistor channel: fraction of the photoresistor's own signal}
+        """
+
+        crosstalk_file_path = self.crosstalk_file_path if crosstalk_file_path is None else crosstalk_file_path
+        pairs = [self.dict_pin_pairs[key] for key in self.keys_pin_pairs]
+        self.reset_pins()
+        time.sleep(SELF_TEST_SETTLE_SECONDS)
+        dark_values = {pair.NR_LED_ANODE: self.read_burst(pair, reads=reads) for pair in pairs}
+        lit_values = {}
+        for led_pair in pairs:
+            self.change_pair_settings(
+                namedtuple_led_resistor_pair=led_pair,
+                value=self.pwm_frequency,
+                photoresistor_gpio_on=False,
+            )
+            time.sleep(SELF_TEST_SETTLE_SECONDS)
+            lit_values[led_pair.NR_LED_ANODE] = {
+                pair.NR_LED_ANODE: self.read_burst(pair, reads=reads) for pair in pairs
+            }
+            self.reset_pins()
+
+        matrix = crosstalk_matrix(dark_readings=dark_values, lit_readings=lit_values)
+        noise = crosstalk_noise(dark_readings=dark_values, lit_readings=lit_values)
+        for led, seen in matrix.items():
+            # MicroPython doesn't nest f-strings
+            seen_by = ', '.join('%s: %s' % (ch, value) for ch, value in seen.items() if ch != led)
+            print(f"GPIO LED {led} seen by: {seen_by}")
+        noise_floor = ', '.join('%s: %s' % (ch, value) for ch, value in noise.items())
+        print(f"Noise floor: {noise_floor}")
+        if crosstalk_file_path is not None:
+            try:
+                save_crosstalk(matrix, crosstalk_file_path, noise=noise)
+                print(f"Crosstalk matrix saved to {crosstalk_file_path}")
+            except OSError as er:
+                print(f"Crosstalk matrix could not be saved: {er}")
+        self.plan_cycle(crosstalk=matrix)
+        return matrix
+
+    def plan_cycle(
+            self,
+            crosstalk: dict | None = None,
+    ) -> None:
+        """ Plan the order of the measurement cycle and predict its duration
+
+        Sequential cycles go channel by channel; scheduled cycles light non-interfering channels together,
+        the schedule is written to the output file.
+
+        :param crosstalk: Crosstalk matrix as returned by measure_crosstalk, loaded from crosstalk_file_path if None
+        :return: None
+        """
+
+        channels = [self.dict_pin_pairs[key].NR_LED_ANODE for key in self.keys_pin_pairs]
+        sequential = sequential_schedule(channels, self.pwm_duty_cycles)
+        sequential_seconds = self.predict_cycle_seconds(sequential)
+        if not self.schedule_measurements:
+            self.schedule = sequential
+            self.predicted_cycle_seconds = sequential_seconds
+            print(f"Measurement cycle: {len(self.schedule)} warmups, predicted {self.predicted_cycle_seconds:.1f} s")
+            return
+
+        if crosstalk is None and self.crosstalk_file_path is not None:
+            crosstalk = load_crosstalk(self.crosstalk_file_path)
+        conflicts = interfering(channels, crosstalk=crosstalk, positions=self.channel_positions)
+        self.schedule = plan_schedule(channels, self.pwm_duty_cycles, conflicts=conflicts)
+        self.predicted_cycle_seconds = self.predict_cycle_seconds(self.schedule)
+        print(f"Measurement cycle: {len(self.schedule)} warmups instead of {len(sequential)}, "
+              f"predicted {self.predicted_cycle_seconds:.1f} s instead of {sequential_seconds:.1f} s")
+        self.save_result(header_line(HEADER_SCHEDULE, {
+            SCHEDULE_STEPS: [[duty, step_channels] for duty, step_channels in self.schedule],
+            SCHEDULE_WARMUPS: len(self.schedule),
+            SCHEDULE_PREDICTED_SECONDS: round(self.predicted_cycle_seconds, 2),
+            SCHEDULE_SEQUENTIAL_SECONDS: round(sequential_seconds, 2),
+        }))
+
+    def predict_cycle_seconds(
+            self,
+            steps: list[(int, list[int])],
+    ) -> float:
+        """ Predicted duration of a measurement cycle with the settings of the class
+
+        :param steps: list of steps (duty power, channels), see Photometer.schedule
+        :return: seconds
+        """
+
+        return predict_cycle_seconds(
+            steps,
+            measurement_led_warmup_seconds=self.measurement_led_warmup_seconds,
+            measurement_repeats=self.measurement_repeats,
+            # Oversampled repeats read for the whole window
+            measurement_repeat_interval_seconds=self.measurement_repeat_interval_seconds +
+            self.oversample_window_us / 1000000,
+        )
+
+    def perform_blank(self) -> None:
+        """ Measure an extra cycle as blank, e.g. of vessels holding sterile medium before inoculation
+
+        Rows are saved as usual. The repeat median of every row is also written as HEADER_BLANK line after the
+        cycle, processing takes them as baseline instead of the early low values
+        (see Photometer.processing.blank_values).
+
+        :return: None
+        """
+
+        # @todo: also set PWM_CORRECTIVE_RATIO from the blank
+        self.blank_readings = []
+        try:
+            self.measure_pwm_duty_cycles()
+            self.save_result(header_line(HEADER_BLANK, {
+                BLANK_TIME: self.get_time_stamp(),
+                BLANK_READINGS: self.blank_readings,
+            }))
+        finally:
+            self.blank_readings = None
 
     def save_result(
             self,
             result: str,
+            row: tuple | None = None,
     ) -> None:
         """ Print result, write result to file if possible.
 
+        Streamed output files get a frame per line, rows with epoch time stamps as key or delta frames;
+        those rows are printed as compact frame lines as well (see Photometer.stream.frame_line).
+
         :param result: Result string
+        :param row: (time stamp, LED anode, resistor anode, LED power, results) of a result row, for streaming
         :return: None
         """
 
-        print(result)
-        result += "\n"
+        printed = result
+        if self.encoder is None:
+            data, mode = result + "\n", 'a+'
+        elif row is not None and isinstance(row[0], int):
+            data, mode = self.encoder.row(*row), 'ab'
+            printed = frame_line(data)
+        else:
+            data, mode = self.encoder.text(result), 'ab'
+        span_start = self.profiler.start()
+        print(printed)
+        self.profiler.stop(PHASE_PRINT, span_start)
+        span_start = self.profiler.start()
         try:
-            with open(self.file_path, 'a+') as f:
-                f.write(result)
+            with open(self.file_path, mode) as f:
+                f.write(data)
+            self.profiler.stop(PHASE_WRITE, span_start)
         except OSError as er:
+            if self.encoder is not None:
+                # Deltas following a lost frame could not be decoded
+                self.encoder.reset()
             if self.file_writable:
                 print(er)
                 print(f"File could be written to. This warning will now be suppressed. \nFile: {self.file_path}")
                 self.file_writable = False
             pass
 
+    def profile(self) -> dict:
+        """ Settings of this run in the form of a run profile (see Photometer.profile)
+
+        :return: profile dictionary
+        """
+
+        return {
+            PROFILE_NAME: self.profile_name,
+            PROFILE_PWM_DUTY_CYCLES: list(self.pwm_duty_cycles),
+            PROFILE_GPIO_PAIRS: [list(pair) for pair in self.resistor_led_gpio_pairs],
+            PROFILE_REPEATS: self.measurement_repeats,
+            PROFILE_REPEAT_INTERVAL: self.measurement_repeat_interval_seconds,
+            PROFILE_FREQUENCY: self.measurement_frequency_seconds,
+            PROFILE_WARMUP: self.measurement_led_warmup_seconds,
+            PROFILE_OVERSAMPLE_WINDOW: self.measurement_oversample_window_seconds,
+        }
+
+    def save_header(self) -> None:
+        """ Write the header to a new output file (see Photometer.header)
+
+        Column schema, firmware version, start time and run profile (GPIO pairs, duty powers, repeats),
+        so the host parses the rows with fixed types and the layout they were recorded with.
+
+        :return: None
+        """
+
+        try:
+            os.stat(self.file_path)
+            # Existing file, appending to it: header has been written already or the file predates headers
+            return
+        except OSError:
+            pass
+        for line in header_lines(
+                profile=self.profile(),
+                firmware_version=FIRMWARE_VERSION,
+                start_time=self.start_time,
+                measurement_repeats=self.measurement_repeats,
+                epoch_timestamps=self.epoch_timestamps,
+        ):
+            self.save_result(line)
+
+    def save_timing(self) -> None:
+        """ Finish the timing record of the current cycle and append it to the timing file, if profiling
+
+        :return: None
+        """
+
+        record = self.profiler.record(
+            get_time_string(),
+            predicted_us=int(self.predicted_cycle_seconds * 1000000),
+        )
+        if record is None:
+            return
+        try:
+            with open(self.timing_file_path, 'a+') as f:
+                f.write(record + "\n")
+        except OSError as er:
+            print(f"Timing record could not be written: {er}")
+
     def measurement_cycle_save(
             self,
             namedtuple_led_resistor_pair: namedtuple,
             led_duty_power: int,
+            measurement_led_warmup_seconds: float | None = None,
     ) -> None:
         """ Perform measurement, format results, then save result to file
 
         :param namedtuple_led_resistor_pair: used NAMEDTUPLE_LED_RESISTOR_PAIR instance
         :param led_duty_power: used LED duty power setting
+        :param measurement_led_warmup_seconds: Specify to overwrite class measurement_led_warmup_seconds definition
         :return: None
         """
 
-        result = self.perform_measurement(
+        self.profiler.channel = namedtuple_led_resistor_pair.NR_LED_ANODE
+        readings = self.perform_measurement(
             led_duty_power=led_duty_power,
             namedtuple_led_resistor_pair=namedtuple_led_resistor_pair,
+            measurement_led_warmup_seconds=measurement_led_warmup_seconds,
         )
+        row = (namedtuple_led_resistor_pair, led_duty_power, readings, self.get_time_stamp())
+        # Any row not saved yet goes first, rows stay in order
+        self.save_deferred_row()
+        if self.capture_samples:
+            self.deferred_row = row
+        else:
+            self.save_row(*row)
+
+    def save_deferred_row(self) -> None:
+        """ Save the row whose bookkeeping was deferred to the next capture, if any
+
+        :return: None
+        """
+
+        if self.deferred_row is None:
+            return
+        row = self.deferred_row
+        self.deferred_row = None
+        # Attributed to the channel of the row, not to the one being captured
+        channel = self.profiler.channel
+        self.save_row(*row)
+        self.profiler.channel = channel
+
+    def save_row(
+            self,
+            namedtuple_led_resistor_pair: namedtuple,
+            led_duty_power: int,
+            readings: list[int],
+            time_stamp: str | int,
+    ) -> None:
+        """ Format and save a result row, then run the health checks on it
+
+        :param namedtuple_led_resistor_pair: used NAMEDTUPLE_LED_RESISTOR_PAIR instance
+        :param led_duty_power: used LED duty power setting
+        :param readings: list of measured results
+        :param time_stamp: time stamp of the row
+        :return: None
+        """
+
+        self.profiler.channel = namedtuple_led_resistor_pair.NR_LED_ANODE
+        span_start = self.profiler.start()
         result = self.format_result(
             namedtuple_led_resistor_pair=namedtuple_led_resistor_pair,
             led_duty_power=led_duty_power,
-            result_list=result,
+            result_list=readings,
+            time_stamp=time_stamp,
         )
-        self.save_result(result)
+        self.profiler.stop(PHASE_FORMAT, span_start)
+        self.save_result(result, row=(
+            time_stamp,
+            namedtuple_led_resistor_pair.NR_LED_ANODE,
+            namedtuple_led_resistor_pair.NR_RESISTOR_ANODE,
+            led_duty_power,
+            readings,
+        ))
+        self.check_health(
+            namedtuple_led_resistor_pair=namedtuple_led_resistor_pair,
+            led_duty_power=led_duty_power,
+            readings=readings,
+            time_stamp=time_stamp,
+        )
+        if self.blank_readings is not None:
+            # Median as pandas takes it, the mean of the middle two of an even number of readings
+            ordered = sorted(readings)
+            middle = len(ordered) // 2
+            self.blank_readings.append([
+                namedtuple_led_resistor_pair.NR_LED_ANODE,
+                led_duty_power,
+                (ordered[middle] + ordered[-middle - 1]) / 2,
+            ])
 
-    def measure_pwm_duty_cycles(self) -> None:
-        """ Perform the whole measurement cycle with all LED/photoresistor pairs at every LED power setting
+    def check_health(
+            self,
+            namedtuple_led_resistor_pair: namedtuple,
+            led_duty_power: int,
+            readings: list[int],
+            time_stamp: str | int,
+    ) -> None:
+        """ Run the health checks on a measurement, write raised or cleared alerts to the output file
 
+        :param namedtuple_led_resistor_pair: used NAMEDTUPLE_LED_RESISTOR_PAIR instance
+        :param led_duty_power: used LED duty power setting
+        :param readings: list of measured results
+        :param time_stamp: time stamp of the result row
         :return: None
         """
 
-        for key in self.keys_pin_pairs:
-            for led_duty_power in self.pwm_duty_cycles:
+        channel = namedtuple_led_resistor_pair.NR_LED_ANODE
+        for alert in self.health.update(time_stamp, channel, led_duty_power, readings):
+            self.save_result(header_line(HEADER_ALERT, alert))
+            if not self.exclude_failing_channels or alert[ALERT_KIND] not in EXCLUDING_ALERTS:
+                continue
+            if alert[ALERT_ACTIVE] and self.health.is_failing(channel):
+                print(f"GPIO LED {channel} excluded from further measurement cycles, probed every few cycles")
+            elif not alert[ALERT_ACTIVE] and not self.health.is_failing(channel):
+                print(f"GPIO LED {channel} passed its checks again, back in the measurement cycles")
+
+    def measure_step(
+            self,
+            namedtuple_led_resistor_pairs: list[namedtuple],
+            led_duty_power: int,
+    ) -> None:
+        """ Light several non-interfering pairs at once, wait for the warmup once, then measure them one by one
+
+        :param namedtuple_led_resistor_pairs: used NAMEDTUPLE_LED_RESISTOR_PAIR instances
+        :param led_duty_power: used LED duty power setting
+        :return: None
+        """
+
+        for pair in namedtuple_led_resistor_pairs:
+            self.change_pair_settings(
+                namedtuple_led_resistor_pair=pair,
+                value=led_duty_power,
+                photoresistor_gpio_on=False,
+            )
+        if self.measurement_led_warmup_seconds and not self.adaptive_settle:
+            # Shared by all pairs of the step
+            self.profiler.channel = NO_CHANNEL
+            span_start = self.profiler.start()
+            time.sleep(self.measurement_led_warmup_seconds)
+            self.profiler.stop(PHASE_WARMUP, span_start)
+        for pair in namedtuple_led_resistor_pairs:
+            # Each LED is switched off after its pair is measured, the others don't see it
+            if self.adaptive_settle:
+                # Lit since the start of the step, settles as soon as selected
                 self.measurement_cycle_save(
-                    namedtuple_led_resistor_pair=self.dict_pin_pairs[key],
+                    namedtuple_led_resistor_pair=pair,
                     led_duty_power=led_duty_power,
                 )
+                continue
+            pair.PIN_RESISTOR_ANODE.on()
+            time.sleep(SELECT_SECONDS)
+            self.measurement_cycle_save(
+                namedtuple_led_resistor_pair=pair,
+                led_duty_power=led_duty_power,
+                measurement_led_warmup_seconds=0,
+            )
+
+    def measure_pwm_duty_cycles(self) -> None:
+        """ Perform the whole measurement cycle with all LED/photoresistor pairs at every LED power setting
+
+        Follows the steps planned by plan_cycle, pairs failing the health checks are skipped if
+        exclude_failing_channels is set, apart from probe cycles that check whether they recovered
+        (see HealthMonitor.skip_cycle). Actual and predicted duration of the cycle are printed.
+
+        :return: None
+        """
+
+        start = ticks_us()
+        self.settle_ms = []
+        self.settle_timeouts = 0
+        # Decided once per cycle, channels are not dropped halfway through their duty powers
+        excluded = [
+            channel for channel in self.keys_by_channel
+            if self.exclude_failing_channels and self.health.skip_cycle(channel)
+        ]
+        steps = []
+        for led_duty_power, channels in self.schedule:
+            channels = [channel for channel in channels if channel not in excluded]
+            if channels:
+                steps.append((led_duty_power, channels))
+        self.predicted_cycle_seconds = self.predict_cycle_seconds(steps)
+
+        try:
+            for led_duty_power, channels in steps:
+                pairs = [self.dict_pin_pairs[self.keys_by_channel[channel]] for channel in channels]
+                if len(pairs) == 1:
+                    self.measurement_cycle_save(
+                        namedtuple_led_resistor_pair=pairs[0],
+                        led_duty_power=led_duty_power,
+                    )
+                else:
+                    self.measure_step(
+                        namedtuple_led_resistor_pairs=pairs,
+                        led_duty_power=led_duty_power,
+                    )
+        finally:
+            # The last row has no next capture to overlap with
+            self.save_deferred_row()
+        self.cycles += 1
+        self.last_cycle_seconds = ticks_diff(ticks_us(), start) / 1000000
+        print(f"Measurement cycle took {self.last_cycle_seconds:.1f} s, "
+              f"predicted {self.predicted_cycle_seconds:.1f} s")
+        if self.settle_ms:
+            print(f"Settled after {sorted(self.settle_ms)[len(self.settle_ms) // 2]} ms (median), "
+                  f"{max(self.settle_ms)} ms (max), {self.settle_timeouts} timeouts")
 
     def has_time_passed(
             self,
@@ -451,12 +1167,100 @@ class Photometer:
         delta = now - self.utc_time_point_then
         print(f"Time: {get_time_string()} ({now}) Last measurement: {self.utc_time_point_then} Delta: {delta} s")
         print(f"Next measurement in: {self.measurement_frequency_seconds - delta} s")
+        if self.measure_now:
+            self.measure_now = False
+            return True, self.measurement_frequency_seconds - delta
         if self.first_call or delta >= self.measurement_frequency_seconds:
             self.first_call = False
             self.utc_time_point_then = now
             return True, self.measurement_frequency_seconds - delta
         return False, self.measurement_frequency_seconds - delta
 
+    def wait_for_commands(
+            self,
+            seconds: float,
+    ) -> None:
+        """ Sleep, handling commands every COMMAND_POLL_SECONDS if the command channel is on
+
+        Returns early after a command that changes when the next cycle is due.
+
+        :param seconds: how long to wait at most
+        :return: None
+        """
+
+        if self.commands is None:
+            time.sleep(seconds)
+            return
+        deadline = time.time() + seconds
+        while True:
+            for command, error in self.commands.poll():
+                if self.handle_command(command, error):
+                    return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, COMMAND_POLL_SECONDS))
+
+    def handle_command(
+            self,
+            command: dict,
+            error: str | None = None,
+    ) -> bool:
+        """ Execute a command and write its record to the output file (see Photometer.command)
+
+        :param command: parsed command
+        :param error: why the command is invalid, None if it is valid
+        :return: True if the next cycle is due at a different time now
+        """
+
+        if error is None and command[COMMAND] == COMMAND_DUTY_CYCLES \
+                and command[COMMAND_VALUES][0] != self.pwm_duty_cycles[0]:
+            # Processing takes the dark measurement of all rows of a run at the same duty power
+            error = f"The dark duty power {self.pwm_duty_cycles[0]} can't change while running"
+        record = dict(command)
+        record[COMMAND_TIME] = self.get_time_stamp()
+        record[COMMAND_OK] = error is None
+        if error is not None:
+            record[COMMAND_ERROR] = error
+            self.save_result(header_line(HEADER_COMMAND, record))
+            return False
+        name = command[COMMAND]
+        if name == COMMAND_STATS:
+            try:
+                mem_free = gc.mem_free()
+            except AttributeError:
+                # Not available in CPython
+                mem_free = None
+            record[COMMAND_STATS] = {
+                'cycles': self.cycles,
+                'last_cycle_seconds': round(self.last_cycle_seconds, 2),
+                'predicted_cycle_seconds': round(self.predicted_cycle_seconds, 2),
+                'excluded_channels': [ch for ch in self.keys_by_channel if self.health.is_failing(ch)]
+                if self.exclude_failing_channels else [],
+                'file_writable': self.file_writable,
+                'mem_free': mem_free,
+                'profile': self.profile(),
+            }
+        # Recorded before it takes effect, so rows of a blank or with new settings follow their command
+        self.save_result(header_line(HEADER_COMMAND, record))
+        if name == COMMAND_INTERVAL:
+            self.measurement_frequency_seconds = command[COMMAND_SECONDS]
+            # Readers take the settings of the rows that follow from the latest profile line
+            self.save_result(header_line(HEADER_PROFILE, self.profile()))
+            return True
+        if name == COMMAND_DUTY_CYCLES:
+            self.pwm_duty_cycles = command[COMMAND_VALUES]
+            self.health.bright_intensity = max(self.pwm_duty_cycles)
+            self.plan_cycle()
+            self.save_result(header_line(HEADER_PROFILE, self.profile()))
+            return False
+        if name == COMMAND_BLANK:
+            self.blank_now = True
+        if name in (COMMAND_MEASURE, COMMAND_BLANK):
+            self.measure_now = True
+            return True
+        return False
+
     def main_loop(self) -> None:
         """ Main function loop
 
@@ -474,13 +1278,19 @@ class Photometer:
                     if has_time_passed:
                         break
                     # Count down in minutes so we can see progress on StdOut
-                    time.sleep(int(min(current_timedelta, 60)))
+                    self.wait_for_commands(int(min(current_timedelta, 60)))
                     # Could replace with machine.idle() / .lightsleep(), might need different data recording method
 
                 # Measure
                 self.working_led.on()
-                self.measure_pwm_duty_cycles()
+                self.profiler.start_cycle()
+                if self.blank_now:
+                    self.blank_now = False
+                    self.perform_blank()
+                else:
+                    self.measure_pwm_duty_cycles()
                 self.working_led.off()
+                self.save_timing()
         # except KeyboardInterrupt:
         #     pass
         except Exception as ex:
@@ -500,17 +1310,24 @@ class Photometer:
 
 if __name__ == "__main__":
     print(os.getcwd())
+    # Settings come from profile.json in the mounted folder if present, from Photometer.constants otherwise
+    try:
+        run_profile = load_profile(PROFILE_FILE_PATH)
+        print(f"Using run profile {run_profile[PROFILE_NAME]} from {PROFILE_FILE_PATH}")
+    except OSError:
+        run_profile = load_profile()
     photometer = Photometer(
-        measurement_led_warmup_seconds=MEASUREMENT_LED_WARMUP_SECONDS,
-        measurement_repeat_interval_seconds=MEASUREMENT_REPEAT_INTERVAL_SECONDS,
-        measurement_repeats=MEASUREMENT_REPEATS,
-        measurement_frequency_seconds=MEASUREMENT_FREQUENCY_SECONDS,
-        resistor_led_gpio_pairs=None,
+        profile_name=run_profile[PROFILE_NAME],
         working_led=WORKING_INDICATOR_LED,
+        profile_timing=PROFILE_TIMING,
+        **profile_settings(run_profile),
     )
     try:
-        photometer.perform_self_test()
-        photometer.main_loop()
+        self_test = photometer.perform_self_test()
+        if SELF_TEST_REQUIRED and not self_test[REPORT_PASSED]:
+            print("Self-test failed, not starting measurements")
+        else:
+            photometer.main_loop()
     except KeyboardInterrupt:
         print("Keyboard Interrupt")
     finally:
@@ -0,0 +1,56 @@
+""" Calibration model fits and the weighting of intensities shared with fusion. """
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Photometer.constants import (
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.calibration import (
+    fit_calibration,
+    combine_intensities,
+    SIGNAL,
+    REFERENCE_OD,
+    RESIDUAL_STD,
+    POINTS,
+)
+from Photometer.fusion import (
+    fuse_measurements,
+    fuse_intensities,
+    OD_ESTIMATE,
+    FUSION_WEIGHT,
+    FUSED_OD,
+    FUSED_OD_STD,
+)
+from Photometer.processing import read_measurements
+from Photometer.synthetic import write_synthetic_run
+
+
+def test_models_need_a_residual():
+    pairs = pd.DataFrame({
+        CHANNEL: [0] * 4 + [1] * 2,
+        INTENSITY: 9000,
+        SIGNAL: [.1, .2, .3, .4, .1, .2],
+        REFERENCE_OD: [.11, .19, .32, .4, .1, .2],
+    })
+    models = fit_calibration(pairs)
+    # Two points fit exactly, no residual to weight the model by
+    assert list(models.index.get_level_values(CHANNEL)) == [0]
+    assert models[POINTS].iloc[0] == 4
+    assert np.isfinite(models[RESIDUAL_STD]).all()
+
+    with pytest.raises(ValueError):
+        fit_calibration(pairs, min_points=2)
+
+
+def test_fusion_weights_intensities_like_calibration(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=3, days=1)
+    df = fuse_measurements(read_measurements(file_path))
+
+    fused = fuse_intensities(df)
+    combined = combine_intensities(df, column=OD_ESTIMATE, weight_column=FUSION_WEIGHT)
+    np.testing.assert_array_equal(fused[FUSED_OD].to_numpy(), combined[OD_ESTIMATE].to_numpy())
+    assert fused[FUSED_OD_STD].notna().any()
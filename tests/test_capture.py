@@ -0,0 +1,32 @@
+""" Capture planning and buffer bounds of the sample capture backends. """
+
+import pytest
+
+from Photometer.capture import (
+    capture_plan,
+    SimulatedCapture,
+    CAPTURE_RATE,
+    CAPTURE_MAX_SAMPLES,
+)
+
+
+@pytest.mark.parametrize('window_us', [50000, 81920, 200000, 1000000])
+def test_capture_spans_whole_window(window_us):
+    rate, samples = capture_plan(window_us)
+    assert rate <= CAPTURE_RATE
+    assert samples <= CAPTURE_MAX_SAMPLES
+    # Short of the window by less than one sample period
+    assert 0 <= window_us - samples * 1000000 / rate < 1000000 / rate
+
+
+def test_window_fitting_the_buffer_keeps_the_rate():
+    assert capture_plan(50000) == (CAPTURE_RATE, 5000)
+
+
+def test_capture_longer_than_buffer_raises():
+    capture = SimulatedCapture(lambda: 0)
+    with pytest.raises(ValueError):
+        capture.start(CAPTURE_MAX_SAMPLES + 1)
+    samples = capture.fit_window(200000)
+    capture.start(samples)
+    assert len(capture.wait()) == samples
@@ -0,0 +1,38 @@
+""" The device side code compiles with the MicroPython cross compiler (pip install mpy-cross), skipped without it. """
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('mpy_cross')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRMWARE = 'pico_photometer.py'
+# Module level imports, host only code imports within its functions
+IMPORT = re.compile(r'^(?:from (Photometer\.\w+) import|import (Photometer\.\w+))', re.MULTILINE)
+
+
+def device_modules() -> list[str]:
+    """ The firmware and the Photometer modules it imports at module level, directly or through other modules """
+
+    modules = [FIRMWARE]
+    for path in modules:
+        with open(os.path.join(ROOT, path)) as f:
+            for names in IMPORT.findall(f.read()):
+                module = f"{(names[0] or names[1]).replace('.', '/')}.py"
+                if module not in modules:
+                    modules.append(module)
+    return modules
+
+
+@pytest.mark.parametrize('path', device_modules())
+def test_compiles_for_micropython(path, tmp_path):
+    result = subprocess.run(
+        [sys.executable, '-m', 'mpy_cross', '-o', str(tmp_path / 'out.mpy'), os.path.join(ROOT, path)],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
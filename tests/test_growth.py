@@ -0,0 +1,55 @@
+""" Growth features against the ground truth of synthetic runs. """
+
+import numpy as np
+import pytest
+
+from Photometer.fusion import fuse_measurements
+from Photometer.growth import (
+    estimate_inoculum,
+    growth_features,
+    _pivot_series,
+    MU_MAX,
+    LAG_TIME,
+    PLATEAU_OD,
+)
+from Photometer.processing import (
+    read_measurements,
+    run_duty_cycles,
+)
+from Photometer.synthetic import (
+    write_synthetic_run,
+    GROWTH_RATE,
+    LAG_HOURS,
+    PLATEAU_OD as TRUE_PLATEAU_OD,
+    START_OD,
+)
+
+
+@pytest.mark.parametrize('start_od', [START_OD, .03, .1])
+def test_growth_features_match_synthetic_run(tmp_path, start_od):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=6, days=3, start_od=start_od)
+    features = growth_features(read_measurements(file_path))
+
+    for (channel, _), row in features.iterrows():
+        if channel % 3 == 0:
+            # Blank channels don't grow
+            assert np.isnan(row[MU_MAX])
+            continue
+        assert abs(row[MU_MAX] - GROWTH_RATE) < .25 * GROWTH_RATE
+        assert abs(row[LAG_TIME] - (LAG_HOURS + channel)) < 1.5
+        assert abs(row[PLATEAU_OD] - TRUE_PLATEAU_OD) < .1 * TRUE_PLATEAU_OD
+
+
+@pytest.mark.parametrize('start_od', [.005, .03, .1])
+def test_inoculum_estimated_from_growth(tmp_path, start_od):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=6, days=3, start_od=start_od)
+    df = read_measurements(file_path)
+    times, ods, columns = _pivot_series(fuse_measurements(df), run_duty_cycles(df)[1:])
+    inoculum = estimate_inoculum(times, ods)
+
+    growing = columns.get_level_values(0) % 3 != 0
+    # Blank channels don't grow, there is nothing to estimate from
+    assert np.isnan(inoculum[~growing]).all()
+    assert abs(np.median(inoculum[growing]) - start_od) < .2 * start_od
@@ -0,0 +1,65 @@
+""" Exclusion and recovery of failing channels. """
+
+from Photometer.health import (
+    HealthMonitor,
+    PROBE_CYCLES,
+    STUCK_ROWS,
+    MIN_CONTRAST,
+    CONTRAST_CYCLES,
+    ALERT_CONTRAST,
+    ALERT_KIND,
+    ALERT_ACTIVE,
+)
+
+DARK, BRIGHT = 0, 65535
+GOOD = {DARK: [20000, 20011, 19995], BRIGHT: [40000, 40020, 39990]}
+STUCK = {DARK: [20000] * 3, BRIGHT: [20000] * 3}
+
+
+def measure_cycle(monitor, channel, readings):
+    alerts = []
+    for intensity in (DARK, BRIGHT):
+        alerts += monitor.update(0, channel, intensity, readings[intensity])
+    return alerts
+
+
+def test_excluded_channel_is_probed_and_recovers():
+    monitor = HealthMonitor(dark_intensity=DARK, bright_intensity=BRIGHT)
+    for _ in range(STUCK_ROWS):
+        measure_cycle(monitor, 0, STUCK)
+    assert monitor.is_failing(0)
+
+    measured = []
+    for cycle in range(3 * PROBE_CYCLES + 4):
+        if not monitor.skip_cycle(0):
+            measured.append(cycle)
+            measure_cycle(monitor, 0, STUCK)
+    # Probed after PROBE_CYCLES skipped cycles, then backing off
+    assert measured == [PROBE_CYCLES, 3 * PROBE_CYCLES + 1]
+    assert monitor.is_failing(0)
+
+    while monitor.skip_cycle(0):
+        pass
+    alerts = measure_cycle(monitor, 0, GOOD)
+    # Stuck and contrast alerts cleared, no spread alert from the stuck rows
+    assert alerts and not any(alert[ALERT_ACTIVE] for alert in alerts)
+    assert not monitor.is_failing(0)
+    assert not monitor.skip_cycle(0)
+
+
+def test_dense_culture_keeps_contrast_check_passing():
+    monitor = HealthMonitor(dark_intensity=DARK, bright_intensity=BRIGHT)
+    alerts = []
+    # Culture absorbing more light every cycle until barely any reaches the photoresistor
+    for cycle in range(40):
+        bright = 20000 + int(20000 * .85 ** cycle)
+        alerts += measure_cycle(monitor, 0, {DARK: [20000, 20011, 19995], BRIGHT: [bright, bright + 9, bright - 7]})
+    assert 20000 + 20000 * .85 ** 39 - 20000 < MIN_CONTRAST
+    assert not alerts
+    assert not monitor.is_failing(0)
+
+    # LED failing later still loses the contrast from one cycle to the next
+    for _ in range(CONTRAST_CYCLES):
+        alerts += measure_cycle(monitor, 0, {DARK: [20000, 20011, 19995], BRIGHT: [20003, 19990, 20008]})
+    assert [(alert[ALERT_KIND], alert[ALERT_ACTIVE]) for alert in alerts] == [(ALERT_CONTRAST, True)]
+    assert monitor.is_failing(0)
@@ -0,0 +1,86 @@
+""" Series grouping and style presets of the figure scripts. """
+
+import importlib
+import shutil
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from Photometer.constants import (
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.plotting import (
+    style_context,
+    iter_series,
+    STYLES,
+    STYLE_PAPER,
+)
+from Photometer.processing import (
+    read_measurements,
+    repeat_columns,
+    MEDIAN,
+)
+from Photometer.synthetic import write_synthetic_run
+
+matplotlib.use('Agg')
+
+
+def test_iter_series_matches_masking():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        DATE: np.arange(60),
+        CHANNEL: rng.integers(0, 4, 60),
+        INTENSITY: rng.choice([0, 100, 200], 60),
+    })
+    channels = [3, 1, 7]
+    intensities = [200, 100]
+    series = list(iter_series(df, channels=channels, intensities=intensities))
+
+    expected = [
+        (ch, intensity, df.loc[(df[CHANNEL] == ch) & (df[INTENSITY] == intensity)])
+        for ch in channels for intensity in intensities
+        if ((df[CHANNEL] == ch) & (df[INTENSITY] == intensity)).any()
+    ]
+    assert [(ch, intensity) for ch, intensity, _ in series] == [(ch, intensity) for ch, intensity, _ in expected]
+    for (_, _, got), (_, _, want) in zip(series, expected):
+        pd.testing.assert_frame_equal(got, want)
+
+
+def test_style_context_restores_settings():
+    before = dict(matplotlib.rcParams)
+    with style_context(STYLE_PAPER) as style:
+        assert style is STYLES[STYLE_PAPER]
+        assert dict(matplotlib.rcParams) != before
+    assert dict(matplotlib.rcParams) == before
+    with pytest.raises(ValueError):
+        with style_context('unknown'):
+            pass
+
+
+def test_apo_figure_processing(tmp_path):
+    apo_figure = importlib.import_module('20241104_APO_Fig')
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=8, days=1, measurement_frequency_seconds=300)
+    df = apo_figure.process_figure(read_measurements(file_path))
+    assert df[MEDIAN].notna().any()
+
+    # Unparseable files draw nothing: a row with more readings than the run layout
+    row = '\t'.join(['20241030-161800', '1', '9', '0'] + ['100'] * len(repeat_columns(df)))
+    broken_path = tmp_path / 'broken.csv'
+    broken_path.write_text(f"{row}\n{row}\t100\n")
+    assert apo_figure.make_figure(str(broken_path), image_file_path=str(tmp_path / 'none.png')) is None
+    assert not (tmp_path / 'none.png').exists()
+
+
+@pytest.mark.skipif(shutil.which('latex') is None, reason="the paper style renders text with LaTeX")
+def test_apo_figure_drawing(tmp_path):
+    apo_figure = importlib.import_module('20241104_APO_Fig')
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=8, days=1, measurement_frequency_seconds=300)
+    image_path = tmp_path / 'apo.png'
+    apo_figure.make_figure(file_path, image_file_path=str(image_path))
+    assert image_path.exists()
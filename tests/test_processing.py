@@ -0,0 +1,129 @@
+""" Processing steps against the per series loops create_figure used before they were factored out. """
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import median_filter
+
+from Photometer.chunked import read_processed
+from Photometer.constants import (
+    MAX_U16,
+    DATE,
+    CHANNEL,
+    INTENSITY,
+)
+from Photometer.header import (
+    header_line,
+    HEADER_PROFILE,
+    HEADER_COMMAND,
+    HEADER_BLANK,
+    BLANK_TIME,
+    BLANK_READINGS,
+)
+from Photometer.processing import (
+    read_measurements,
+    run_duty_cycles,
+    repeat_columns,
+    epoch_seconds,
+    blank_values,
+    process_measurements,
+    MEDIAN,
+    FULLY_DARK,
+)
+from Photometer.synthetic import write_synthetic_run
+
+
+def reference_processing(df: pd.DataFrame) -> pd.DataFrame:
+    """ Processing as create_figure did it, one masked series at a time """
+
+    df = df.copy()
+    pwm_duty_cycles = run_duty_cycles(df)
+    seconds = epoch_seconds(df[DATE])
+    df[DATE] = (seconds - seconds.min()) / 3600
+    df['med'] = MAX_U16 - df[repeat_columns(df)].median(axis=1)
+    df['fully_dark'] = df.loc[(df[INTENSITY] == pwm_duty_cycles[0]), 'med']
+    df['fully_dark'] = df['fully_dark'].ffill()
+    for intensity_select in pwm_duty_cycles[1:]:
+        for ch in df[CHANNEL].unique():
+            selected = (df[INTENSITY] == intensity_select) & (df[CHANNEL] == ch)
+            median_window = 5
+            if df.loc[selected, 'med'].size > median_window:
+                df.loc[selected, 'med'] = median_filter(df.loc[selected]['med'], size=median_window, mode='nearest')
+            if any(df[DATE] > 10):
+                df.loc[selected, 'med'] = df.loc[selected, 'med'] - \
+                    df.loc[selected & (df[DATE] < 10) & (df[DATE] > 1), 'med'].quantile(.01)
+    df['med'] = (df['med'] / df['fully_dark']) * 2.5
+    return df
+
+
+def test_process_measurements_matches_per_series_loops(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=4, days=1, measurement_frequency_seconds=300)
+    df = read_measurements(file_path)
+    expected = reference_processing(df)
+    processed = process_measurements(df)
+
+    lit = processed[INTENSITY].isin(run_duty_cycles(df)[1:])
+    assert lit.any()
+    np.testing.assert_allclose(processed[DATE], expected[DATE])
+    np.testing.assert_allclose(processed[FULLY_DARK], expected['fully_dark'])
+    np.testing.assert_allclose(processed.loc[lit, MEDIAN], expected.loc[lit, 'med'])
+    # The input frame is left as read
+    assert MEDIAN not in df.columns
+
+
+def write_changed_run(file_path: str, tmp_path) -> None:
+    """ Synthetic run whose duty powers are changed by a command after a day """
+
+    write_synthetic_run(file_path, channels=2, pwm_duty_cycles=[0, 16383, 65535], days=1,
+                        measurement_frequency_seconds=600)
+    later_path = str(tmp_path / 'later_output.csv')
+    write_synthetic_run(later_path, channels=2, pwm_duty_cycles=[0, 40000], days=1,
+                        measurement_frequency_seconds=600, start=datetime(2024, 10, 31, 16, 18))
+    with open(later_path) as f:
+        lines = f.readlines()
+    with open(file_path, 'a') as f:
+        f.write(header_line(HEADER_COMMAND, {'command': 'duty_cycles', 'values': [0, 40000]}) + '\n')
+        f.writelines(line for line in lines if line.startswith(f"#{HEADER_PROFILE}") or not line.startswith('#'))
+
+
+def test_duty_cycles_changed_while_running(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_changed_run(file_path, tmp_path)
+    df = read_measurements(file_path)
+    assert run_duty_cycles(df) == [0, 16383, 65535, 40000]
+
+    processed = process_measurements(df)
+    counts = processed.groupby([CHANNEL, INTENSITY])[MEDIAN].count()
+    assert (counts.xs(40000, level=INTENSITY) > 0).all()
+    assert (counts.xs(16383, level=INTENSITY) > 0).all()
+    chunked = read_processed(file_path, chunk_rows=100)
+    np.testing.assert_allclose(chunked[MEDIAN], processed[MEDIAN])
+
+
+def test_blank_is_baseline(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=4, days=1, measurement_frequency_seconds=600)
+    df = read_measurements(file_path)
+    assert blank_values(df) is None
+    # Blank of the first cycle, as the firmware writes it after the rows
+    first = df.groupby([CHANNEL, INTENSITY], sort=False).head(1)
+    readings = [[int(ch), int(intensity), float(median)] for ch, intensity, median in
+                zip(first[CHANNEL], first[INTENSITY], first[repeat_columns(df)].median(axis=1))]
+    with open(file_path, 'a') as f:
+        f.write(header_line(HEADER_BLANK, {BLANK_TIME: 0, BLANK_READINGS: readings}) + '\n')
+
+    df = read_measurements(file_path)
+    blank = blank_values(df)
+    lit = run_duty_cycles(df)[1:]
+    assert len(blank) == 4 * len(lit)
+    assert blank[readings[1][0], readings[1][1]] == MAX_U16 - readings[1][2]
+
+    processed = process_measurements(df)
+    series = processed.loc[processed[INTENSITY].isin(lit)].groupby(CHANNEL)[MEDIAN]
+    # Channel 0 stays blank, channel 1 grows
+    assert series.apply(lambda s: s.abs().median())[0] < .005
+    assert series.last()[1] > .1
+    chunked = read_processed(file_path, chunk_rows=100)
+    np.testing.assert_allclose(chunked[MEDIAN], processed[MEDIAN])
@@ -0,0 +1,122 @@
+""" Plotted levels of a run still being written, updated from the appended rows only. """
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Photometer.chunked import LiveProcessor, ChunkProcessor
+from Photometer.constants import (
+    DATE,
+    INTENSITY,
+)
+from Photometer.header import HEADER_PROFILE
+from Photometer.processing import (
+    read_measurements,
+    process_measurements,
+    run_duty_cycles,
+    MEDIAN,
+)
+from Photometer.pyramid import SeriesPyramid
+from Photometer.synthetic import write_synthetic_run
+
+CHANNELS = 2
+INTENSITIES = 5
+
+
+def split_run(file_path: str, growing_path: str, held_back_cycles: int) -> list[list[str]]:
+    """ Write all but the last cycles of a run to growing_path, return the held back cycles as lines """
+
+    with open(file_path) as f:
+        lines = f.readlines()
+    cycle_rows = CHANNELS * INTENSITIES
+    held_back = held_back_cycles * cycle_rows
+    with open(growing_path, 'w') as f:
+        f.writelines(lines[:len(lines) - held_back])
+    return [lines[start:start + cycle_rows] for start in range(len(lines) - held_back, len(lines), cycle_rows)]
+
+
+def lit(df: pd.DataFrame | None, pwm_duty_cycles: list[int]) -> pd.DataFrame | None:
+    return None if df is None else df.loc[df[INTENSITY].isin(pwm_duty_cycles[1:])]
+
+
+def test_live_processing_matches_whole_file(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    growing_path = str(tmp_path / 'growing_output.csv')
+    write_synthetic_run(file_path, channels=CHANNELS, days=1, measurement_frequency_seconds=600)
+    cycles = split_run(file_path, growing_path, held_back_cycles=20)
+
+    live = LiveProcessor(growing_path)
+    pyramid = SeriesPyramid()
+    final = []
+    for cycle in [[]] + cycles:
+        with open(growing_path, 'a') as f:
+            # A line the firmware is still writing is left for the next update
+            f.writelines(cycle[:-1])
+            f.write(cycle[-1][:10] if cycle else '')
+        df_final, df_tail, restarted = live.update()
+        assert restarted == (not final)
+        final.append(df_final)
+        with open(growing_path, 'a') as f:
+            f.write(cycle[-1][10:] if cycle else '')
+        pwm_duty_cycles = live.pwm_duty_cycles
+        pyramid.extend(lit(df_final, pwm_duty_cycles), column=MEDIAN, tail=lit(df_tail, pwm_duty_cycles))
+    df_final, df_tail, restarted = live.update()
+    pyramid.extend(lit(df_final, pwm_duty_cycles), column=MEDIAN, tail=lit(df_tail, pwm_duty_cycles))
+    live.close()
+
+    df = read_measurements(file_path)
+    processed = process_measurements(df)
+    followed = pd.concat(final + [df_final, df_tail])
+    np.testing.assert_allclose(followed[DATE], processed[DATE])
+    np.testing.assert_allclose(followed[MEDIAN], processed[MEDIAN])
+
+    expected = SeriesPyramid()
+    expected.update(lit(processed, run_duty_cycles(df)), column=MEDIAN)
+    for hours, level in expected.levels.items():
+        np.testing.assert_allclose(pyramid.levels[hours].frame().to_numpy(float), level.frame().to_numpy(float))
+
+
+def test_live_restarts_on_changed_profile(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_synthetic_run(file_path, channels=CHANNELS, days=1, measurement_frequency_seconds=600)
+    live = LiveProcessor(file_path)
+    live.update()
+
+    with open(file_path) as f:
+        profile = next(line for line in f if line.startswith(f"#{HEADER_PROFILE}"))
+    with open(file_path, 'a') as f:
+        f.write(profile)
+    assert live.update()[2]
+    assert not live.update()[2]
+    live.close()
+
+
+@pytest.mark.parametrize('days', [1, 7])
+def test_redraw_work_independent_of_run_length(tmp_path, monkeypatch, days):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    growing_path = str(tmp_path / 'growing_output.csv')
+    write_synthetic_run(file_path, channels=CHANNELS, days=days)
+    cycles = split_run(file_path, growing_path, held_back_cycles=1)
+    live = LiveProcessor(growing_path)
+    pyramid = SeriesPyramid()
+    df_final, df_tail, _ = live.update()
+    pyramid.extend(df_final, column=MEDIAN, tail=df_tail)
+
+    processed_rows = []
+    add = ChunkProcessor.add
+
+    def counting_add(self, df):
+        processed_rows.append(len(df))
+        return add(self, df)
+
+    monkeypatch.setattr(ChunkProcessor, 'add', counting_add)
+    with open(growing_path, 'a') as f:
+        f.writelines(cycles[0])
+    df_final, df_tail, restarted = live.update()
+    changed_from = pyramid.extend(df_final, column=MEDIAN, tail=df_tail)
+    live.close()
+
+    # Only the appended cycle is read and processed, bins are recomputed from the provisional rows on
+    assert not restarted
+    assert sum(processed_rows) == CHANNELS * INTENSITIES
+    assert changed_from >= pyramid.rows[DATE][-1] - 1
@@ -0,0 +1,41 @@
+""" Crosstalk matrix and schedule from simulated calibration reads. """
+
+import random
+
+from Photometer.schedule import (
+    crosstalk_matrix,
+    interfering,
+    plan_schedule,
+)
+from Photometer.self_test import SELF_TEST_READS
+
+DARK = 15000
+SIGNAL = 30000
+# Per reading noise of the synthetic model (Photometer.synthetic.READING_NOISE)
+NOISE = 50
+NEIGHBOUR_CROSSTALK = .02
+
+
+def simulated_reads(channels, seed=0):
+    rng = random.Random(seed)
+
+    def reads(light):
+        return [int(DARK + light + rng.gauss(0, NOISE)) for _ in range(SELF_TEST_READS)]
+
+    dark_readings = {ch: reads(0) for ch in channels}
+    lit_readings = {
+        led: {ch: reads(SIGNAL if ch == led else SIGNAL * NEIGHBOUR_CROSSTALK if abs(ch - led) == 1 else 0)
+              for ch in channels}
+        for led in channels
+    }
+    return dark_readings, lit_readings
+
+
+def test_noise_is_not_crosstalk():
+    channels = list(range(8))
+    matrix = crosstalk_matrix(*simulated_reads(channels))
+    conflicts = interfering(channels, crosstalk=matrix)
+    for ch in channels:
+        assert conflicts[ch] == {c for c in (ch - 1, ch + 1) if c in channels}
+    # Neighbours apart: two groups, dark step plus one step per group and lit duty power
+    assert len(plan_schedule(channels, [0, 32767, 65535], conflicts=conflicts)) == 1 + 2 * 2
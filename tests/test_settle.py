@@ -0,0 +1,51 @@
+""" Settle detection with a tolerance following the read noise. """
+
+import random
+
+from Photometer.settle import (
+    SettleDetector,
+    settle_tolerance,
+    update_noise,
+    SETTLE_TOLERANCE,
+    SETTLE_MIN_TOLERANCE,
+    SETTLE_NOISE_MULTIPLE,
+)
+
+
+def settle(detector, readings):
+    for index, reading in enumerate(readings):
+        if detector.add(reading):
+            return index
+    return None
+
+
+def test_noise_estimate_ignores_drift():
+    rng = random.Random(0)
+    noise = None
+    for _ in range(200):
+        detector = SettleDetector()
+        settle(detector, [20000 + 50 * i + rng.gauss(0, 40) for i in range(5)])
+        noise = update_noise(noise, detector.noise())
+    assert 30 < noise < 50
+
+
+def test_noisy_channel_settles_with_measured_noise():
+    rng = random.Random(1)
+    # Exponential approach to the settled value, then read noise alone
+    readings = [30000 - 10000 * .5 ** i + rng.gauss(0, 150) for i in range(100)]
+
+    assert settle(SettleDetector(tolerance=SETTLE_TOLERANCE), readings) is None
+    noise = None
+    for start in range(40, 95):
+        detector = SettleDetector()
+        settle(detector, readings[start:start + 5])
+        noise = update_noise(noise, detector.noise())
+    settled_at = settle(SettleDetector(tolerance=settle_tolerance(noise)), readings)
+    # Not before the photoresistor settled
+    assert settled_at is not None and 5 <= settled_at < 40
+
+
+def test_tolerance_bounds():
+    assert settle_tolerance(None) == SETTLE_TOLERANCE
+    assert settle_tolerance(0) == SETTLE_MIN_TOLERANCE
+    assert settle_tolerance(100) == SETTLE_NOISE_MULTIPLE * 100
@@ -0,0 +1,76 @@
+""" Change watching of the measurement store. """
+
+import json
+
+from Photometer.files import cycle_settle_seconds, SETTLE_SECONDS
+from Photometer.constants import MAX_U16
+from Photometer.header import (
+    result_schema,
+    HEADER_SCHEMA,
+    HEADER_PROFILE,
+    HEADER_BLANK,
+    BLANK_TIME,
+    BLANK_READINGS,
+)
+from Photometer.processing import read_measurements, run_duty_cycles, blank_values
+from Photometer.profile import default_profile, PROFILE_REPEATS
+from Photometer.store import MeasurementStore, _DataVersionSource, run_settle_seconds
+
+from test_processing import write_changed_run
+
+ROW = ['1730305080', '3', '27', '32767', '100', '101', '102']
+
+
+def test_commits_of_another_connection_are_seen(tmp_path):
+    file_path = str(tmp_path / 'measurements.sqlite')
+    with MeasurementStore(file_path) as store:
+        source = _DataVersionSource(file_path, poll_seconds=.01)
+        try:
+            assert not source.wait(.05)
+            run = store.open_run('run', {}, ROW)
+            assert source.wait(1)
+            store.add_row(run, ROW)
+            # Pending rows aren't committed yet
+            assert not source.wait(.05)
+            store.flush()
+            assert source.wait(1)
+        finally:
+            source.close()
+
+
+def test_settle_time_follows_run_profile(tmp_path):
+    file_path = str(tmp_path / 'measurements.sqlite')
+    profile = {PROFILE_REPEATS: 50}
+    with MeasurementStore(file_path) as store:
+        assert run_settle_seconds(store.connection, 'run') == SETTLE_SECONDS
+        store.open_run('run', {HEADER_PROFILE: profile}, ROW[:4] + ['100'] * 50)
+        expected = default_profile()
+        expected.update(profile)
+        assert run_settle_seconds(store.connection, 'run') == cycle_settle_seconds(expected)
+        assert run_settle_seconds(store.connection, 'run') > SETTLE_SECONDS
+        assert json.loads(store.connection.execute('SELECT header FROM runs').fetchone()[0]) == \
+            {HEADER_PROFILE: profile}
+
+
+def test_profile_changed_while_running(tmp_path):
+    file_path = str(tmp_path / 'synthetic_output.csv')
+    write_changed_run(file_path, tmp_path)
+    with MeasurementStore(str(tmp_path / 'measurements.sqlite')) as store:
+        store.import_file(file_path, name='run')
+        df = store.read_run('run')
+    assert run_duty_cycles(df) == [0, 16383, 65535, 40000]
+    assert run_duty_cycles(df) == run_duty_cycles(read_measurements(file_path))
+
+
+def test_blank_written_between_rows(tmp_path):
+    file_path = str(tmp_path / 'measurements.sqlite')
+    blank = {BLANK_TIME: 1730305090, BLANK_READINGS: [[3, 32767, 101.0]]}
+    with MeasurementStore(file_path) as store:
+        store.header('pico', HEADER_SCHEMA, result_schema(3, epoch_timestamps=True))
+        store.row('pico', ROW)
+        store.header('pico', HEADER_BLANK, blank)
+        store.row('pico', ROW)
+        store.flush()
+        df = store.read_run('pico')
+    assert len(df) == 2
+    assert blank_values(df)[3, 32767] == MAX_U16 - 101
@@ -0,0 +1,55 @@
+""" Compact result streams: file and serial link round trips through the host decoder. """
+
+import numpy as np
+
+from Photometer.constants import SEPERATOR
+from Photometer.decode import StreamDecoder, open_result
+from Photometer.fleet import Ingestor
+from Photometer.stream import StreamEncoder, frame_line, FRAME_LINE_PREFIX
+
+HEADER = '#start\t"20241030-161800"'
+
+
+def synthetic_rows(cycles: int = 40) -> list[tuple]:
+    rng = np.random.default_rng(0)
+    return [
+        (1730305080 + 60 * cycle, channel, channel + 8, duty,
+         [int(i) for i in 20000 + duty // 4 + rng.integers(-20, 20, 11)])
+        for cycle in range(cycles) for channel in range(4) for duty in (0, 9000, 65535)
+    ]
+
+
+def row_line(row: tuple) -> str:
+    return SEPERATOR.join(str(i) for i in list(row[:4]) + row[4])
+
+
+def test_file_round_trip(tmp_path):
+    rows = synthetic_rows()
+    encoder = StreamEncoder()
+    file_path = tmp_path / 'output.pms'
+    with open(file_path, 'wb') as f:
+        f.write(encoder.text(HEADER))
+        for row in rows:
+            f.write(encoder.row(*row))
+    with open_result(str(file_path)) as f:
+        lines = [line.rstrip('\n') for line in f]
+    assert lines == [HEADER] + [row_line(row) for row in rows]
+
+
+def test_printed_frames_are_compact_and_ingested():
+    rows = synthetic_rows()
+    encoder = StreamEncoder()
+    printed = [frame_line(encoder.row(*row)) for row in rows]
+    assert all(line.startswith(FRAME_LINE_PREFIX) and '\n' not in line for line in printed)
+    assert sum(map(len, printed)) < .5 * sum(len(row_line(row)) for row in rows)
+
+    decoder = StreamDecoder()
+    assert [line for frame in printed for line in decoder.feed_line(frame)] == [row_line(row) for row in rows]
+    assert decoder.feed_line(FRAME_LINE_PREFIX + '#?') == []
+
+    ingested = []
+    ingestor = Ingestor(settle_seconds=1, render=False)
+    ingestor.add_consumer(lambda name, fields: ingested.append(SEPERATOR.join(fields)))
+    for line in printed:
+        ingestor.ingest('pico', '/remote', line)
+    assert ingested == [row_line(row) for row in rows]